@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+
+"""
+Benchmark routing by segment against trying each of the server's regexes
+in turn, as Brubeck does, for each kind of request.
+
+python bench/bench_routing.py
+"""
+
+import sys
+import os
+import re
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from caustic.routing import SegmentRouter
+
+V_C = r'\w\-'
+ROUTES = [
+    ('/', 'IndexHandler'),
+    ('/:user', 'UserHandler'),
+    ('/:user/instructions', 'InstructionCollectionHandler'),
+    ('/:user/instructions/:name', 'InstructionModelHandler'),
+    ('/:user/tagged/:tag', 'TagCollectionHandler')]
+
+REQUESTS = [
+    ('index', '/'),
+    ('user', '/openscrape/'),
+    ('collection', '/openscrape/instructions'),
+    ('instruction', '/openscrape/instructions/nyc-property-owner'),
+    ('tagged', '/openscrape/tagged/nyc'),
+    ('not found', '/openscrape/elsewhere/nyc')]
+
+
+def regex_router(routes):
+    """What Brubeck's `route_message` does.
+    """
+    compiled = [(re.compile(regex), handler) for regex, handler in routes]
+
+    def route(path):
+        for regex, handler in compiled:
+            m = regex.match(path)
+            if m:
+                return handler, m.groupdict() or m.groups() or []
+    return route
+
+
+if __name__ == '__main__':
+    router = SegmentRouter(V_C)
+    for pattern, handler in ROUTES:
+        router.add(pattern, handler)
+    by_regex = regex_router([(router.regex(p), h) for p, h in ROUTES])
+
+    number = 100000
+    for label, path in REQUESTS:
+        for name, fn in [('regexes', by_regex), ('segments', router._route),
+                         ('memoised', router.match)]:
+            secs = min(timeit.repeat(lambda: fn(path), number=number, repeat=3))
+            print '%-12s %-9s %8.3f us/route' % (label, name,
+                                                 secs * 1e6 / number)
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+
+"""
+Benchmark the compiled instruction validator against the three validictory
+passes `InstructionField.validate` used to make.
+
+python bench/bench_validator.py [DEPTH] [WIDTH]
+"""
+
+import sys
+import os
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import validictory
+from caustic import schema
+from caustic.validator import validate_instruction, InstructionError
+
+
+def three_pass(value):
+    """What `InstructionField.validate` used to do.
+    """
+    try:
+        validictory.validate(value, schema.INSTRUCTION)
+    except ValueError as instruction_err:
+        errors = []
+        try:
+            validictory.validate(value, schema.FIND)
+        except ValueError as find_err:
+            errors.append(find_err)
+        try:
+            validictory.validate(value, schema.LOAD)
+        except ValueError as load_err:
+            errors.append(load_err)
+        return "Invalid Instruction: %s" % (errors or [instruction_err])
+
+
+def compiled(value):
+    try:
+        validate_instruction(value)
+    except InstructionError as err:
+        return str(err)
+
+
+def tree(depth, width):
+    """A `then` tree alternating between finds and loads, with path
+    references at the leaves.
+    """
+    if depth == 0:
+        return '/leaf'
+    if depth % 2:
+        node = {'find': '<td>(.*?)</td>', 'replace': '$1', 'match': 0}
+    else:
+        node = {'load': 'http://example.com/{{x}}', 'method': 'post',
+                'posts': {'x': '{{x}}'}}
+    node['then'] = [tree(depth - 1, width) for _ in range(width)]
+    return node
+
+
+def bench(label, value, number):
+    assert three_pass(value) == compiled(value)
+    for name, fn in [('validictory x3', three_pass), ('compiled', compiled)]:
+        secs = min(timeit.repeat(lambda: fn(value), number=number, repeat=3))
+        print '%-8s %-15s %10.3f ms/validation' % (label, name,
+                                                  secs * 1000 / number)
+
+
+if __name__ == '__main__':
+    depth = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    width = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    valid = tree(depth, width)
+    invalid = tree(depth, width)
+    invalid['then'][-1] = {'find': 'x', 'then': {'load': ''}}
+
+    bench('valid', valid, 20)
+    bench('invalid', invalid, 20)
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+
+"""
+caustic.cache
+"""
+
+import time
+import threading
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """A bounded mapping that forgets its least recently used keys, and
+    optionally any key older than `ttl` seconds.
+
+    `None` is a legitimate value, so use `get`'s `default` or `in` to tell a
+    cached miss from no entry at all.
+
+    `on_evict`, if given, is called with each key that is forgotten because
+    the cache was full or the key had expired.
+    """
+
+    def __init__(self, maxsize, ttl=None, clock=time.time, on_evict=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.on_evict = on_evict
+        self._clock = clock
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Get the value for `key`, or `default` if it is missing or stale.
+        """
+        with self._lock:
+            try:
+                value, expires = self._data.pop(key)
+            except KeyError:
+                return default
+            if expires is None or expires > self._clock():
+                self._data[key] = (value, expires)
+                return value
+        if self.on_evict:
+            self.on_evict(key)
+        return default
+
+    def set(self, key, value):
+        """Cache `value` under `key`, evicting the oldest entry if full.
+        """
+        expires = self._clock() + self.ttl if self.ttl is not None else None
+        evicted = []
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (value, expires)
+            while len(self._data) > self.maxsize:
+                evicted.append(self._data.popitem(last=False)[0])
+        if self.on_evict:
+            for old in evicted:
+                self.on_evict(old)
+
+    def delete(self, key):
+        """Forget `key`.  Returns True if it was cached.
+        """
+        with self._lock:
+            return self._data.pop(key, None) is not None
+
+    def clear(self):
+        """Forget everything.
+        """
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key):
+        sentinel = object()
+        return self.get(key, sentinel) is not sentinel
+
+    def __len__(self):
+        return len(self._data)
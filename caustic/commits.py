@@ -0,0 +1,414 @@
+# -*- coding: utf-8 -*-
+
+"""
+caustic.commits
+
+A write-behind queue in front of a JsonGitRepository.  Mongo is the source
+of truth for instructions; git keeps their history, and requests should not
+wait on it.
+"""
+
+try:
+    import simplejson as json
+    json
+except ImportError:
+    import json
+
+import os
+import re
+import time
+import fcntl
+import logging
+import threading
+from Queue import Queue, Empty
+from collections import OrderedDict
+
+from jsongit import signature
+
+from metrics import REGISTRY
+
+REGISTRY.histogram('caustic_git_seconds',
+                   'Seconds taken by each git create or commit.')
+
+
+class CommitQueue(object):
+    """Queues `create` and `commit` calls for a JsonGitRepository and applies
+    them from a background worker.
+
+    Every call is appended to a journal, and flushed to disk, before it is
+    queued.  Calls arriving within `batch_window` seconds of each other are
+    applied as one batch, which is checkpointed in the journal with a single
+    write.  Calls not checkpointed when the process died are replayed by
+    `start`.
+
+    If several processes share a repo, each needs its own journal, and a
+    common `lock_path`: batches are applied holding an exclusive lock on it.
+
+    Calls that fail stay in the journal, and are retried after
+    `retry_delay` seconds, doubling up to `max_retry_delay` while they keep
+    failing.  Later calls for the same key wait behind them, so that each
+    key's history stays in order.  A call that has failed `max_attempts`
+    times is given up on, and written to `<journal_path>.dead` instead.
+
+    Once the journal grows past `max_journal_size` bytes while calls are
+    outstanding, it is rewritten as just those calls.
+
+    JsonGitRepository writes each call's objects separately, so a batch
+    shares the lock and the checkpoint, but not the writes.
+
+    Batches are applied, and the journal synced to disk, through `pool`, a
+    ThreadPool, if there is one.  Calls journaled at about the same time
+    share a sync.
+    """
+
+    def __init__(self, repo, journal_path, batch_window=0.05, max_batch=256,
+                 lock_path=None, pool=None, retry_delay=1, max_retry_delay=60,
+                 max_attempts=10, max_journal_size=1024 * 1024):
+        self.repo = repo
+        self.journal_path = journal_path
+        self.dead_path = journal_path + '.dead'
+        self.lock_path = lock_path
+        self.pool = pool
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.max_attempts = max_attempts
+        self.max_journal_size = max_journal_size
+        self._queue = Queue()
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._writes = 0
+        self._synced = 0
+        self._seq = 0
+        self._unapplied = OrderedDict()
+        self._held = []
+        self._retries = 0
+        self._retry_at = 0
+        self._drained = threading.Condition(self._lock)
+        self._journal = None
+        self._worker = None
+
+    def create(self, key, data, author=None):
+        """Queue the creation of `key` with `data`.
+        """
+        self._enqueue('create', key, data, author)
+
+    def commit(self, key, data, author=None):
+        """Queue a commit of `data` to `key`.
+        """
+        self._enqueue('commit', key, data, author)
+
+    def batch(self, calls):
+        """Queue several calls at once, with a single journal write.  `calls`
+        is a list of `(op, key, data, author)`, where `op` is 'create' or
+        'commit'.
+        """
+        self._enqueue_many(calls)
+
+    @property
+    def pending(self):
+        """The number of calls queued and not yet applied.
+        """
+        return len(self._unapplied)
+
+    def start(self):
+        """Replay anything left in the journal and start the worker.  Calls
+        that still fail are kept in the journal, to be retried.
+        """
+        entries = self._read_journal()
+        failed = []
+        if entries:
+            logging.warn('Replaying %d journaled git commits.' % len(entries))
+            self._seq = max(e['seq'] for e in entries)
+            failed = self._bury(self._apply(entries))
+        self._journal = open(self.journal_path, 'w')
+        if failed:
+            with self._lock:
+                self._write(*failed)
+                for entry in failed:
+                    self._unapplied[entry['seq']] = entry
+                self._hold(failed)
+            self._sync()
+        self._worker = threading.Thread(target=self._work,
+                                        name='caustic-commits')
+        self._worker.daemon = True
+        self._worker.start()
+
+    def flush(self, timeout=None):
+        """Block until everything queued so far has been applied, retries
+        included.  Returns False if `timeout` ran out first.
+        """
+        return self._wait(timeout, True)
+
+    def stop(self, timeout=None):
+        """Apply everything queued and stop the worker, without waiting for
+        calls that failed to be retried.  The journal is kept if anything is
+        left, to be replayed by the next `start`.
+        """
+        drained = self._wait(timeout, False)
+        if self._worker:
+            self._queue.put(None)
+            self._worker.join(timeout)
+            self._worker = None
+        if self._journal:
+            self._journal.close()
+            self._journal = None
+            if drained:
+                os.remove(self.journal_path)
+            else:
+                logging.warn('Keeping %d unapplied git commits in %s.' % (
+                    len(self._unapplied), self.journal_path))
+        return drained
+
+    def _wait(self, timeout, retries):
+        """Wait until nothing is pending, or, without `retries`, until only
+        failed calls are.  Returns True if nothing is pending.
+        """
+        deadline = time.time() + timeout if timeout is not None else None
+        with self._drained:
+            while len(self._unapplied) > (0 if retries else len(self._held)):
+                remaining = deadline - time.time() if deadline else None
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._drained.wait(remaining)
+            return not self._unapplied
+
+    def _enqueue(self, op, key, data, author):
+        self._enqueue_many([(op, key, data, author)])
+
+    def _enqueue_many(self, calls):
+        with self._lock:
+            entries = []
+            for op, key, data, author in calls:
+                self._seq += 1
+                entry = {'seq': self._seq, 'op': op, 'key': key, 'data': data}
+                if author is not None:
+                    entry['author'] = [author.name, author.email]
+                entries.append(entry)
+            self._write(*entries)
+            for entry in entries:
+                self._unapplied[entry['seq']] = entry
+                self._queue.put(entry)
+        self._sync()
+
+    def _write(self, *records):
+        """Append records to the journal, to be synced to disk by `_sync`.
+        Called with the lock held.
+        """
+        self._journal.write(''.join(json.dumps(r) + '\n' for r in records))
+        self._journal.flush()
+        self._writes += 1
+
+    def _sync(self):
+        """Sync everything written to the journal so far to disk.  Callers
+        waiting on a sync already under way share the next one.
+        """
+        with self._sync_lock:
+            with self._lock:
+                writes = self._writes
+                fileno = self._journal.fileno() if self._journal else None
+            if writes <= self._synced or fileno is None:
+                return
+            if self.pool:
+                self.pool.run(os.fsync, fileno)
+            else:
+                os.fsync(fileno)
+            self._synced = writes
+
+    def _read_journal(self):
+        """Entries in the journal that were never checkpointed.
+        """
+        if not os.path.exists(self.journal_path):
+            return []
+        entries = []
+        with open(self.journal_path) as journal:
+            for line in journal:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break  # torn final write
+                if 'done' in record:
+                    done = record['done']
+                    if isinstance(done, list):
+                        done = set(done)
+                        entries = [e for e in entries if e['seq'] not in done]
+                    else:
+                        entries = [e for e in entries if e['seq'] > done]
+                else:
+                    entries.append(record)
+        return entries
+
+    def _apply(self, entries, blocked=()):
+        """Apply entries, skipping those for `blocked` keys.
+
+        Returns the entries that failed or were skipped, in order.
+        """
+        if self.lock_path:
+            with open(self.lock_path, 'a') as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                return self._apply_unlocked(entries, blocked)
+        else:
+            return self._apply_unlocked(entries, blocked)
+
+    def _apply_unlocked(self, entries, blocked=()):
+        blocked = set(blocked)
+        failed = []
+        for entry in entries:
+            if entry['key'] in blocked:
+                failed.append(entry)
+                continue
+            kwargs = {}
+            if 'author' in entry:
+                kwargs['author'] = signature(*entry['author'])
+            start = time.time()
+            try:
+                getattr(self.repo, entry['op'])(entry['key'], entry['data'],
+                                                **kwargs)
+                REGISTRY.observe('caustic_git_seconds', time.time() - start,
+                                 op=entry['op'])
+            except Exception:
+                entry['attempts'] = entry.get('attempts', 0) + 1
+                logging.error('Could not %s %s in git (attempt %d).' % (
+                    entry['op'], entry['key'], entry['attempts']),
+                    exc_info=True)
+                blocked.add(entry['key'])
+                failed.append(entry)
+        return failed
+
+    def _bury(self, failed):
+        """Write the failed entries that have used up their attempts to the
+        dead letter file.
+
+        Returns the rest, to be retried.
+        """
+        dead = [e for e in failed if e.get('attempts', 0) >= self.max_attempts]
+        if not dead:
+            return failed
+        with open(self.dead_path, 'a') as letters:
+            letters.write(''.join(json.dumps(e) + '\n' for e in dead))
+        for entry in dead:
+            logging.critical('Gave up on %s of %s in git after %d attempts; '
+                             'it is kept in %s.' % (entry['op'], entry['key'],
+                                                     entry['attempts'],
+                                                     self.dead_path))
+        dead_seqs = set(e['seq'] for e in dead)
+        return [e for e in failed if e['seq'] not in dead_seqs]
+
+    def _compact(self):
+        """Rewrite the journal as just the entries not yet applied.
+        Called with the lock held.
+        """
+        path = self.journal_path + '.tmp'
+        with open(path, 'w') as journal:
+            journal.write(''.join(json.dumps(e) + '\n'
+                                  for e in self._unapplied.values()))
+            journal.flush()
+            if self.pool:
+                self.pool.run(os.fsync, journal.fileno())
+            else:
+                os.fsync(journal.fileno())
+        os.rename(path, self.journal_path)
+        self._journal.close()
+        self._journal = open(self.journal_path, 'a')
+
+    def _hold(self, failed):
+        """Keep failed entries to retry, backing off.  Called with the lock
+        held.
+        """
+        self._held = failed
+        if failed:
+            self._retries += 1
+            self._retry_at = time.time() + min(
+                self.retry_delay * 2 ** (self._retries - 1), self.max_retry_delay)
+        else:
+            self._retries = 0
+
+    def _next_batch(self):
+        """Wait for the next batch: the held entries once they are due,
+        and whatever else arrives within the batch window.
+
+        Returns a tuple of the batch and whether it retries the held
+        entries, or None when it is time to stop.
+        """
+        retrying = bool(self._held) and time.time() >= self._retry_at
+        if retrying:
+            batch = list(self._held)
+        else:
+            wait = max(0, self._retry_at - time.time()) if self._held else None
+            try:
+                entry = self._queue.get(timeout=wait)
+            except Empty:
+                return [], False
+            if entry is None:
+                return None
+            batch = [entry]
+
+        deadline = time.time() + self.batch_window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                entry = self._queue.get(timeout=remaining)
+            except Empty:
+                break
+            if entry is None:
+                self._queue.put(None)
+                break
+            batch.append(entry)
+        return batch, retrying
+
+    def _work(self):
+        while True:
+            next_batch = self._next_batch()
+            if next_batch is None:
+                return
+            batch, retrying = next_batch
+            if not batch:
+                continue
+            waiting = [] if retrying else self._held
+            blocked = set(e['key'] for e in waiting)
+
+            if self.pool:
+                failed = self.pool.run(self._apply, batch, blocked)
+            else:
+                failed = self._apply(batch, blocked)
+
+            with self._lock:
+                failed = self._bury(failed)
+                failed_seqs = set(e['seq'] for e in failed)
+                # Applied, or given up on.
+                done = [e['seq'] for e in batch if e['seq'] not in failed_seqs]
+                for seq in done:
+                    del self._unapplied[seq]
+                if retrying or not waiting:
+                    self._hold(failed)
+                else:
+                    self._held = waiting + failed
+                if self._unapplied:
+                    if done:
+                        self._write({'done': done})
+                    if self._journal.tell() > self.max_journal_size:
+                        self._compact()
+                else:
+                    # Nothing outstanding, so the journal can start over.
+                    self._journal.seek(0)
+                    self._journal.truncate()
+                    self._journal.flush()
+                    self._writes += 1
+                self._drained.notify_all()
+            self._sync()
+
+
+def journals(journal_path):
+    """The journals that CommitQueues at `journal_path` may have left
+    behind: its own, and those of numbered workers, `<journal_path>.<n>`.
+    """
+    directory, name = os.path.split(journal_path)
+    worker = re.compile(r'^%s\.\d+$' % re.escape(name))
+    found = sorted(os.path.join(directory, f)
+                   for f in os.listdir(directory or '.') if worker.match(f))
+    if os.path.exists(journal_path):
+        found.insert(0, journal_path)
+    return found
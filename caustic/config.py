@@ -14,7 +14,30 @@ Look at `config.ini` for defined modes. Defaults are `production`,
     exit(1)
 
 MODE = sys.argv[1]
-PARSER = SafeConfigParser()
+
+# Options that existing `config.ini` files may not have yet.
+DEFAULTS = {
+    'json_git_journal': '%(json_git_dir)s.journal',
+    'json_git_batch_window': '0.05',
+    'json_git_lock': '%(json_git_dir)s.lock',
+    'workers': '1',
+    'thread_pool_size': '4',
+    'thread_pool_queue': '64',
+    'template_cache_size': '512',
+    'revision_cache_size': '256',
+    'db_replica_set': '',
+    'db_pool_size': '10',
+    'db_secondary_reads': 'false',
+    'profile_dir': 'profiles',
+    'profile_threshold': '1.0',
+    'profile_keep': '50',
+    'profile_sample_rate': '0',
+    'metrics_dir': 'metrics',
+    'metrics_interval': '5',
+    'session_max_age': '1209600',
+}
+
+PARSER = SafeConfigParser(DEFAULTS)
 
 if not len(PARSER.read('config.ini')):
     print "No config.ini file found in this directory.  Writing a config..."
@@ -24,12 +47,16 @@ if not len(PARSER.read('config.ini')):
         PARSER.set(mode, 'db_name', "caustic_%s" % mode)
         PARSER.set(mode, 'db_port', '27017')
         PARSER.set(mode, 'db_host', 'localhost')
+        PARSER.set(mode, 'db_replica_set', '')
+        PARSER.set(mode, 'db_pool_size', '10')
+        PARSER.set(mode, 'db_secondary_reads', 'false')
         PARSER.set(mode, 'template_dir', './templates')
         PARSER.set(mode, 'cookie_secret', str(uuid.uuid4()))
         PARSER.set(mode, 'json_git_dir', "%s.jsongit" % mode)
         PARSER.set(mode, 'recv_spec', 'ipc://caustic:1')
         PARSER.set(mode, 'send_spec', 'ipc://caustic:0')
         PARSER.set(mode, 'valid_url_chars', '\w\-')
+        PARSER.set(mode, 'workers', '1')
 
     try:
         conf = open('config.ini', 'w')
@@ -42,9 +69,27 @@ if not len(PARSER.read('config.ini')):
 DB_NAME = PARSER.get(MODE, 'db_name')
 DB_PORT = int(PARSER.get(MODE, 'db_port'))
 DB_HOST = PARSER.get(MODE, 'db_host')
+DB_REPLICA_SET = PARSER.get(MODE, 'db_replica_set') or None
+DB_POOL_SIZE = PARSER.getint(MODE, 'db_pool_size')
+DB_SECONDARY_READS = PARSER.getboolean(MODE, 'db_secondary_reads')
 COOKIE_SECRET = PARSER.get(MODE, 'cookie_secret')
+SESSION_MAX_AGE = PARSER.getfloat(MODE, 'session_max_age') or None
 RECV_SPEC = PARSER.get(MODE, 'recv_spec')
 SEND_SPEC = PARSER.get(MODE, 'send_spec')
 JSON_GIT_DIR = PARSER.get(MODE, 'json_git_dir')
+JSON_GIT_JOURNAL = PARSER.get(MODE, 'json_git_journal')
+JSON_GIT_BATCH_WINDOW = float(PARSER.get(MODE, 'json_git_batch_window'))
+JSON_GIT_LOCK = PARSER.get(MODE, 'json_git_lock')
 TEMPLATE_DIR = PARSER.get(MODE, 'template_dir')
+TEMPLATE_CACHE_SIZE = PARSER.getint(MODE, 'template_cache_size')
+REVISION_CACHE_SIZE = PARSER.getint(MODE, 'revision_cache_size')
 VALID_URL_CHARS = PARSER.get(MODE, 'valid_url_chars')
+WORKERS = PARSER.getint(MODE, 'workers')
+THREAD_POOL_SIZE = PARSER.getint(MODE, 'thread_pool_size')
+THREAD_POOL_QUEUE = PARSER.getint(MODE, 'thread_pool_queue')
+PROFILE_DIR = PARSER.get(MODE, 'profile_dir')
+PROFILE_THRESHOLD = PARSER.getfloat(MODE, 'profile_threshold')
+PROFILE_KEEP = PARSER.getint(MODE, 'profile_keep')
+PROFILE_SAMPLE_RATE = PARSER.getfloat(MODE, 'profile_sample_rate')
+METRICS_DIR = PARSER.get(MODE, 'metrics_dir')
+METRICS_INTERVAL = PARSER.getfloat(MODE, 'metrics_interval')
@@ -4,38 +4,128 @@
 caustic.database
 """
 
+try:
+    import simplejson as json
+    json
+except ImportError:
+    import json
+
+import os
+import re
+import time
+import socket
+import logging
+import itertools
+from datetime import datetime, timedelta
+from collections import namedtuple
+
 import pymongo
-from pymongo.errors import DuplicateKeyError
+from bson.objectid import ObjectId
+from pymongo import ReadPreference
+from pymongo.errors import DuplicateKeyError, CollectionInvalid
 from jsongit import signature
 from models import User, InstructionDocument
+from cache import LRUCache
+from commits import CommitQueue
+from metrics import REGISTRY
+from encoding import content_hash, canonical_json, json_hash
+from search import search_terms, words, tag_term
+from resolver import references, reference_path
+from diff import diff
 from dictshield.base import ShieldException
 
-def get_db(server, port, name):
-    db = pymongo.Connection(server, port)[name]
+_MISSING = object()
+
+# How far behind one process's clock another's may be when it records a
+# deletion.
+DELETION_SKEW = timedelta(seconds=60)
+
+# Bytes of recent changes to keep in the capped change log.
+CHANGES_SIZE = 1024 * 1024
+# How many changes before the latest one seen are read again, to catch
+# those that took a little longer to be written than later ones.
+CHANGES_WINDOW = 64
+
+SEARCH_LIMIT = 50  # results per page of search, by default
+MAX_SEARCH_LIMIT = 500
+
+# How far, and how many instructions, to look for indirect dependents.
+MAX_DEPENDENT_DEPTH = 10
+MAX_DEPENDENTS = 1000
+
+InstructionName = namedtuple('InstructionName', ['name'])
+REGISTRY.histogram('caustic_db_seconds',
+                   'Seconds spent in each Users and Instructions method.')
+
+InstructionRef = namedtuple('InstructionRef', ['id', 'creator_name', 'name'])
+Revision = namedtuple('Revision', ['rev', 'content_hash', 'author', 'time'])
+
+def get_db(server, port, name, replica_set=None, pool_size=10):
+    """Connect to a database.  `server` may be a comma-separated list of
+    hosts, which default to `port`, to seed a connection to `replica_set`.
+    Each connection keeps a pool of up to `pool_size` sockets.
+    """
+    if replica_set:
+        seeds = ','.join(h if ':' in h else '%s:%d' % (h, port)
+                         for h in server.split(','))
+        conn = pymongo.ReplicaSetConnection(seeds, replicaSet=replica_set,
+                                            max_pool_size=pool_size)
+    else:
+        conn = pymongo.Connection(server, port, max_pool_size=pool_size)
+    db = conn[name]
     db.safe = True
     return db
 
 
+def reader(coll, secondary_reads=False):
+    """A handle on `coll` for read-only queries.  If `secondary_reads`,
+    they go to a secondary when there is one.
+    """
+    if secondary_reads:
+        coll = coll.database[coll.name]
+        coll.read_preference = ReadPreference.SECONDARY_PREFERRED
+    return coll
+
+
+@REGISTRY.instrumented('caustic_db_seconds')
 class Users(object):
     """Collection of users.  Ensures uniqueness of non-deleted
-    names.
+    names.  Keeps a process-wide cache of users by session id.
+
+    Finding users by name may read from a secondary if `secondary_reads`.
+
+    Each user has a session generation, kept in memory, which is bumped to
+    revoke their session tokens.  Users deleted by other processes are
+    picked up every `generation_refresh` seconds, by reading the deletions
+    recorded since the last time.
     """
 
-    def __init__(self, db):
+    def __init__(self, db, session_cache_size=4096, session_cache_ttl=60,
+                 secondary_reads=False, generation_refresh=5):
         self.coll = db.users
+        self.reads = reader(self.coll, secondary_reads)
         self.coll.ensure_index('name', unique=True)
         self.deleted = db.deleted_users
+        self.deleted.ensure_index('deleted_at')
+        self.instructions = db.instructions
+        self.sessions = LRUCache(session_cache_size, session_cache_ttl)
+        self.generations = {}
+        self.generation_refresh = generation_refresh
+        self._refreshed = None
+        self._deleted_since = None
 
     def create(self, name):
         """Create a new user.
 
         Returns the User, or None if the user has a duplicate name.
         """
+        user = User(name=name)
         try:
-            id = self.coll.insert(User(name=name).to_python())
-            return self.get(id)
+            user.id = self.coll.insert(user.to_python())
         except DuplicateKeyError:
             return None
+        self.sessions.delete(str(user.id))
+        return user
 
     def get(self, id):
         """Get a user by id.
@@ -45,63 +135,626 @@ class Users(object):
         u = self.coll.find_one(id)
         return User(**u) if u else None
 
+    def for_session(self, session_id):
+        """Get a user by session id, which is the user's id as stored in the
+        session cookie.  Lookups, including misses, are cached for a short
+        while.
+
+        Returns the User or None.
+        """
+        key = str(session_id)
+        user = self.sessions.get(key, _MISSING)
+        if user is _MISSING:
+            user = self.get(session_id)
+            self.sessions.set(key, user)
+        return user
+
+    def for_token(self, session):
+        """Get the user a session token was issued to, without reading
+        the database.  `session` is a Session read from the token.
+
+        Returns the User, or None if the session was revoked.
+        """
+        if session.generation != self.generation(session.id):
+            return None
+        return User(id=ObjectId(session.id), name=session.name)
+
+    def generation(self, user_id):
+        """The current session generation of a user.
+        """
+        if (self._refreshed is None or
+                time.time() - self._refreshed > self.generation_refresh):
+            self.refresh_generations()
+        return self.generations.get(str(user_id), 0)
+
+    def refresh_generations(self):
+        """Revoke the sessions of users deleted elsewhere.  Every deletion
+        is read the first time, and only recent ones after that.
+        """
+        self._refreshed = time.time()
+        started = datetime.utcnow()
+        spec = {}
+        if self._deleted_since is not None:
+            spec['deleted_at'] = {'$gte': self._deleted_since - DELETION_SKEW}
+        for u in self.deleted.find(spec, fields=['_id']):
+            key = str(u['_id'])
+            if not self.generations.get(key):
+                self.generations[key] = 1
+        self._deleted_since = started
+
     def find(self, name):
         """Get a user by name.
 
         Returns the User or None.
         """
-        u = self.coll.find_one({'name': name})
+        u = self.reads.find_one({'name': name})
         return User(**u) if u else None
 
     def delete(self, user):
-        """Delete a user.
+        """Delete a user.  Their instructions are orphaned, and no longer
+        found under their name, which may be taken by someone else.
         """
         self.coll.remove(user.id)
-        self.deleted.save(user.to_python())
+        key = str(user.id)
+        self.sessions.delete(key)
+        self.generations[key] = self.generations.get(key, 0) + 1
+        self.instructions.update({'creator_id': user.id},
+                                 {'$unset': {'creator_name': 1}},
+                                 multi=True)
+        deleted = user.to_python()
+        deleted['deleted_at'] = datetime.utcnow()
+        self.deleted.save(deleted)
+
+
+@REGISTRY.instrumented('caustic_db_seconds')
+class Changes(object):
+    """A log of which instructions were written, for processes caching
+    what they read to learn what the others changed.  Each entry is
+    numbered, and the log is a capped collection of about `size` bytes.
+    """
+
+    def __init__(self, db, size=CHANGES_SIZE):
+        try:
+            db.create_collection('instruction_changes', capped=True, size=size)
+        except CollectionInvalid:
+            pass  # it already exists
+        self.coll = db.instruction_changes
+        self.counters = db.counters
+        self.origin = '%s:%d' % (socket.gethostname(), os.getpid())
+        self._seen = None
+        self._start = None
+        self._read = set()
+
+    def record(self, keys):
+        """Log that the instructions at `keys`, a list of `(creator_name,
+        name)` tuples, were written.
+        """
+        seq = self.counters.find_and_modify({'_id': 'instruction_changes'},
+                                            {'$inc': {'seq': 1}},
+                                            upsert=True, new=True)['seq']
+        self.coll.insert({'_id': seq, 'origin': self.origin,
+                          'keys': [list(k) for k in keys]})
+
+    def read(self):
+        """The keys other processes have written since the last read.  The
+        first read only finds where the log ends.
+
+        Returns a list of `(creator_name, name)` tuples.
+        """
+        if self._seen is None:
+            latest = self.counters.find_one({'_id': 'instruction_changes'})
+            self._seen = self._start = latest['seq'] if latest else 0
+            return []
+        keys = []
+        since = max(self._start, self._seen - CHANGES_WINDOW)
+        for change in self.coll.find({'_id': {'$gt': since}}):
+            if change['_id'] in self._read:
+                continue
+            self._read.add(change['_id'])
+            self._seen = max(self._seen, change['_id'])
+            if change['origin'] != self.origin:
+                keys.extend(tuple(k) for k in change['keys'])
+        self._read = set(seq for seq in self._read
+                         if seq > self._seen - CHANGES_WINDOW)
+        return keys
 
 
+@REGISTRY.instrumented('caustic_db_seconds')
 class Instructions(object):
     """Collection of instructions.  Ensures uniquenss of
     creator_id and name.  Keeps git repo fresh.
+
+    The creator's name is stored alongside creator_id, so that reads by
+    creator name are a single query.
+
+    `repo` is a JsonGitRepository, or a CommitQueue in front of one.
+
+    Each of `listeners` is called with `(doc, deleted)` after an
+    instruction is written or deleted.  If other processes cache what they
+    read, writes are also logged to `changes`, a Changes.
+
+    Lookups and listings may read from a secondary if `secondary_reads`;
+    lookups made in order to write always read from the primary.
+
+    Validation and git calls are made through `pool`, a ThreadPool, if
+    there is one.  A CommitQueue makes its git calls through its own pool.
+
+    Every revision committed to git is also listed in a side table, with
+    its content stored by hash, so that history can be read without
+    walking the git log.  Up to `blob_cache_size` contents are cached, and
+    up to `diff_cache_size` diffs between them.
     """
 
-    def __init__(self, users, repo, db):
+    def __init__(self, users, repo, db, secondary_reads=False, pool=None,
+                 blob_cache_size=256, diff_cache_size=256, changes=None):
         self.repo = repo
+        self.pool = pool
         self.users = users
+        self.listeners = []
+        self.changes = changes
         self.coll = db.instructions
+        self.reads = reader(self.coll, secondary_reads)
+        self.revisions = db.revisions
+        self.revisions.ensure_index([('instruction_id', pymongo.ASCENDING),
+                                     ('rev', pymongo.DESCENDING)],
+                                    unique=True)
+        self.blobs = db.blobs
+        self.blob_cache = LRUCache(blob_cache_size)
+        self.diff_cache = LRUCache(diff_cache_size)
         self.coll.ensure_index([('creator_id', pymongo.ASCENDING),
                                 ('name', pymongo.ASCENDING)],
                                unique=True)
+        self.coll.ensure_index([('creator_name', pymongo.ASCENDING),
+                                ('name', pymongo.ASCENDING),
+                                ('content_hash', pymongo.ASCENDING)])
+        self.coll.ensure_index([('search_terms', pymongo.ASCENDING),
+                                ('_id', pymongo.ASCENDING)])
+        self.coll.ensure_index([('references', pymongo.ASCENDING),
+                                ('_id', pymongo.ASCENDING)])
+        self.coll.ensure_index([('creator_name', pymongo.ASCENDING),
+                                ('tags', pymongo.ASCENDING),
+                                ('name', pymongo.ASCENDING)])
+
+    def backfill_creator_names(self):
+        """Store creator_name on instructions that lack it.  Instructions
+        whose creator was deleted are left without one.
+
+        Returns the number of instructions updated.
+        """
+        updated = 0
+        missing = {'creator_name': {'$exists': False}}
+        for creator_id in self.coll.find(missing).distinct('creator_id'):
+            creator = self.users.get(creator_id)
+            if creator:
+                spec = dict(missing, creator_id=creator_id)
+                result = self.coll.update(spec,
+                                          {'$set': {'creator_name': creator.name}},
+                                          multi=True)
+                updated += result['n']
+        return updated
+
+    def backfill_content_hashes(self):
+        """Store the canonical JSON and content hash on instructions that
+        lack them.
+
+        Returns the number of instructions updated.
+        """
+        updated = 0
+        for i in self.coll.find({'instruction': {'$exists': True},
+                                 '$or': [{'content_hash': {'$exists': False}},
+                                         {'instruction_json': {'$exists': False}}]},
+                                fields=['instruction']):
+            encoded = canonical_json(i['instruction'])
+            self.coll.update({'_id': i['_id']},
+                             {'$set': {'instruction_json': encoded,
+                                       'content_hash': json_hash(encoded)}})
+            updated += 1
+        return updated
+
+    def _offload(self, fn, *args, **kwargs):
+        """Call something that blocks, through the pool if there is one.
+        """
+        if self.pool:
+            return self.pool.run(fn, *args, **kwargs)
+        return fn(*args, **kwargs)
+
+    def _git(self, fn, *args, **kwargs):
+        """Call the repo.  A CommitQueue returns at once, so only a bare
+        repository is called through the pool.
+        """
+        if isinstance(self.repo, CommitQueue):
+            return fn(*args, **kwargs)
+        return self._offload(fn, *args, **kwargs)
+
+    def backfill_search_terms(self):
+        """Store search terms on instructions that lack them, or that
+        have tags stored as `tag:` terms, which query words could match.
+
+        Returns the number of instructions updated.
+        """
+        updated = 0
+        for i in self.coll.find({'$or': [{'search_terms': {'$exists': False}},
+                                         {'search_terms': re.compile('^tag:')}]},
+                                fields=['name', 'instruction', 'tags',
+                                        'content_hash', 'cloned_from']):
+            if 'instruction' in i:
+                instruction = i['instruction']
+            else:
+                encoded = self._content(i)
+                if encoded is None:
+                    continue
+                instruction = json.loads(encoded)
+            terms = search_terms(i['name'], instruction, i.get('tags'))
+            self.coll.update({'_id': i['_id']},
+                             {'$set': {'search_terms': terms}})
+            updated += 1
+        return updated
+
+    def backfill_references(self):
+        """Store references on instructions that lack them.
+
+        Returns the number of instructions updated.
+        """
+        updated = 0
+        for i in self.coll.find({'references': {'$exists': False}},
+                                fields=['creator_name', 'instruction']):
+            refs = references(i.get('creator_name'), i['instruction'])
+            self.coll.update({'_id': i['_id']},
+                             {'$set': {'references': refs}})
+            updated += 1
+        return updated
+
+    def backfill_revisions(self):
+        """Record the current content of instructions from before the
+        revision side table as their first revision.
+
+        Returns the number of instructions updated.
+        """
+        updated = 0
+        for i in self.coll.find({'revision': {'$exists': False}},
+                                fields=['creator_name', 'instruction_json',
+                                        'content_hash']):
+            self._record_revisions([(i['_id'], 1, i['content_hash'],
+                                     i['instruction_json'],
+                                     i.get('creator_name'),
+                                     i['_id'].generation_time)])
+            self.coll.update({'_id': i['_id']}, {'$set': {'revision': 1}})
+            updated += 1
+        return updated
+
+    def _derive(self, doc):
+        """Store what is derived from the instruction on the doc: its
+        canonical JSON, the hash of that, its search terms and the paths it
+        refers to.
+        """
+        doc.instruction_json = canonical_json(doc.instruction)
+        doc.content_hash = json_hash(doc.instruction_json)
+        doc.search_terms = search_terms(doc.name, doc.instruction, doc.tags)
+        doc.references = references(doc.creator_name, doc.instruction)
+
+    def _changed(self, docs, deleted=False):
+        """Log writes to a list of docs, and tell the listeners about them.
+        """
+        if self.changes and docs:
+            self.changes.record([(d.creator_name, d.name) for d in docs])
+        for doc in docs:
+            for listener in self.listeners:
+                listener(doc, deleted)
 
     def _repo_key(self, creator, instruction):
         """The key for the repo.
         """
         return '/'.join([str(creator.id), str(instruction.id)])
 
+    def _document(self, i):
+        """Make an InstructionDocument from what is stored.  Clones that
+        haven't been changed only refer to their content, which is read from
+        the blobs.
+
+        Returns None if the content can't be found.
+        """
+        if 'instruction' not in i:
+            i['instruction_json'] = self._content(i)
+            if i['instruction_json'] is None:
+                return None
+            i['instruction'] = json.loads(i['instruction_json'])
+        return InstructionDocument(**i)
+
+    def _record(self, doc):
+        """What to store for an InstructionDocument.  A clone that hasn't
+        been changed only refers to its content.
+        """
+        record = doc.to_python()
+        if doc.cloned_from:
+            record.pop('instruction', None)
+            record.pop('instruction_json', None)
+        return record
+
+    def _content(self, i):
+        """The canonical JSON of a stored clone that has no content of its
+        own.  If its blob is missing, the content is taken from the
+        instruction it was cloned from, if that hasn't changed since, and
+        the blob is stored again.
+
+        Returns None if the content can't be found.
+        """
+        encoded = self.blob(i['content_hash'])
+        if encoded is not None:
+            return encoded
+        source = self.coll.find_one({'_id': i.get('cloned_from'),
+                                     'content_hash': i['content_hash'],
+                                     'instruction_json': {'$exists': True}},
+                                    fields=['instruction_json'])
+        if not source:
+            logging.error('Content %s of instruction %s is missing.' % (
+                i['content_hash'], i['_id']))
+            return None
+        try:
+            self.blobs.insert({'_id': i['content_hash'],
+                               'json': source['instruction_json']})
+        except DuplicateKeyError:
+            pass
+        return source['instruction_json']
+
     def for_creator(self, creator_name):
         """Find all instructions by a creator.
 
         Returns an array of InstructionDocuments, or None if
         the creator_name does not exist.
         """
-        u = self.users.find(creator_name)
-        if u:
-            cursor = self.coll.find({'creator_id': u.id})
-            return [InstructionDocument(**i) for i in cursor]
+        cursor = self.reads.find({'creator_name': creator_name})
+        docs = filter(None, (self._document(i) for i in cursor))
+        if docs or self.users.find(creator_name):
+            return docs
         else:
             return None
 
-    def find(self, creator_name, name):
-        """Find an instruction by creator name and its own name.
+    def names_for_creator(self, creator_name, after=None, limit=None):
+        """List the names of all instructions by a creator, without loading
+        the instructions themselves.  Only names sorting after `after` are
+        listed, and no more than `limit` of them.
+
+        Returns an iterable of InstructionNames sorted by name, read from
+        the database as it is consumed, or None if the creator_name does
+        not exist.
+        """
+        return self._names(creator_name, {'creator_name': creator_name},
+                           after, limit)
+
+    def names_tagged(self, creator_name, tag, after=None, limit=None):
+        """List the names of a creator's instructions with a tag, without
+        loading the instructions themselves.  Only names sorting after
+        `after` are listed, and no more than `limit` of them.
+
+        Returns an iterable of InstructionNames sorted by name, read from
+        the database as it is consumed, or None if the creator doesn't
+        exist.
+        """
+        return self._names(creator_name,
+                           {'creator_name': creator_name, 'tags': tag},
+                           after, limit)
+
+    def _names(self, creator_name, spec, after, limit):
+        """Names of instructions matching spec, or None if there are none
+        and creator_name does not exist.
+        """
+        if after is not None:
+            spec = dict(spec, name={'$gt': after})
+        cursor = self.reads.find(spec, fields={'name': True, '_id': False},
+                                sort=[('name', pymongo.ASCENDING)])
+        if limit:
+            cursor = cursor.limit(limit)
+
+        names = (InstructionName(i['name']) for i in cursor)
+        try:
+            first = next(names)
+        except StopIteration:
+            return [] if self.users.find(creator_name) else None
+        return itertools.chain([first], names)
+
+    def find(self, creator_name, name, primary=False):
+        """Find an instruction by creator name and its own name, from the
+        primary if `primary`.
 
         Returns the InstructionDocument or None.
         """
-        u = self.users.find(creator_name)
-        if u:
-            i = self.coll.find_one({'creator_id': u.id, 'name': name})
-            return InstructionDocument(**i) if i else None
-        else:
+        return self._find(self.coll if primary else self.reads,
+                          creator_name, name)
+
+    def _find(self, coll, creator_name, name):
+        i = coll.find_one({'creator_name': creator_name, 'name': name})
+        return self._document(i) if i else None
+
+    def hash_for(self, creator_name, name):
+        """Look up the content hash of an instruction by creator name and
+        its own name.  This is answered from the index alone, without
+        loading the instruction.
+
+        Returns the hash, or None if there is no such instruction.
+        """
+        i = self.reads.find_one({'creator_name': creator_name, 'name': name},
+                                fields={'content_hash': True, '_id': False})
+        return i.get('content_hash') if i else None
+
+    def encoded_for(self, creator_name, name):
+        """Look up the canonical JSON of an instruction, and its content
+        hash, by creator name and its own name, without decoding it.
+
+        Returns a tuple of the JSON and the hash, or None if there is no
+        such instruction or it has not been encoded.
+        """
+        i = self.reads.find_one({'creator_name': creator_name, 'name': name},
+                                fields={'instruction_json': True,
+                                        'content_hash': True,
+                                        'cloned_from': True})
+        if i and 'instruction_json' in i:
+            return i['instruction_json'], i['content_hash']
+        elif i and 'content_hash' in i:
+            encoded = self._content(i)
+            return (encoded, i['content_hash']) if encoded is not None else None
+        return None
+
+    def search(self, query=None, tags=None, after=None, limit=None):
+        """Search everyone's instructions.  Every word in `query` must
+        begin some word of an instruction's name, tags, description or
+        metadata, and it must have every one of `tags`.  Only instructions
+        with ids after `after` are found, and no more than `limit` of them,
+        which is SEARCH_LIMIT by default and at most MAX_SEARCH_LIMIT.
+
+        Instructions whose creator was deleted aren't found.
+
+        Returns a list of InstructionRefs, sorted by id.
+        """
+        # Exact tags first, since the index is searched by the first term.
+        terms = [tag_term(t) for t in tags or []]
+        terms += [re.compile('^' + re.escape(w)) for w in words(query)]
+        if not terms:
+            return []
+        spec = {'search_terms': {'$all': terms},
+                'creator_name': {'$exists': True}}
+        if after is not None:
+            spec['_id'] = {'$gt': after}
+        cursor = self.reads.find(spec,
+                                 fields=['creator_name', 'name'],
+                                 sort=[('_id', pymongo.ASCENDING)])
+        cursor = cursor.limit(min(limit or SEARCH_LIMIT, MAX_SEARCH_LIMIT))
+        return [InstructionRef(i['_id'], i.get('creator_name'), i['name'])
+                for i in cursor]
+
+    def dependents(self, creator_name, name, after=None, limit=None):
+        """Find the instructions that refer to an instruction, through
+        `then` or `extends`.  Only those with ids after `after` are found,
+        and no more than `limit` of them.  Instructions whose creator was
+        deleted aren't found.
+
+        Returns a list of InstructionRefs, sorted by id.
+        """
+        spec = {'references': reference_path(creator_name, name),
+                'creator_name': {'$exists': True}}
+        if after is not None:
+            spec['_id'] = {'$gt': after}
+        cursor = self.reads.find(spec, fields=['creator_name', 'name'],
+                                 sort=[('_id', pymongo.ASCENDING)])
+        if limit:
+            cursor = cursor.limit(limit)
+        return [InstructionRef(i['_id'], i.get('creator_name'), i['name'])
+                for i in cursor]
+
+    def all_dependents(self, creator_name, name, after=None, limit=None):
+        """Find the instructions that depend on an instruction, directly
+        or through others, to see what a change to it would affect.  Each
+        level is found with one query, up to MAX_DEPENDENT_DEPTH levels and
+        MAX_DEPENDENTS instructions.  Only those listed after the one with
+        id `after` are returned, and no more than `limit` of them.
+
+        Returns a list of InstructionRefs, nearest first.
+        """
+        seen = set([(creator_name, name)])
+        found = []
+        frontier = [reference_path(creator_name, name)]
+        for _ in range(MAX_DEPENDENT_DEPTH):
+            if not frontier or len(found) >= MAX_DEPENDENTS:
+                break
+            cursor = self.reads.find({'references': {'$in': frontier},
+                                      'creator_name': {'$exists': True}},
+                                     fields=['creator_name', 'name'],
+                                     sort=[('_id', pymongo.ASCENDING)])
+            frontier = []
+            for i in cursor.limit(MAX_DEPENDENTS):
+                key = (i['creator_name'], i['name'])
+                if key not in seen and len(found) < MAX_DEPENDENTS:
+                    seen.add(key)
+                    found.append(InstructionRef(i['_id'], *key))
+                    frontier.append(reference_path(*key))
+
+        if after is not None:
+            ids = [ref.id for ref in found]
+            found = found[ids.index(after) + 1:] if after in ids else []
+        return found[:limit] if limit else found
+
+    def history(self, creator_name, name, before=None, limit=None):
+        """List the revisions of an instruction, newest first, from the
+        side table.  Only revisions before `before` are listed, and no more
+        than `limit` of them.
+
+        Returns a list of Revisions, or None if there is no such
+        instruction.
+        """
+        i = self.reads.find_one({'creator_name': creator_name, 'name': name},
+                                fields=['_id'])
+        if not i:
+            return None
+        spec = {'instruction_id': i['_id']}
+        if before is not None:
+            spec['rev'] = {'$lt': before}
+        cursor = self.revisions.find(spec, sort=[('rev', pymongo.DESCENDING)])
+        if limit:
+            cursor = cursor.limit(limit)
+        return [Revision(r['rev'], r['content_hash'], r['author'], r['time'])
+                for r in cursor]
+
+    def revision(self, creator_name, name, rev):
+        """Read one revision of an instruction.
+
+        Returns a tuple of the Revision and the instruction's canonical JSON
+        as of it, or None if there is no such revision or its content is
+        missing.
+        """
+        i = self.reads.find_one({'creator_name': creator_name, 'name': name},
+                                fields=['_id'])
+        if not i:
+            return None
+        r = self.revisions.find_one({'instruction_id': i['_id'], 'rev': rev})
+        if not r:
+            return None
+        encoded = self.blob(r['content_hash'])
+        if encoded is None:
+            return None
+        revision = Revision(r['rev'], r['content_hash'], r['author'], r['time'])
+        return revision, encoded
+
+    def diff(self, creator_name, name, from_rev, to_rev):
+        """Find what changed in an instruction between two revisions, as
+        JSON Patch operations.  Revision 0 is the empty instruction, so the
+        first revision can be diffed against it.  Diffs are cached by the
+        content hashes of the revisions, which is the same as caching them by
+        revision.
+
+        Returns None if either revision, or its content, doesn't exist.
+        """
+        i = self.reads.find_one({'creator_name': creator_name, 'name': name},
+                                fields=['_id'])
+        if not i:
+            return None
+        hashes = {0: None}
+        hashes.update((r['rev'], r['content_hash']) for r in self.revisions.find(
+            {'instruction_id': i['_id'], 'rev': {'$in': [from_rev, to_rev]}},
+            fields=['rev', 'content_hash']))
+        if from_rev not in hashes or to_rev not in hashes:
             return None
+        key = (hashes[from_rev], hashes[to_rev])
+        ops = self.diff_cache.get(key)
+        if ops is None:
+            old, new = [self.blob(hash) if hash else '{}' for hash in key]
+            if old is None or new is None:
+                return None
+            ops = diff(json.loads(old), json.loads(new))
+            self.diff_cache.set(key, ops)
+        return ops
+
+    def blob(self, hash):
+        """Read the canonical JSON of an instruction by its content hash.
+
+        Returns None if there is no such content.
+        """
+        encoded = self.blob_cache.get(hash)
+        if encoded is None:
+            blob = self.blobs.find_one(hash)
+            if blob is None:
+                return None
+            encoded = blob['json']
+            self.blob_cache.set(hash, encoded)
+        return encoded
 
     def tagged(self, creator_name, tag):
         """Find instructions by creator name and tag.
@@ -109,10 +762,10 @@ class Instructions(object):
         Returns a list of InstructionDocuments, or None if
         the creator doesn't exist.
         """
-        u = self.users.find(creator_name)
-        if u:
-            cursor = self.coll.find({'creator_id': u.id, 'tags': tag})
-            return [InstructionDocument(**i) for i in cursor]
+        cursor = self.reads.find({'creator_name': creator_name, 'tags': tag})
+        docs = filter(None, (self._document(i) for i in cursor))
+        if docs or self.users.find(creator_name):
+            return docs
         else:
             return None
 
@@ -125,53 +778,283 @@ class Instructions(object):
         """
         doc = InstructionDocument(
             creator_id=creator.id,
+            creator_name=creator.name,
             name=name,
             instruction=instruction,
             tags=tags)
-        doc.validate()
+        self._offload(doc.validate)
+        self._derive(doc)
+        doc.revision = 1
+
+        doc.id = self.coll.insert(doc.to_python())
+        self._record_revisions([self._revision_record(doc, creator.name)])
+        self._changed([doc])
+        self._git(self.repo.create, self._repo_key(creator, doc),
+                  doc.instruction,
+                  author=signature(creator.name, creator.name))
+        return doc
 
-        id = self.coll.insert(doc.to_python())
-        doc = InstructionDocument(**self.coll.find_one(id))  # grab ID
-        self.repo.create(self._repo_key(creator, doc), doc.instruction,
-                         author=signature(creator.name, creator.name))
+    def clone(self, creator, source, name=None):
+        """Clone an InstructionDocument for a creator, as `name` or under
+        the source's name.  The clone shares the source's stored content,
+        so nothing is encoded, validated or committed until it is changed.
+
+        Returns the InstructionDocument.
+
+        Raises a DuplicateKeyError if the creator has an instruction by
+        that name.
+        """
+        name = name or source.name
+        doc = InstructionDocument(
+            creator_id=creator.id,
+            creator_name=creator.name,
+            name=name,
+            instruction=source.instruction,
+            instruction_json=source.instruction_json,
+            tags=source.tags,
+            content_hash=source.content_hash,
+            search_terms=(source.search_terms if name == source.name else
+                          search_terms(name, source.instruction, source.tags)),
+            references=references(creator.name, source.instruction),
+            revision=1,
+            cloned_from=source.id)
+        doc.id = self.coll.insert(self._record(doc))
+        # Stores the blob too, in case the source's never was.
+        self._record_revisions([self._revision_record(doc, creator.name)])
+        self._changed([doc])
         return doc
 
     def save_or_create(self, creator, name, instruction, tags):
         """Save over the named instruction with new data if it exists,
-        or create it otherwise.
+        or create it otherwise.  Nothing is written if neither the
+        instruction nor its tags changed.
 
-        Returns the InstructionDocument.
+        Returns a tuple of the InstructionDocument and whether a new revision
+        of the instruction was recorded.
 
         Raises a ShieldException if there's a problem.
         """
-        doc = self.find(creator.name, name)
+        doc = self._find(self.coll, creator.name, name)
         if doc:
+            stored_hash = doc.content_hash or content_hash(doc.instruction)
+            if doc.tags == tags and stored_hash == content_hash(instruction):
+                return doc, False
             doc.instruction = instruction
             doc.tags = tags
-            self.save(doc)
-            return doc
+            return doc, self._save(doc, creator)
+        else:
+            return self.create(creator, name, instruction, tags), True
+
+    def import_many(self, creator, items):
+        """Save or create many instructions for a creator at once.  `items`
+        is a list of `(name, instruction, tags)`.
+
+        Everything is validated first.  Existing instructions are read with
+        one query and updated with one bulk write, new ones are written with
+        one batched insert, and the git commits are queued together.
+
+        Returns a list with a `(status, doc)` for each item, in order.
+        Status is 'created', 'updated' or 'unchanged', or 'invalid' or
+        'conflict', in which case `doc` is a message explaining why.
+        """
+        results = [None] * len(items)
+        docs = self._offload(self._validate_many, creator, items, results)
+
+        existing = self.coll.find({'creator_id': creator.id,
+                                   'name': {'$in': docs.keys()}})
+        author = signature(creator.name, creator.name)
+        updates = self.coll.initialize_unordered_bulk_op()
+        calls = []
+        revisions = []
+        changed = []
+        for found in existing:
+            stored = self._document(found)
+            if stored is None:
+                continue
+            i, doc = docs.pop(stored.name)
+            stored_hash = stored.content_hash or content_hash(stored.instruction)
+            if stored.tags == doc.tags and stored_hash == doc.content_hash:
+                results[i] = ('unchanged', stored)
+                continue
+            doc.id = stored.id
+            revised = stored_hash != doc.content_hash
+            if revised:
+                doc.revision = (stored.revision or 0) + 1
+            else:
+                doc.revision = stored.revision
+                doc.cloned_from = stored.cloned_from
+            updates.find({'_id': doc.id}).update_one(
+                self._update(found, self._record(doc), revised))
+            changed.append(doc)
+            results[i] = ('updated', doc)
+            if revised:
+                revisions.append(self._revision_record(doc, creator.name))
+                calls.append(('create' if stored.cloned_from else 'commit',
+                              self._repo_key(creator, doc),
+                              doc.instruction, author))
+
+        if changed:
+            updates.execute()
+
+        if docs:
+            new = sorted(docs.values())
+            for _, doc in new:
+                doc.revision = 1
+            records = [doc.to_python() for _, doc in new]
+            try:
+                self.coll.insert(records, continue_on_error=True)
+                inserted = set(r['_id'] for r in records)
+            except DuplicateKeyError:
+                # Someone else got some of these names first.
+                ids = [r['_id'] for r in records]
+                inserted = set(d['_id'] for d in
+                               self.coll.find({'_id': {'$in': ids}},
+                                              fields=['_id']))
+            for (i, doc), record in zip(new, records):
+                if record['_id'] in inserted:
+                    doc.id = record['_id']
+                    changed.append(doc)
+                    results[i] = ('created', doc)
+                    revisions.append(self._revision_record(doc, creator.name))
+                    calls.append(('create', self._repo_key(creator, doc),
+                                  doc.instruction, author))
+                else:
+                    results[i] = ('conflict',
+                                  "There is already an instruction with that name")
+
+        self._changed(changed)
+        if revisions:
+            self._record_revisions(revisions)
+        if calls:
+            self._git(self._apply_calls, calls)
+        return results
+
+    def _update(self, stored, record, revised):
+        """The update turning the `stored` record into `record`.  The
+        revision is incremented in place if `revised`.
+        """
+        fields = dict((k, v) for k, v in record.iteritems()
+                      if k != '_id' and not (revised and k == 'revision'))
+        update = {'$set': fields}
+        gone = [k for k in stored if k not in record]
+        if gone:
+            update['$unset'] = dict((k, 1) for k in gone)
+        if revised:
+            update['$inc'] = {'revision': 1}
+        return update
+
+    def _validate_many(self, creator, items, results):
+        """Build and validate documents for `import_many`, filling in
+        `results` for the invalid ones.
+
+        Returns a dict of the valid documents, and their index in `items`,
+        by name.
+        """
+        docs = {}
+        for i, (name, instruction, tags) in enumerate(items):
+            if name in docs:
+                results[i] = ('invalid', "Duplicate name %s in import" % name)
+                continue
+            doc = InstructionDocument(creator_id=creator.id,
+                                      creator_name=creator.name,
+                                      name=name,
+                                      instruction=instruction,
+                                      tags=tags)
+            try:
+                doc.validate()
+            except ShieldException as e:
+                results[i] = ('invalid', str(e))
+                continue
+            self._derive(doc)
+            docs[name] = (i, doc)
+        return docs
+
+    def _apply_calls(self, calls):
+        """Make several calls to the repo, as one batch if it can.
+        """
+        if hasattr(self.repo, 'batch'):
+            self.repo.batch(calls)
         else:
-            return self.create(creator, name, instruction, tags)
+            for op, key, data, author in calls:
+                getattr(self.repo, op)(key, data, author=author)
+
+    def _next_revision(self, doc):
+        """Take the next revision number of a stored instruction.
+        """
+        i = self.coll.find_and_modify({'_id': doc.id},
+                                      {'$inc': {'revision': 1}},
+                                      new=True, fields=['revision'])
+        return i['revision'] if i else 1
+
+    def _revision_record(self, doc, author):
+        return (doc.id, doc.revision, doc.content_hash, doc.instruction_json,
+                author, datetime.utcnow())
+
+    def _record_revisions(self, records):
+        """Add revisions to the side table.  `records` is a list of
+        `(instruction_id, rev, content_hash, json, author, time)`.
+        """
+        try:
+            self.blobs.insert([{'_id': hash, 'json': encoded}
+                               for _, _, hash, encoded, _, _ in records],
+                              continue_on_error=True)
+        except DuplicateKeyError:
+            pass  # the same content was stored before
+        self.revisions.insert([{'instruction_id': id, 'rev': rev,
+                                'content_hash': hash, 'author': author,
+                                'time': time}
+                               for id, rev, hash, _, author, time in records])
 
     def save(self, doc):
-        """Save an instruction.
+        """Save an instruction.  The git repo is only committed to if the
+        instruction itself changed.
 
         Returns None if the save was successful, a message explaining why it
         failed otherwise.
         """
         try:
-            doc.validate()
-            self.coll.save(doc.to_python())
+            self._save(doc)
         except ShieldException as e:
             return str(e)
 
-        creator = self.users.get(doc.creator_id)
-        self.repo.commit(self._repo_key(creator, doc), doc.instruction,
-                         author=signature(creator.name, creator.name))
+    def _save(self, doc, creator=None):
+        """Validate and save an instruction, committing it if its content
+        changed.
+
+        Returns True if there was a commit.  Raises a ShieldException if the
+        instruction is invalid.
+        """
+        creator = creator or self.users.get(doc.creator_id)
+        if creator:
+            doc.creator_name = creator.name
+
+        self._offload(doc.validate)
+        previous_hash = doc.content_hash
+        self._derive(doc)
+        revised = doc.content_hash != previous_hash
+        shared = doc.cloned_from
+        if revised:
+            doc.revision = self._next_revision(doc)
+            doc.cloned_from = None
+        self.coll.save(self._record(doc))
+        self._changed([doc])
+
+        if not revised:
+            return False
+        self._record_revisions([self._revision_record(doc, doc.creator_name)])
+        # A clone is only in the repo once it has content of its own.
+        self._git(self.repo.create if shared else self.repo.commit,
+                  self._repo_key(creator, doc),
+                  doc.instruction,
+                  author=signature(creator.name, creator.name))
+        return True
 
     def delete(self, doc):
         """Delete an instruction.
 
         Returns True if the deletion was successful.
         """
-        return self.coll.remove(doc.id)['n'] == 1
+        deleted = self.coll.remove(doc.id)['n'] == 1
+        if deleted:
+            self._changed([doc], True)
+        return deleted
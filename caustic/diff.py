@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+"""
+caustic.diff
+
+Structural diffs between JSON documents, as JSON Patch operations.  Only
+what changed is described, so a small change to a large instruction makes
+a small patch.
+"""
+
+
+def _escape(key):
+    return unicode(key).replace(u'~', u'~0').replace(u'/', u'~1')
+
+
+def _unescape(token):
+    return token.replace(u'~1', u'/').replace(u'~0', u'~')
+
+
+def _equal(a, b):
+    """Compare JSON values, without taking `true` for `1`.
+    """
+    return a == b and isinstance(a, bool) == isinstance(b, bool)
+
+
+def diff(old, new):
+    """The operations that turn `old` into `new`, a list of JSON Patch
+    `add`, `remove` and `replace` operations applied in order.
+
+    Objects are compared key by key.  Arrays are compared after trimming
+    the items they start and end with in common, so inserting or removing
+    a few items doesn't touch the rest.
+    """
+    ops = []
+    _diff(old, new, u'', ops)
+    return ops
+
+
+def _diff(old, new, path, ops):
+    if isinstance(old, dict) and isinstance(new, dict):
+        for key in sorted(old):
+            if key not in new:
+                ops.append({'op': 'remove', 'path': path + u'/' + _escape(key)})
+        for key in sorted(new):
+            child = path + u'/' + _escape(key)
+            if key in old:
+                _diff(old[key], new[key], child, ops)
+            else:
+                ops.append({'op': 'add', 'path': child, 'value': new[key]})
+    elif isinstance(old, list) and isinstance(new, list):
+        _diff_list(old, new, path, ops)
+    elif not _equal(old, new):
+        ops.append({'op': 'replace', 'path': path, 'value': new})
+
+
+def _diff_list(old, new, path, ops):
+    shorter = min(len(old), len(new))
+    start = 0
+    while start < shorter and _equal(old[start], new[start]):
+        start += 1
+    end = 0
+    while end < shorter - start and _equal(old[-1 - end], new[-1 - end]):
+        end += 1
+
+    old_middle = len(old) - end - start
+    new_middle = len(new) - end - start
+    paired = min(old_middle, new_middle)
+    for i in xrange(start, start + paired):
+        _diff(old[i], new[i], u'%s/%d' % (path, i), ops)
+    for i in reversed(xrange(start + paired, start + old_middle)):
+        ops.append({'op': 'remove', 'path': u'%s/%d' % (path, i)})
+    for i in xrange(start + paired, start + new_middle):
+        ops.append({'op': 'add', 'path': u'%s/%d' % (path, i), 'value': new[i]})
+
+
+def patch(doc, ops):
+    """Apply operations from `diff` to `doc`, changing it in place.
+
+    Returns the patched document, which is a new one if the whole document
+    was replaced.  Raises a ValueError for paths that don't exist.
+    """
+    for op in ops:
+        path = op['path']
+        if not path:
+            doc = op['value']
+            continue
+        tokens = [_unescape(t) for t in path.split(u'/')[1:]]
+        parent = doc
+        try:
+            for token in tokens[:-1]:
+                parent = parent[int(token) if isinstance(parent, list) else token]
+            last = tokens[-1]
+            if isinstance(parent, list):
+                last = int(last)
+            if op['op'] == 'add' and isinstance(parent, list):
+                parent.insert(last, op['value'])
+            elif op['op'] == 'remove':
+                del parent[last]
+            else:
+                parent[last] = op['value']
+        except (KeyError, IndexError, TypeError, ValueError):
+            raise ValueError('No such path: %s' % path)
+    return doc
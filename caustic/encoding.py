@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+
+"""
+caustic.encoding
+"""
+
+try:
+    import simplejson as json
+    json
+except ImportError:
+    import json
+
+import hashlib
+
+
+def canonical_json(value):
+    """Encode `value` as JSON with sorted keys and no extra whitespace, so
+    that equal values always encode the same way.
+    """
+    return json.dumps(value, sort_keys=True, separators=(',', ':'))
+
+
+def content_hash(value):
+    """The SHA-1 hex digest of `value`'s canonical JSON.
+    """
+    return json_hash(canonical_json(value))
+
+
+def json_hash(encoded):
+    """The SHA-1 hex digest of canonical JSON that is already encoded.
+    """
+    return hashlib.sha1(encoded).hexdigest()
+
+
+def json_array_chunks(items, size=100):
+    """Encode an iterable as a JSON array, yielding a string for every
+    `size` items so that the array can be sent before it is complete.
+    """
+    opener = '['
+    batch = []
+    for item in items:
+        batch.append(json.dumps(item))
+        if len(batch) == size:
+            yield opener + ','.join(batch)
+            opener = ','
+            batch = []
+    if batch:
+        yield opener + ','.join(batch) + ']'
+    elif opener == '[':
+        yield '[]'
+    else:
+        yield ']'
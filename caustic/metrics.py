@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+
+"""
+caustic.metrics
+
+Latency histograms and gauges, exposed in the Prometheus text format.
+Observing a value takes no lock: a green thread can't be interrupted
+partway through, and the rare race with a real thread costs at most a
+count.
+
+Each worker process keeps its own metrics, labelled with its `worker`
+index, and publishes a snapshot of them every few seconds for the others
+to read.  Whichever worker is scraped serves its own metrics merged with
+the others' latest snapshots.
+"""
+
+try:
+    import simplejson as json
+    json
+except ImportError:
+    import json
+
+import os
+import time
+import bisect
+import inspect
+import logging
+import functools
+import threading
+
+DEFAULT_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+
+
+class Histogram(object):
+    """Counts of observations no greater than each of `buckets`, with the
+    sum and count of them all.
+    """
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Registry(object):
+    """Named histograms, one for each set of labels they are observed
+    with, and gauges read when the metrics are rendered.  Every series
+    also gets the labels in `labels`.
+    """
+
+    def __init__(self):
+        self.labels = {}
+        self._declared = {}
+        self._series = {}
+        self._gauges = {}
+
+    def histogram(self, name, help, buckets=DEFAULT_BUCKETS):
+        """Declare a histogram.
+        """
+        self._declared[name] = (help, tuple(buckets))
+
+    def gauge(self, name, help, read):
+        """Declare a gauge.  `read` is called for its value, or a list of
+        `(labels, value)` tuples with a dict of labels.
+        """
+        self._gauges[name] = (help, read)
+
+    def observe(self, name, value, **labels):
+        """Add an observation to a declared histogram.
+        """
+        key = (name, tuple(sorted(labels.items())))
+        series = self._series.get(key)
+        if series is None:
+            series = self._series.setdefault(
+                key, Histogram(self._declared[name][1]))
+        series.observe(value)
+
+    def timed(self, name, **labels):
+        """Decorate a function to observe how many seconds it takes.
+        """
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                start = time.time()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    self.observe(name, time.time() - start, **labels)
+            return wrapper
+        return decorator
+
+    def instrumented(self, name):
+        """Decorate a class to time each of its public methods, labelled
+        with the class and method name.
+        """
+        def decorator(cls):
+            for attr, fn in vars(cls).items():
+                if not attr.startswith('_') and inspect.isfunction(fn):
+                    setattr(cls, attr, self.timed(
+                        name, cls=cls.__name__, method=attr)(fn))
+            return cls
+        return decorator
+
+    def snapshot(self):
+        """The current value of every series, as a dict of each metric's
+        name to its help, type, buckets if it is a histogram, and a list of
+        its series.  A snapshot can be written as JSON.
+        """
+        extra = self.labels.items()
+        families = {}
+        for name, (help, buckets) in self._declared.items():
+            families[name] = {'help': help, 'type': 'histogram',
+                              'buckets': list(buckets), 'series': []}
+        for (name, labels), series in self._series.items():
+            families[name]['series'].append(
+                [sorted(labels + tuple(extra)), list(series.counts),
+                 series.sum, series.count])
+        for name, (help, read) in self._gauges.items():
+            value = read()
+            if not isinstance(value, list):
+                value = [({}, value)]
+            families[name] = {'help': help, 'type': 'gauge',
+                              'series': [[sorted(labels.items() + extra), v]
+                                         for labels, v in value]}
+        return families
+
+    def render(self, others=()):
+        """The metrics in the Prometheus text format, merged with the
+        series of `others`, snapshots from other processes.
+        """
+        return render([self.snapshot()] + list(others))
+
+    def publish(self, directory):
+        """Write a snapshot to `directory`, named after the `worker` label,
+        for other workers to read.
+        """
+        path = os.path.join(directory, '%s.json' % self.labels['worker'])
+        with open(path + '.tmp', 'w') as snapshot:
+            json.dump(self.snapshot(), snapshot)
+        os.rename(path + '.tmp', path)
+
+    def published(self, directory, max_age, clock=time.time):
+        """The snapshots other workers have published to `directory` in
+        the last `max_age` seconds.
+        """
+        own = '%s.json' % self.labels['worker']
+        found = []
+        for filename in sorted(os.listdir(directory)):
+            path = os.path.join(directory, filename)
+            if not filename.endswith('.json') or filename == own:
+                continue
+            try:
+                if os.path.getmtime(path) < clock() - max_age:
+                    continue
+                with open(path) as snapshot:
+                    found.append(json.load(snapshot))
+            except (IOError, OSError, ValueError):
+                pass  # a worker is replacing it
+        return found
+
+
+class Publisher(object):
+    """Publishes `registry`'s snapshot to `directory` every `interval`
+    seconds, from a background thread.
+    """
+
+    def __init__(self, registry, directory, interval=5):
+        self.registry = registry
+        self.directory = directory
+        self.interval = interval
+        self._stopped = threading.Event()
+        self._thread = None
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def start(self):
+        """Start publishing.
+        """
+        self._thread = threading.Thread(target=self._run,
+                                        name='caustic-metrics')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stop publishing.
+        """
+        self._stopped.set()
+        if self._thread:
+            self._thread.join(self.interval)
+            self._thread = None
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                self.registry.publish(self.directory)
+            except (IOError, OSError):
+                logging.exception('Could not publish metrics.')
+            self._stopped.wait(self.interval)
+
+
+def render(snapshots):
+    """Snapshots in the Prometheus text format, with the series of each
+    metric merged across them.
+    """
+    merged = {}
+    for families in snapshots:
+        for name, family in families.items():
+            if name in merged:
+                merged[name]['series'].extend(family['series'])
+            else:
+                merged[name] = dict(family, series=list(family['series']))
+
+    lines = []
+    for name in sorted(merged, key=lambda n: (merged[n]['type'] != 'histogram', n)):
+        family = merged[name]
+        lines.append('# HELP %s %s' % (name, family['help']))
+        lines.append('# TYPE %s %s' % (name, family['type']))
+        series = sorted((tuple(tuple(l) for l in s[0]),) + tuple(s[1:])
+                        for s in family['series'])
+        if family['type'] == 'histogram':
+            buckets = tuple(family['buckets']) + ('+Inf',)
+            for labels, counts, total, count in series:
+                cumulative = 0
+                for bound, n in zip(buckets, counts):
+                    cumulative += n
+                    lines.append('%s_bucket%s %d' % (
+                        name, _labels(labels + (('le', bound),)), cumulative))
+                lines.append('%s_sum%s %s' % (name, _labels(labels),
+                                              _number(total)))
+                lines.append('%s_count%s %d' % (name, _labels(labels), count))
+        else:
+            for labels, value in series:
+                lines.append('%s%s %s' % (name, _labels(labels), _number(value)))
+    return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _number(value):
+    return repr(float(value))
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (k, _escape(v)) for k, v in labels)
+
+
+REGISTRY = Registry()
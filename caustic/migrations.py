@@ -367,9 +367,14 @@ if r.status_code == 400:
 
 assert r.status_code == 200, r.content
 
-for i in instructions:
-    r = s.put('%s/%s/instructions/%s' % (HOST, USER, i['name']), data = {
-        'instruction': json.dumps(i['json']),
-        'tags': json.dumps([str(e) for e in i.get('tags', [])])
-    })
-    assert r.status_code == 201, r.content
+r = s.post('%s/%s/instructions' % (HOST, USER),
+           headers={'content-type': 'application/json'},
+           data=json.dumps([{
+               'name': i['name'],
+               'instruction': i['json'],
+               'tags': [str(e) for e in i.get('tags', [])]
+           } for i in instructions]))
+assert r.status_code == 200, r.content
+
+for result in json.loads(r.content):
+    assert 'error' not in result, result
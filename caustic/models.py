@@ -1,52 +1,47 @@
-import validictory
-
-import schema
+import validator
 
 from dictshield.document import Document
 from dictshield.base import ShieldException
-from dictshield.fields import StringField, BooleanField, DictField
+from dictshield.fields import StringField, BooleanField, DictField, IntField
 from dictshield.fields.compound import ListField
 from dictshield.fields.mongo import ObjectIdField
 
 class InstructionField(DictField):
     """
-    A DictField that can only hold instructions validated by schema.
+    A DictField that can only hold instructions validated by the schemas
+    compiled in `validator`.
     """
 
     def validate(self, value):
         super(DictField, self).validate(value)
         try:
-            validictory.validate(value, schema.INSTRUCTION)
-        except ValueError as instruction_err:
-            errors = []
-            # We don't know which schema it failed against, if it wasn't within
-            # a 'then' block we may be able to be more specific.
-            try:
-                validictory.validate(value, schema.FIND)
-            except ValueError as find_err:
-                errors.append(find_err)
-
-            try:
-                validictory.validate(value, schema.LOAD)
-            except ValueError as load_err:
-                errors.append(load_err)
-
-            if not errors:
-                errors = [instruction_err]
-
-            raise ShieldException("Invalid Instruction: %s" % errors,
-                                  'instruction', value)
+            validator.validate_instruction(value)
+        except validator.InstructionError as error:
+            raise ShieldException(str(error), 'instruction', value)
 
 class InstructionDocument(Document):
     """
     An Instruction Document has not just the instruction, but also a name, tags,
-    and a creator ID.
+    and a creator ID.  The creator's name is kept too, for lookups by name,
+    as are the instruction's canonical JSON, to serve it as is, a hash of
+    that, to tell when it has changed, the terms it can be searched by, the
+    paths of the instructions it refers to, and its latest revision number.
+
+    A clone keeps the id of the instruction it was cloned from, and shares
+    its content, until it is first changed.
     """
     id = ObjectIdField(id_field=True)
     creator_id = ObjectIdField(required=True)
+    creator_name = StringField()
     name = StringField(required=True)
     tags = ListField(StringField())
     instruction = InstructionField(required=True)
+    instruction_json = StringField()
+    content_hash = StringField()
+    search_terms = ListField(StringField())
+    references = ListField(StringField())
+    revision = IntField()
+    cloned_from = ObjectIdField()
 
 class User(Document):
     """
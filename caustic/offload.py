@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+"""
+caustic.offload
+
+Brubeck serves requests on green threads.  Anything that blocks without
+yielding -- libgit2, or a long stretch of Python -- holds up every request,
+so it is run on real threads instead.
+"""
+
+import time
+import threading
+
+
+def _executor(size):
+    """A function that runs a call on one of `size` real threads, blocking
+    only the calling green thread, or None if threads aren't green.
+    """
+    try:
+        from gevent import monkey
+        if monkey.is_module_patched('threading'):
+            from gevent.threadpool import ThreadPool
+            pool = ThreadPool(size)
+            return lambda fn, args, kwargs: pool.apply(fn, args, kwargs)
+    except ImportError:
+        pass
+    try:
+        from eventlet import patcher, tpool
+        if patcher.is_monkey_patched('thread'):
+            tpool.set_num_threads(size)
+            return lambda fn, args, kwargs: tpool.execute(fn, *args, **kwargs)
+    except ImportError:
+        pass
+    return None
+
+
+class ThreadPool(object):
+    """Runs blocking calls on `size` threads.  No more than `max_queue`
+    calls wait for a thread; callers beyond that wait to submit theirs.
+
+    Without green threads, calls are simply made in the caller's thread.
+    """
+
+    def __init__(self, size=4, max_queue=64):
+        self.size = size
+        self._execute = _executor(size)
+        self._slots = threading.BoundedSemaphore(size + max_queue)
+        self.pending = 0
+        self.calls = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def run(self, fn, *args, **kwargs):
+        """Call `fn` with `args` and `kwargs` on a thread, and return what
+        it returns.  Exceptions are raised here.
+        """
+        submitted = time.time()
+        started = []
+
+        def call():
+            started.append(time.time())
+            return fn(*args, **kwargs)
+
+        self.pending += 1
+        try:
+            with self._slots:
+                if self._execute:
+                    return self._execute(call, (), {})
+                else:
+                    return call()
+        finally:
+            self.pending -= 1
+            if started:
+                self._waited(started[0] - submitted)
+
+    def _waited(self, wait):
+        self.calls += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+
+    @property
+    def queue_depth(self):
+        """The number of calls waiting for a thread.
+        """
+        return max(0, self.pending - self.size)
+
+    def stats(self):
+        """How busy the pool is, and how long calls have waited for it.
+        Waits are in seconds.
+        """
+        return {
+            'size': self.size,
+            'pending': self.pending,
+            'queue_depth': self.queue_depth,
+            'calls': self.calls,
+            'total_wait': self.total_wait,
+            'mean_wait': self.total_wait / self.calls if self.calls else 0.0,
+            'max_wait': self.max_wait,
+        }
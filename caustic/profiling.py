@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+
+"""
+caustic.profiling
+
+Profiles of slow requests, kept on disk to see where the time went.  Only
+some requests are profiled: a sample of them, and those carrying a signed
+`X-Caustic-Profile` header.
+
+    python caustic/profiling.py <MODE>
+
+prints a header value that is good for an hour.
+"""
+
+import os
+import re
+import hmac
+import time
+import random
+import hashlib
+import cProfile
+import itertools
+
+from sessions import _equal
+
+PROFILE_NAME = re.compile(r'^(\d{13})-(\d{3})-(\d+)ms-(\w+)\.prof$')
+
+
+class RequestProfiler(object):
+    """Profiles a `sample_rate` fraction of requests, and requests with a
+    token signed with `secret`.  Profiles of those taking `threshold`
+    seconds or more are written to `directory`, which keeps the latest
+    `keep` of them.
+
+    Writes are made through `pool`, a ThreadPool, if there is one.
+
+    Requests share a thread as green threads, and a profiler sees every
+    call in its thread, so only one request per process is profiled at a
+    time; others arriving meanwhile are not profiled.  A request's elapsed
+    time is wall-clock time, including any it spent waiting while other
+    requests ran.
+    """
+
+    def __init__(self, directory, secret, threshold=1.0, keep=50,
+                 sample_rate=0.0, pool=None, clock=time.time):
+        self.directory = directory
+        self.secret = str(secret)
+        self.threshold = threshold
+        self.keep = keep
+        self.sample_rate = sample_rate
+        self.pool = pool
+        self.clock = clock
+        self._seq = itertools.count()
+        self._active = False
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def token(self, ttl=3600):
+        """A token allowing requests to be profiled, and profiles to be
+        read, for `ttl` seconds.
+        """
+        expires = str(int(self.clock() + ttl))
+        return '%s.%s' % (expires, self._sign(expires))
+
+    def authorized(self, token):
+        """Returns True if `token` is one of ours and hasn't expired.
+        """
+        if not token or token.count('.') != 1:
+            return False
+        try:
+            expires, signature = str(token).split('.')
+        except ValueError:
+            return False  # not ASCII
+        return (expires.isdigit() and int(expires) > self.clock() and
+                _equal(signature, self._sign(expires)))
+
+    def wants(self, token):
+        """Returns True if a request with `token`, which may be None,
+        should be profiled.
+        """
+        if self.sample_rate and random.random() < self.sample_rate:
+            return True
+        return self.authorized(token)
+
+    def run(self, name, fn, *args, **kwargs):
+        """Call `fn`, keeping a profile of it as `name` if it was slow.
+        If another call is being profiled, `fn` is just called.
+        """
+        if self._active:
+            return fn(*args, **kwargs)
+        self._active = True
+        profile = cProfile.Profile()
+        start = self.clock()
+        try:
+            return profile.runcall(fn, *args, **kwargs)
+        finally:
+            self._active = False
+            elapsed = self.clock() - start
+            if elapsed >= self.threshold:
+                if self.pool:
+                    self.pool.run(self.save, name, elapsed, profile)
+                else:
+                    self.save(name, elapsed, profile)
+
+    def save(self, name, elapsed, profile):
+        """Write a profile, dropping the oldest beyond `keep`.
+        """
+        filename = '%013d-%03d-%dms-%s.prof' % (
+            self.clock() * 1000, next(self._seq) % 1000, elapsed * 1000,
+            re.sub(r'\W', '_', name))
+        profile.dump_stats(os.path.join(self.directory, filename))
+        for old in self._filenames()[self.keep:]:
+            try:
+                os.remove(os.path.join(self.directory, old))
+            except OSError:
+                pass  # another worker removed it
+
+    def profiles(self):
+        """The profiles kept, newest first, as dicts of their `id`, when
+        they were written, how many milliseconds the request took, and its
+        name.
+        """
+        found = []
+        for filename in self._filenames():
+            written, _, elapsed, name = PROFILE_NAME.match(filename).groups()
+            found.append({'id': filename[:-len('.prof')],
+                          'time': int(written) / 1000.0,
+                          'elapsed_ms': int(elapsed),
+                          'name': name})
+        return found
+
+    def path(self, id):
+        """The path of a kept profile, or None if there is no such profile.
+        """
+        filename = '%s.prof' % id
+        if PROFILE_NAME.match(filename):
+            path = os.path.join(self.directory, filename)
+            if os.path.exists(path):
+                return path
+        return None
+
+    def _filenames(self):
+        return sorted((f for f in os.listdir(self.directory)
+                       if PROFILE_NAME.match(f)), reverse=True)
+
+    def _sign(self, expires):
+        return hmac.new(self.secret, 'profile:' + expires,
+                        hashlib.sha256).hexdigest()
+
+
+if __name__ == '__main__':
+    from config import COOKIE_SECRET, PROFILE_DIR
+    print RequestProfiler(PROFILE_DIR, COOKIE_SECRET).token()
@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+
+"""
+caustic.resolver
+
+Expands the references between instructions -- `extends`, and paths in
+`then` -- into a single document, so clients don't have to chase them.
+"""
+
+import time
+import threading
+
+from cache import LRUCache
+
+_MISSING = object()
+
+
+class ReferenceCycleError(ValueError):
+    """An instruction extends itself, directly or through others.
+    """
+
+    def __init__(self, chain):
+        self.chain = chain
+        ValueError.__init__(self, "Instruction extends itself: %s" %
+                            ' -> '.join(reference_path(*k) for k in chain))
+
+
+def reference_path(creator_name, name):
+    """The canonical path of an instruction.
+    """
+    return '/%s/instructions/%s' % (creator_name, name)
+
+
+def parse_reference(owner, value):
+    """Parse a path reference.  `/<name>` is an instruction belonging to
+    `owner`, `/<user>/instructions/<name>` is anyone's.
+
+    Returns a `(creator_name, name)` tuple, or None if `value` isn't a path.
+    """
+    if not isinstance(value, basestring) or not value.startswith('/'):
+        return None
+    parts = value[1:].split('/')
+    if len(parts) == 1 and parts[0]:
+        return owner, parts[0]
+    elif len(parts) == 3 and parts[0] and parts[1] == 'instructions' and parts[2]:
+        return parts[0], parts[2]
+    return None
+
+
+def references(owner, instruction):
+    """The paths of the instructions an instruction refers to directly,
+    through `then` or `extends`.  Without an `owner`, references to its
+    own instructions are left out.
+
+    Returns a sorted list of canonical paths.
+    """
+    found = set()
+    _collect(owner, instruction, found)
+    return sorted(reference_path(*r) for r in found if r[0])
+
+
+def _collect(owner, instruction, found):
+    reference = parse_reference(owner, instruction)
+    if reference:
+        found.add(reference)
+    elif isinstance(instruction, list):
+        for item in instruction:
+            _collect(owner, item, found)
+    elif isinstance(instruction, dict):
+        _collect(owner, instruction.get('then'), found)
+        reference = parse_reference(owner, instruction.get('extends'))
+        if reference:
+            found.add(reference)
+
+
+def merge(base, override):
+    """Merge `override` into a copy of `base`.  Objects are merged key by
+    key, anything else in `override` replaces what's in `base`.
+    """
+    merged = dict(base)
+    for key, value in override.iteritems():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = merge(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+
+class Resolver(object):
+    """Resolves instructions, memoising the results.
+
+    A resolved instruction is forgotten as soon as any instruction it was
+    built from -- or a missing one it referred to -- is saved, created or
+    deleted.  References that can't be found are left as they are, as are
+    `then` references back into an instruction being expanded, since those
+    describe a recursive scrape.  An `extends` cycle is an error.
+
+    Results also expire after `cache_ttl` seconds, to catch changes made
+    behind Instructions' back, like a user being deleted.  Instructions
+    are read from the primary, so that a change isn't followed by a stale
+    read from a secondary.
+
+    If other processes write instructions too, pass the `changes` they
+    log to, a Changes: it is read at most every `poll_interval` seconds,
+    and the resolved instructions built from what changed are forgotten.
+    """
+
+    def __init__(self, instructions, cache_size=1024, cache_ttl=300,
+                 changes=None, poll_interval=1.0, clock=time.time):
+        self.instructions = instructions
+        self.cache = LRUCache(cache_size, cache_ttl, on_evict=self._evicted)
+        self.changes = changes
+        self.poll_interval = poll_interval
+        self.clock = clock
+        self._lock = threading.RLock()
+        self._generation = 0
+        self._dependents = {}
+        self._used = {}
+        self._polled = None
+        instructions.listeners.append(self.changed)
+
+    def resolve(self, creator_name, name):
+        """Resolve an instruction by creator name and its own name.
+
+        Returns the resolved instruction, or None if it doesn't exist.
+        Raises a ReferenceCycleError if it extends itself.
+        """
+        key = (creator_name, name)
+        if self.changes:
+            self._poll()
+        resolved = self.cache.get(key, _MISSING)
+        if resolved is not _MISSING:
+            return resolved
+
+        generation = self._generation
+        used = set()
+        resolved = self._follow(key, None, [], used)
+
+        with self._lock:
+            # Don't remember anything that changed while we were reading it.
+            if generation == self._generation:
+                self._forget(key)
+                self._used[key] = used
+                for dependency in used:
+                    self._dependents.setdefault(dependency, set()).add(key)
+                self.cache.set(key, resolved)
+        return resolved
+
+    def invalidate(self, creator_name, name):
+        """Forget every resolved instruction built from this one.
+        """
+        with self._lock:
+            self._generation += 1
+            for key in list(self._dependents.get((creator_name, name), ())):
+                self._forget(key)
+                self.cache.delete(key)
+
+    def _forget(self, key):
+        """Stop tracking what a resolved instruction was built from.
+        Called with the lock held.
+        """
+        for dependency in self._used.pop(key, ()):
+            dependents = self._dependents.get(dependency)
+            if dependents is not None:
+                dependents.discard(key)
+                if not dependents:
+                    del self._dependents[dependency]
+
+    def _evicted(self, key):
+        with self._lock:
+            self._forget(key)
+
+    def _poll(self):
+        """Invalidate what other processes have changed, if it's been
+        `poll_interval` seconds since we last looked.
+        """
+        now = self.clock()
+        if self._polled is not None and now - self._polled < self.poll_interval:
+            return
+        self._polled = now
+        for key in self.changes.read():
+            self.invalidate(*key)
+
+    def changed(self, doc, deleted=False):
+        """Listener for writes to Instructions.
+        """
+        self.invalidate(doc.creator_name, doc.name)
+
+    def _follow(self, key, reference, stack, used):
+        """Expand the instruction at `key`, or return `reference` unchanged
+        if it doesn't exist or is already being expanded.
+        """
+        used.add(key)
+        if key in stack:
+            return reference
+        doc = self.instructions.find(key[0], key[1], primary=True)
+        if doc is None:
+            return reference
+        return self._expand(key[0], doc.instruction, stack + [key], used)
+
+    def _expand(self, owner, instruction, stack, used):
+        reference = parse_reference(owner, instruction)
+        if reference:
+            return self._follow(reference, instruction, stack, used)
+        elif isinstance(instruction, list):
+            return [self._expand(owner, i, stack, used) for i in instruction]
+        elif not isinstance(instruction, dict):
+            return instruction
+
+        own = dict(instruction)
+        if 'then' in own:
+            own['then'] = self._expand(owner, own['then'], stack, used)
+
+        reference = parse_reference(owner, own.get('extends'))
+        if not reference:
+            return own
+        used.add(reference)
+        if reference in stack:
+            raise ReferenceCycleError(stack + [reference])
+        base = self._follow(reference, None, stack, used)
+        if not isinstance(base, dict):
+            return own
+        del own['extends']
+        return merge(base, own)
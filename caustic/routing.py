@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+
+"""
+caustic.routing
+
+Routes request paths one segment at a time, instead of trying a list of
+regexes in turn.
+"""
+
+import re
+
+
+class SegmentRouter(object):
+    """A trie of routes.  A pattern like `/:user/instructions/:name` has
+    literal segments, and `:`-prefixed ones that capture any segment made
+    of `valid_chars`, a regex character class.  A trailing slash is
+    optional, as it is in `regex`.
+
+    Literal segments are preferred to captures.  The routes of up to
+    `memo_size` recent paths are remembered, since clients poll the same
+    ones over and over.
+    """
+
+    def __init__(self, valid_chars, memo_size=10000):
+        self.valid_chars = valid_chars
+        self.memo_size = memo_size
+        self._valid_path = re.compile('(?:/[%s/]*)?$' % valid_chars)
+        self._root = _Node()
+        self._memo = {}
+
+    def add(self, pattern, handler):
+        """Route paths matching `pattern` to `handler`.
+        """
+        node = self._root
+        for segment in _segments(pattern):
+            if segment.startswith(':'):
+                if node.capture is None:
+                    node.capture = _Node()
+                node = node.capture
+            else:
+                node = node.literals.setdefault(segment, _Node())
+        node.handler = handler
+        self._memo.clear()
+
+    def regex(self, pattern):
+        """The regex matching the same paths as `pattern`, for routers that
+        try regexes.
+        """
+        parts = ['([%s]+)' % self.valid_chars if s.startswith(':') else re.escape(s)
+                 for s in _segments(pattern)]
+        return '^/%s/?$' % '/'.join(parts) if parts else '^/?$'
+
+    def match(self, path):
+        """Find the route for a path.
+
+        Returns a tuple of its handler and a tuple of the captured segments,
+        or None if no route matches.
+        """
+        try:
+            return self._memo[path]
+        except KeyError:
+            pass
+        if len(self._memo) >= self.memo_size:
+            self._memo.clear()
+        found = self._memo[path] = self._route(path)
+        return found
+
+    def _route(self, path):
+        # With every character valid, any non-empty segment can be captured.
+        if not self._valid_path.match(path):
+            return None
+        if path.endswith('/'):
+            path = path[:-1]
+        segments = path[1:].split('/') if path else []
+
+        node = self._root
+        captured = ()
+        passed_capture = False
+        for segment in segments:
+            child = node.literals.get(segment)
+            if child is not None:
+                passed_capture = passed_capture or node.capture is not None
+            elif node.capture is not None and segment:
+                child = node.capture
+                captured += (segment,)
+            else:
+                break
+            node = child
+        else:
+            if node.handler is not None:
+                return node.handler, captured
+
+        if passed_capture:
+            # A literal segment led nowhere, but capturing it might not.
+            return self._search(self._root, segments, 0, ())
+        return None
+
+    def _search(self, node, segments, i, captured):
+        if i == len(segments):
+            return (node.handler, captured) if node.handler else None
+        segment = segments[i]
+        child = node.literals.get(segment)
+        if child:
+            found = self._search(child, segments, i + 1, captured)
+            if found:
+                return found
+        if node.capture and segment:
+            return self._search(node.capture, segments, i + 1,
+                                captured + (segment,))
+        return None
+
+
+class _Node(object):
+    __slots__ = ('literals', 'capture', 'handler')
+
+    def __init__(self):
+        self.literals = {}
+        self.capture = None
+        self.handler = None
+
+
+def _segments(pattern):
+    return [s for s in pattern.split('/') if s]
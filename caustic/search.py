@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+
+"""
+caustic.search
+
+Search terms for instructions.  Each instruction stores its terms, and an
+index over them makes an inverted index that is kept up to date by every
+write.
+"""
+
+import re
+
+WORD = re.compile(r'\w+', re.UNICODE)
+# Tags are kept among the words, but a word can't begin with this, so no
+# query word can match one.
+TAG_PREFIX = '#'
+
+
+def words(text):
+    """The lowercased words in a string.
+    """
+    return WORD.findall(text.lower()) if isinstance(text, basestring) else []
+
+
+def _metadata_words(value):
+    if isinstance(value, dict):
+        for key, item in value.iteritems():
+            for word in words(key):
+                yield word
+            for word in _metadata_words(item):
+                yield word
+    elif isinstance(value, list):
+        for item in value:
+            for word in _metadata_words(item):
+                yield word
+    else:
+        for word in words(value):
+            yield word
+
+
+def search_terms(name, instruction, tags):
+    """The terms an instruction can be found by: words from its name and
+    tags, and from the `name`, `description` and `metadata` of the
+    instruction itself, as well as each tag exactly.
+
+    Returns a sorted list.
+    """
+    terms = set(words(name))
+    for tag in tags or []:
+        terms.add(tag_term(tag))
+        terms.update(words(tag))
+    if isinstance(instruction, dict):
+        terms.update(words(instruction.get('name')))
+        terms.update(words(instruction.get('description')))
+        terms.update(_metadata_words(instruction.get('metadata')))
+    return sorted(terms)
+
+
+def tag_term(tag):
+    """The term an exact tag is stored as.
+    """
+    return TAG_PREFIX + tag
@@ -13,54 +13,178 @@ except ImportError:
     import json
 
 import logging
+import time
 import re
+import urllib
 from jsongit import JsonGitRepository
+from bson.objectid import ObjectId
+from bson.errors import InvalidId
+from pymongo.errors import DuplicateKeyError
 from dictshield.base import ShieldException
 from brubeck.request_handling import Brubeck
 from brubeck.auth import UserHandlingMixin
 
 from brubeck.templating import MustacheRendering, load_mustache_env
-from config     import DB_NAME, DB_HOST, DB_PORT, COOKIE_SECRET, RECV_SPEC, \
-                       SEND_SPEC, JSON_GIT_DIR, TEMPLATE_DIR, VALID_URL_CHARS
-from database   import Users, Instructions, get_db
+from config     import DB_NAME, DB_HOST, DB_PORT, DB_REPLICA_SET, \
+                       DB_POOL_SIZE, DB_SECONDARY_READS, COOKIE_SECRET, RECV_SPEC, \
+                       SEND_SPEC, JSON_GIT_DIR, TEMPLATE_DIR, VALID_URL_CHARS, \
+                       JSON_GIT_JOURNAL, JSON_GIT_BATCH_WINDOW, JSON_GIT_LOCK, \
+                       WORKERS, THREAD_POOL_SIZE, THREAD_POOL_QUEUE, \
+                       TEMPLATE_CACHE_SIZE, REVISION_CACHE_SIZE, PROFILE_DIR, \
+                       PROFILE_THRESHOLD, PROFILE_KEEP, PROFILE_SAMPLE_RATE, \
+                       METRICS_DIR, METRICS_INTERVAL, SESSION_MAX_AGE
+from database   import Users, Instructions, Changes, get_db, \
+                       SEARCH_LIMIT, MAX_SEARCH_LIMIT
+from commits    import CommitQueue, journals
+from encoding   import json_array_chunks, content_hash
+from resolver   import Resolver, ReferenceCycleError
+from workers    import Supervisor
+from offload    import ThreadPool
+from sessions   import SessionTokens
+from routing    import SegmentRouter
+from templates  import CompiledTemplates
+from metrics    import REGISTRY, Publisher
+from profiling  import RequestProfiler
+
+IMPORT_CONTENT_TYPES = ('application/json', 'application/x-ndjson')
+RESERVED_NAMES = ('search', 'metrics', 'profiles')  # top-level paths that aren't users
+TIMED_METHODS = ('GET', 'POST', 'PUT', 'DELETE', 'HEAD')  # any other is 'other'
+
+REGISTRY.histogram('caustic_request_seconds',
+                   'Seconds taken to handle requests, by handler and method.')
 
 class Handler(MustacheRendering, UserHandlingMixin):
     """
     An extended handler.
     """
 
+    def __call__(self):
+        """
+        Handle the request, timing it by handler and method, and profiling
+        it if the profiler wants it.
+        """
+        start = time.time()
+        method = self.message.method
+        if method not in TIMED_METHODS:
+            method = 'other'
+        try:
+            profiler = self.application.profiler
+            if profiler.wants(self.message.headers.get('x-caustic-profile')):
+                return profiler.run('%s_%s' % (type(self).__name__, method),
+                                    super(Handler, self).__call__)
+            return super(Handler, self).__call__()
+        finally:
+            REGISTRY.observe('caustic_request_seconds', time.time() - start,
+                             handler=type(self).__name__, method=method)
+
     def instruction_to_path(self, user_name, instruction_doc):
         """
-        Convert an instruction to its path.
+        Convert an instruction, or just its name, to its path.
         """
         return "/%s/instructions/%s" % (user_name, instruction_doc.name)
 
     def instruction_paths(self, user_name, instruction_docs):
         """
-        Convert a list of instruction documents to a list of their paths.
+        Convert a list of instruction documents or names to a list of their
+        paths.
         """
         return [self.instruction_to_path(user_name, doc) for doc in instruction_docs]
 
+    def listing_arguments(self):
+        """
+        Return the `after` and `limit` arguments for a paginated listing.
+        Raises a ValueError if `limit` is not a positive integer.
+        """
+        after = self.get_argument('after') or None
+        limit = self.get_argument('limit')
+        if limit:
+            limit = int(limit)
+            if limit < 1:
+                raise ValueError('limit must be positive')
+        return after, limit or None
+
+    def get_flag(self, name):
+        """
+        Returns True if the argument `name` is `true`, `1`, `yes` or `on`.
+        """
+        value = self.get_argument(name) or ''
+        return value.lower() in ('true', '1', 'yes', 'on')
+
+    def link_next_page(self, names, limit):
+        """
+        Add a `Link` header for the page after `names`, if it was full.
+        """
+        if limit and len(names) == limit:
+            self.headers['Link'] = '<%s?after=%s&limit=%d>; rel="next"' % (
+                self.message.path, urllib.quote(names[-1].name), limit)
+
+    def stream_json(self, items):
+        """
+        Send `items` to Mongrel2 as a JSON array, a chunk at a time, using
+        chunked transfer encoding.  Returns the empty reply that closes the
+        connection afterwards.
+        """
+        conn = self.application.m2conn
+        self.set_status(200)
+        self.headers['Content-Type'] = 'application/json'
+        self.headers['Transfer-Encoding'] = 'chunked'
+        self.convert_cookies()
+        conn.reply(self.message, "HTTP/1.1 %s %s\r\n%s\r\n\r\n" % (
+            self.status_code, self.status_msg,
+            "\r\n".join('%s: %s' % h for h in self.headers.items())))
+        for chunk in json_array_chunks(items):
+            conn.reply(self.message, "%x\r\n%s\r\n" % (len(chunk), chunk))
+        conn.reply(self.message, "0\r\n\r\n")
+        return ''
+
     def get_current_user(self):
         """
-        Return the User DictShield model from the database using
-        cookie session.  Returns `None` if there is no current user.
+        Return the User DictShield model for the session token, without
+        reading the database.  Sessions from before tokens hold only the
+        user's id, and are looked up in the process-wide session cache or
+        the database.  Returns `None` if there is no current user.
+        `current_user` keeps this for the request.
         """
+        session = self.application.sessions.read(self.get_cookie('session'))
+        if session:
+            return self.application.users.for_token(session)
         id = self.get_cookie('session', None, self.application.cookie_secret)
-        return self.application.users.get(id) if id else None
+        return self.application.users.for_session(id) if id else None
 
     def set_current_user(self, user):
         """
-        Set the cookie that will be used for session management.
-        `user` is a User.
+        Set the session token cookie.  `user` is a User.
         """
-        self.set_cookie('session', user.id, self.application.cookie_secret)
+        users = self.application.users
+        self.set_cookie('session', self.application.sessions.issue(
+            user, users.generation(user.id)))
+        self._current_user = user
 
     def logout_user(self):
         """
         Log out the current user.  Returns None
         """
         self.delete_cookie('session')
+        self._current_user = None
+
+    def render_template(self, template_file, _status_code=200, **context):
+        """
+        Render a template compiled at startup, or a cached rendering of it.
+        """
+        body = self.application.templates.render(template_file, context)
+        self.set_body(body, status_code=_status_code)
+        return self.render()
+
+    def etag_matches(self, etag):
+        """
+        Returns True if the request's `If-None-Match` header matches `etag`.
+        """
+        header = self.message.headers.get('if-none-match')
+        if not header:
+            return False
+        tags = [t.strip() for t in header.split(',')]
+        return '*' in tags or etag in (t[2:] if t.startswith('W/') else t
+                                       for t in tags)
 
     def is_json_request(self):
         """
@@ -91,6 +215,9 @@ class IndexHandler(Handler):
                 elif re.search(r'[^%s]' % VALID_URL_CHARS, user_name):
                     context['error'] = 'Illegal character in requested user name'
                     status = 400
+                elif user_name in RESERVED_NAMES:
+                    context['error'] = "User name '%s' is reserved." % user_name
+                    status = 400
                 elif self.application.users.find(user_name):
                     context['error'] = "User name '%s' is already in use." % user_name
                     status = 400
@@ -184,16 +311,29 @@ class InstructionCollectionHandler(Handler):
 
     def get(self, user_name):
         """
-        Provide a listing of all this user's instructions.
+        Provide a listing of all this user's instructions, a page at a time
+        if `limit` is given.  JSON listings are streamed if `stream` is set.
         """
         context = { 'user': user_name }
-        instructions = self.application.instructions.for_creator(user_name)
-        if instructions == None:
-            context['error'] = "User %s does not exist." % user_name
-            status = 404
+        try:
+            after, limit = self.listing_arguments()
+            instructions = self.application.instructions.names_for_creator(
+                user_name, after, limit)
+        except ValueError as error:
+            context['error'] = 'Invalid arguments: %s.' % error
+            status = 400
         else:
-            context['instructions'] = self.instruction_paths(user_name, instructions)
-            status = 200
+            if instructions == None:
+                context['error'] = "User %s does not exist." % user_name
+                status = 404
+            elif self.is_json_request() and self.get_flag('stream'):
+                return self.stream_json(self.instruction_to_path(user_name, i)
+                                        for i in instructions)
+            else:
+                instructions = list(instructions)
+                self.link_next_page(instructions, limit)
+                context['instructions'] = self.instruction_paths(user_name, instructions)
+                status = 200
 
         if self.is_json_request():
             if status == 200:
@@ -208,42 +348,32 @@ class InstructionCollectionHandler(Handler):
 
     def post(self, user_name):
         """
-        Allow for cloning and creation.
+        Allow for cloning the instruction at the path `clone`, creation,
+        and bulk imports of a JSON array or NDJSON body.
         """
         context = {}
         user = self.application.users.find(user_name)
-        if user != self.current_user:
+        # Documents compare with `==` but not `!=`, so compare ids.
+        current = self.current_user
+        if not user or not current or user.id != current.id:
             context['error'] = 'You cannot modify these resources.'
             status = 403
+        elif self.is_import_request():
+            return self.import_instructions(user)
+        elif self.get_argument('clone'):
+            status = self.clone_instruction(user, self.get_argument('clone'),
+                                            self.get_argument('name'), context)
         else:
             action = self.get_argument('action')
             if action == 'create':
                 name = self.get_argument('name')
-                if self.application.instructions.find(user_name, name):
+                if self.application.instructions.find(user_name, name,
+                                                      primary=True):
                     status = 409
                     context['error'] = "There is already an instruction with that name"
                 else:
                     status = 302
                     self.headers['Location'] = name  # they will be able to create it there
-            # elif action == 'clone':
-            #     owner = self.application.users.find(self.get_argument('owner'))
-            #     name = self.get_argument('name')
-
-            #     if not owner:
-            #         status = 404
-            #         context['error'] = "There is no user %s" % owner
-            #     elif name in user.instructions:
-            #         status = 409
-            #         context['error'] = "You already have an instruction with that name"
-            #     elif name in owner.instructions:
-            #         user.instructions[name] = owner.instructions[name]
-            #         self.db_conn.users.save(user.to_python())
-            #         self.repo.create('/'.join(user, name), user.instructions[name])
-            #         status = 303 # forward to page for instruction
-            #         self.headers['Location'] = name
-            #     else:
-            #         status = 409
-            #         context['error'] = "Could not clone the instruction."
             else:
                 context['error'] = 'Unknown action'
                 status = 400
@@ -255,20 +385,120 @@ class InstructionCollectionHandler(Handler):
         else:
             return self.render_template('created', _status_code=status, **context)
 
+    def clone_instruction(self, user, path, name, context):
+        """
+        Clone the instruction at `path` for `user`, as `name` if it is
+        given.  Returns the status, and fills in `context`.
+        """
+        match = re.match(r'^/([^/]+)/instructions/([^/]+)/?$', path)
+        source = match and self.application.instructions.find(
+            *match.groups(), primary=True)
+        if not source:
+            context['error'] = "There is no instruction at %s" % path
+            return 404
+        name = name or source.name
+        if not re.match('^[%s]+$' % VALID_URL_CHARS, name):
+            context['error'] = "Invalid name %s" % name
+            return 400
+        try:
+            doc = self.application.instructions.clone(user, source, name)
+        except DuplicateKeyError:
+            context['error'] = "You already have an instruction with that name"
+            return 409
+        self.headers['Location'] = self.instruction_to_path(user.name, doc)
+        return 201
+
+    def is_import_request(self):
+        """
+        Returns True if the body is JSON or NDJSON to import.
+        """
+        content_type = self.message.headers.get('content-type', '')
+        return content_type.split(';')[0].strip() in IMPORT_CONTENT_TYPES
+
+    def import_instructions(self, user):
+        """
+        Save or create every `{name, instruction, tags}` object in the body,
+        and respond with the result for each.
+        """
+        body = self.message.body
+        try:
+            if 'ndjson' in self.message.headers.get('content-type'):
+                items = [json.loads(line) for line in body.splitlines()
+                         if line.strip()]
+            else:
+                items = json.loads(body)
+                if not isinstance(items, list):
+                    raise ValueError('expected an array')
+        except ValueError as error:
+            context = {'error': 'Invalid JSON: %s.' % error}
+            status = 400
+        else:
+            results = [None] * len(items)
+            valid = []
+            for i, item in enumerate(items):
+                name = item.get('name') if isinstance(item, dict) else None
+                if not isinstance(name, basestring) or \
+                   not re.match(r'^[%s]+$' % VALID_URL_CHARS, name):
+                    results[i] = (name, 'invalid', 'Invalid instruction name')
+                else:
+                    valid.append((i, (name, item.get('instruction'),
+                                      item.get('tags', []))))
+            imported = self.application.instructions.import_many(
+                user, [item for _, item in valid])
+            for (i, (name, _, _)), (result, detail) in zip(valid, imported):
+                results[i] = (name, result, detail)
+
+            context = {'results': []}
+            for name, result, detail in results:
+                if result in ('invalid', 'conflict'):
+                    context['results'].append({'name': name, 'status': result,
+                                               'error': detail})
+                else:
+                    context['results'].append({
+                        'name': name, 'status': result,
+                        'path': self.instruction_to_path(user.name, detail)})
+            status = 200
+
+        if self.is_json_request():
+            if status == 200:
+                context = context['results']
+            self.set_body(json.dumps(context))
+            self.set_status(status)
+            return self.render()
+        else:
+            return self.render_template('imported', _status_code=status,
+                                        **context)
+
 class TagCollectionHandler(Handler):
     """
     This handler provides access to all of a user's instructions with a certain
     tag.
     """
     def get(self, user_name, tag):
+        """
+        Provide a listing of this user's instructions with the tag, paginated
+        and streamed like the full listing.
+        """
         context = {'tag': tag, 'user': user_name}
-        instructions = self.application.instructions.tagged(user_name, tag)
-        if instructions == None:
-            status = 404
-            context['error'] = "No user %s" % user_name
+        try:
+            after, limit = self.listing_arguments()
+            instructions = self.application.instructions.names_tagged(
+                user_name, tag, after, limit)
+        except ValueError as error:
+            context['error'] = 'Invalid arguments: %s.' % error
+            status = 400
         else:
-            status = 200
-            context['instructions'] = self.instruction_paths(user_name, instructions)
+            if instructions == None:
+                status = 404
+                context['error'] = "No user %s" % user_name
+            elif self.is_json_request() and self.get_flag('stream'):
+                return self.stream_json(self.instruction_to_path(user_name, i)
+                                        for i in instructions)
+            else:
+                instructions = list(instructions)
+                self.link_next_page(instructions, limit)
+                status = 200
+                context['instructions'] = self.instruction_paths(user_name, instructions)
 
         if self.is_json_request():
             if status == 200:
@@ -280,6 +510,279 @@ class TagCollectionHandler(Handler):
             return self.render_template('tagged', _status_code=status, **context)
 
 
+class SearchHandler(Handler):
+    """
+    This handler searches everyone's instructions.
+    """
+    def get(self):
+        """
+        Provide a listing of instructions matching the words in `q`, as
+        prefixes, and having all of the comma-separated `tags`.  Paginated
+        by id, a page of SEARCH_LIMIT at a time unless `limit` is given.
+        """
+        query = self.get_argument('q')
+        tags = [t for t in (self.get_argument('tags') or '').split(',') if t]
+        context = {'q': query, 'tags': tags}
+        try:
+            after, limit = self.listing_arguments()
+            limit = min(limit or SEARCH_LIMIT, MAX_SEARCH_LIMIT)
+            results = self.application.instructions.search(
+                query, tags, ObjectId(after) if after else None, limit)
+        except (ValueError, InvalidId) as error:
+            context['error'] = 'Invalid arguments: %s.' % error
+            status = 400
+        else:
+            status = 200
+            context['instructions'] = [self.instruction_to_path(r.creator_name, r)
+                                       for r in results]
+            if limit and len(results) == limit:
+                self.headers['Link'] = '<%s?%s>; rel="next"' % (
+                    self.message.path, urllib.urlencode([
+                        ('q', (query or u'').encode('utf-8')),
+                        ('tags', u','.join(tags).encode('utf-8')),
+                        ('after', str(results[-1].id)), ('limit', limit)]))
+
+        if self.is_json_request():
+            if status == 200:
+                context = context['instructions']
+            self.set_body(json.dumps(context))
+            self.set_status(status)
+            return self.render()
+        else:
+            return self.render_template('search', _status_code=status, **context)
+
+
+class MetricsHandler(Handler):
+    """
+    This handler exposes the metrics of every worker to Prometheus: this
+    one's, and the latest the others have published.
+    """
+    def get(self):
+        others = []
+        if 'worker' in REGISTRY.labels:
+            others = self.application.thread_pool.run(
+                REGISTRY.published, METRICS_DIR, 3 * METRICS_INTERVAL)
+        self.headers['Content-Type'] = 'text/plain; version=0.0.4'
+        self.set_body(REGISTRY.render(others))
+        self.set_status(200)
+        return self.render()
+
+
+class ProfilesHandler(Handler):
+    """
+    This handler lists the profiles of slow requests.  It needs a profiling
+    token, in the `X-Caustic-Profile` header or the `token` argument.
+    """
+    def profiling_authorized(self):
+        """
+        Returns True if the request has a profiling token.
+        """
+        profiler = self.application.profiler
+        return profiler.authorized(self.message.headers.get('x-caustic-profile')
+                                   or self.get_argument('token'))
+
+    def get(self):
+        """
+        Provide a listing of the profiles kept, newest first.
+        """
+        if not self.profiling_authorized():
+            self.set_body(json.dumps({'error': 'Not authorized.'}))
+            self.set_status(403)
+            return self.render()
+        profiles = self.application.profiler.profiles()
+        for profile in profiles:
+            profile['path'] = '/profiles/%s' % profile['id']
+        self.headers['Content-Type'] = 'application/json'
+        self.set_body(json.dumps(profiles))
+        self.set_status(200)
+        return self.render()
+
+
+class ProfileHandler(ProfilesHandler):
+    """
+    This handler downloads a profile, for `pstats`.
+    """
+    def get(self, id):
+        if not self.profiling_authorized():
+            self.set_body(json.dumps({'error': 'Not authorized.'}))
+            self.set_status(403)
+            return self.render()
+        path = self.application.profiler.path(id)
+        if not path:
+            self.set_body(json.dumps({'error': 'No such profile.'}))
+            self.set_status(404)
+            return self.render()
+        with open(path, 'rb') as profile:
+            self.set_body(self.application.thread_pool.run(profile.read))
+        self.headers['Content-Type'] = 'application/octet-stream'
+        self.headers['Content-Disposition'] = 'attachment; filename="%s.prof"' % id
+        self.set_status(200)
+        return self.render()
+
+
+class DependentsHandler(Handler):
+    """
+    This handler lists the instructions that refer to an instruction.
+    """
+    def get(self, user_name, name):
+        """
+        Provide a listing of the instructions that refer to this one through
+        `then` or `extends`, paginated by id.  With `?transitive=true`, list
+        what depends on it through others too, nearest first, paginated by
+        the id of the last one listed.
+        """
+        context = {'user': user_name, 'name': name}
+        instructions = self.application.instructions
+        try:
+            after, limit = self.listing_arguments()
+            after = ObjectId(after) if after else None
+            if self.get_flag('transitive'):
+                results = instructions.all_dependents(user_name, name,
+                                                      after, limit)
+            else:
+                results = instructions.dependents(user_name, name, after, limit)
+        except (ValueError, InvalidId) as error:
+            context['error'] = 'Invalid arguments: %s.' % error
+            status = 400
+        else:
+            status = 200
+            context['instructions'] = [self.instruction_to_path(r.creator_name, r)
+                                       for r in results]
+            if limit and len(results) == limit:
+                args = [('after', str(results[-1].id)), ('limit', limit)]
+                if self.get_flag('transitive'):
+                    args.insert(0, ('transitive', 'true'))
+                self.headers['Link'] = '<%s?%s>; rel="next"' % (
+                    self.message.path, urllib.urlencode(args))
+
+        if self.is_json_request():
+            if status == 200:
+                context = context['instructions']
+            self.set_body(json.dumps(context))
+            self.set_status(status)
+            return self.render()
+        else:
+            return self.render_template('dependents', _status_code=status, **context)
+
+
+class HistoryHandler(Handler):
+    """
+    This handler lists the revisions of an instruction.
+    """
+    def revision_to_dict(self, revision):
+        """
+        Convert a Revision to what is sent to clients.
+        """
+        return {'rev': revision.rev,
+                'hash': revision.content_hash,
+                'author': revision.author,
+                'time': revision.time.isoformat()}
+
+    def get(self, user_name, name):
+        """
+        Provide a listing of the revisions of this instruction, newest
+        first, paginated by revision number.
+        """
+        context = {'user': user_name, 'name': name}
+        try:
+            after, limit = self.listing_arguments()
+            results = self.application.instructions.history(
+                user_name, name, int(after) if after else None, limit)
+        except ValueError as error:
+            context['error'] = 'Invalid arguments: %s.' % error
+            status = 400
+        else:
+            if results is None:
+                context['error'] = "Instruction does not exist"
+                status = 404
+            else:
+                status = 200
+                context['revisions'] = [self.revision_to_dict(r) for r in results]
+                if limit and len(results) == limit:
+                    self.headers['Link'] = '<%s?after=%d&limit=%d>; rel="next"' % (
+                        self.message.path, results[-1].rev, limit)
+
+        if self.is_json_request():
+            if status == 200:
+                context = context['revisions']
+            self.set_body(json.dumps(context))
+            self.set_status(status)
+            return self.render()
+        else:
+            return self.render_template('history', _status_code=status, **context)
+
+
+class RevisionHandler(HistoryHandler):
+    """
+    This handler provides one revision of an instruction.
+    """
+    def get(self, user_name, name, rev):
+        """
+        Display an instruction as it was at a revision.  JSON responses
+        are the instruction alone, with an ETag of its content hash.
+        """
+        context = {'user': user_name, 'name': name}
+        try:
+            found = self.application.instructions.revision(user_name, name,
+                                                           int(rev))
+        except ValueError:
+            found = None
+        if found:
+            revision, encoded = found
+            status = 200
+            context['revision'] = self.revision_to_dict(revision)
+            context['instruction'] = json.loads(encoded)
+        else:
+            context['error'] = "Revision does not exist"
+            status = 404
+
+        if self.is_json_request():
+            if status == 200:
+                self.headers['ETag'] = '"%s"' % revision.content_hash
+                self.set_body(str(encoded))
+            else:
+                self.set_body(json.dumps(context))
+            self.set_status(status)
+            return self.render()
+        else:
+            return self.render_template('revision', _status_code=status, **context)
+
+
+class DiffHandler(Handler):
+    """
+    This handler shows what changed in an instruction between revisions.
+    """
+    def get(self, user_name, name, rev):
+        """
+        Provide the JSON Patch operations that turn the instruction as of
+        revision `from`, by default the one before, into this revision.  The
+        first revision is diffed against an empty instruction.
+        """
+        context = {'user': user_name, 'name': name}
+        try:
+            to_rev = int(rev)
+            from_rev = int(self.get_argument('from') or to_rev - 1)
+        except ValueError:
+            ops = None
+        else:
+            context['from'], context['to'] = from_rev, to_rev
+            ops = self.application.instructions.diff(user_name, name,
+                                                     from_rev, to_rev)
+        if ops is None:
+            context['error'] = "Revision does not exist"
+            status = 404
+        else:
+            context['ops'] = ops
+            status = 200
+
+        if self.is_json_request():
+            self.set_body(json.dumps(ops if status == 200 else context))
+            self.set_status(status)
+            return self.render()
+        else:
+            return self.render_template('diff', _status_code=status, **context)
+
+
 class InstructionModelHandler(Handler):
     """
     This handler provides clients access to a single instruction by name.
@@ -287,8 +790,31 @@ class InstructionModelHandler(Handler):
 
     def get(self, user_name, name):
         """
-        Display a single instruction.
+        Display a single instruction.  With `?resolved=true`, its `extends`
+        and path references are expanded into it.
+
+        JSON responses carry an ETag of the instruction's content hash, and
+        a matching `If-None-Match` is answered from the index alone.
+        Otherwise the JSON stored with the instruction is sent as it is.
         """
+        resolved = self.get_flag('resolved')
+        if self.is_json_request() and not resolved:
+            instructions = self.application.instructions
+            if self.message.headers.get('if-none-match'):
+                stored_hash = instructions.hash_for(user_name, name)
+                if stored_hash and self.etag_matches('"%s"' % stored_hash):
+                    self.headers['ETag'] = '"%s"' % stored_hash
+                    self.set_body('')
+                    self.set_status(304, 'Not Modified')
+                    return self.render()
+            stored = instructions.encoded_for(user_name, name)
+            if stored:
+                encoded, stored_hash = stored
+                self.headers['ETag'] = '"%s"' % stored_hash
+                self.set_body(str(encoded))
+                self.set_status(200)
+                return self.render()
+
         context = {}
         doc = self.application.instructions.find(user_name, name)
         if doc:
@@ -298,10 +824,25 @@ class InstructionModelHandler(Handler):
             context['error'] = "Instruction does not exist"
             status = 404
 
+        if doc and resolved:
+            try:
+                instruction = self.application.resolver.resolve(user_name, name)
+                context['resolved'] = instruction
+            except ReferenceCycleError as e:
+                context['error'] = str(e)
+                status = 409
+        elif doc:
+            instruction = doc.instruction
+
         if self.is_json_request():
             if status == 200:
-                context = doc.instruction
-            self.set_body(json.dumps(context))
+                body = instruction
+                if not resolved:
+                    self.headers['ETag'] = '"%s"' % (
+                        doc.content_hash or content_hash(doc.instruction))
+            else:
+                body = {'error': context['error']}
+            self.set_body(json.dumps(body))
             self.set_status(status)
             return self.render()
         else:
@@ -309,7 +850,8 @@ class InstructionModelHandler(Handler):
 
     def put(self, owner, name):
         """
-        Update a single instruction, creating it if it doesn't exist.
+        Update a single instruction, creating it if it doesn't exist.  The
+        `X-Revision-Created` header says whether it actually changed.
         """
         user = self.current_user
         context = {}
@@ -321,12 +863,14 @@ class InstructionModelHandler(Handler):
             status = 403
         else:
             try:
-                doc = self.application.instructions.save_or_create(
+                doc, revised = self.application.instructions.save_or_create(
                     user, name,
                     json.loads(self.get_argument('instruction')),
                     json.loads(self.get_argument('tags')))
                 status = 201
+                self.headers['X-Revision-Created'] = 'true' if revised else 'false'
                 context['instruction'] = doc.to_python()
+                context['revised'] = revised
             except ShieldException as error:
                 context['error'] = "Invalid instruction: %s." % error
                 status = 400
@@ -339,8 +883,10 @@ class InstructionModelHandler(Handler):
 
         if self.is_json_request():
             if status == 201:
-                context = doc.instruction
-            self.set_body(json.dumps(context))
+                self.set_body(str(doc.instruction_json or
+                                  json.dumps(doc.instruction)))
+            else:
+                self.set_body(json.dumps(context))
             self.set_status(status)
             return self.render()
         else:
@@ -354,16 +900,18 @@ class InstructionModelHandler(Handler):
         context = {}
         if not user:
             context['error'] = 'You are not logged in'
+            status = 403
         elif not owner == user.name:
             context['error'] = "You cannot delete someone else's template"
             status = 403
         else:
-            instruction = self.application.instructions.find(user, name)
+            instruction = self.application.instructions.find(user.name, name,
+                                                             primary=True)
             if instruction:
                 self.application.instructions.delete(instruction)
                 status = 200
             else:
-                status['error'] = "Instruction does not exist"
+                context['error'] = "Instruction does not exist"
                 status = 404
 
         if self.is_json_request():
@@ -373,21 +921,119 @@ class InstructionModelHandler(Handler):
         else:
             return self.render_template('delete_instruction', _status_code=status, **context)
 
-V_C = VALID_URL_CHARS
+class Caustic(Brubeck):
+    """
+    A Brubeck app that routes by path segment, falling back to its
+    `handler_tuples` for paths the router doesn't know.
+    """
+
+    def __init__(self, router, **kwargs):
+        self.router = router
+        super(Caustic, self).__init__(**kwargs)
+
+    def route_message(self, message):
+        found = self.router.match(message.path)
+        if found:
+            kallable, url_args = found
+            handler = kallable(self, message)
+            handler._url_args = url_args
+            return handler
+        return super(Caustic, self).route_message(message)
+
+ROUTES = [
+    ('/', IndexHandler),
+    ('/search', SearchHandler),
+    ('/metrics', MetricsHandler),
+    ('/profiles', ProfilesHandler),
+    ('/profiles/:id', ProfileHandler),
+    ('/:user', UserHandler),
+    ('/:user/instructions', InstructionCollectionHandler),
+    ('/:user/instructions/:name', InstructionModelHandler),
+    ('/:user/instructions/:name/dependents', DependentsHandler),
+    ('/:user/instructions/:name/history', HistoryHandler),
+    ('/:user/instructions/:name/history/:rev', RevisionHandler),
+    ('/:user/instructions/:name/history/:rev/diff', DiffHandler),
+    ('/:user/tagged/:tag', TagCollectionHandler)]
+
+router = SegmentRouter(VALID_URL_CHARS)
+for pattern, handler in ROUTES:
+    router.add(pattern, handler)
+
 config = {
     'mongrel2_pair': (RECV_SPEC, SEND_SPEC),
-    'handler_tuples': [
-        (r'^/?$', IndexHandler),
-        (r'^/([%s]+)/?$' % V_C, UserHandler),
-        (r'^/([%s]+)/instructions/?$' % V_C, InstructionCollectionHandler),
-        (r'^/([%s]+)/instructions/([%s]+)/?$' % (V_C, V_C), InstructionModelHandler),
-        (r'^/([%s]+)/tagged/([%s]+)/?$' % (V_C, V_C), TagCollectionHandler)],
+    'handler_tuples': [(router.regex(p), h) for p, h in ROUTES],
     'template_loader': load_mustache_env(TEMPLATE_DIR),
     'cookie_secret': COOKIE_SECRET,
 }
 
-app = Brubeck(**config)
-db = get_db(DB_HOST, DB_PORT, DB_NAME)
-app.users = Users(db)
-app.instructions = Instructions(app.users, JsonGitRepository(JSON_GIT_DIR), db)
-app.run()
+def backfill():
+    """
+    Fill in fields that instructions written by older versions lack, and
+    replay the journal of every worker, including those there may no
+    longer be.
+    """
+    for journal in journals(JSON_GIT_JOURNAL):
+        commits = CommitQueue(JsonGitRepository(JSON_GIT_DIR), journal,
+                              lock_path=JSON_GIT_LOCK)
+        commits.start()
+        commits.stop()
+    db = get_db(DB_HOST, DB_PORT, DB_NAME, DB_REPLICA_SET, DB_POOL_SIZE)
+    instructions = Instructions(Users(db), None, db)
+    instructions.backfill_creator_names()
+    instructions.backfill_content_hashes()
+    instructions.backfill_search_terms()
+    instructions.backfill_references()
+    instructions.backfill_revisions()
+    db.connection.disconnect()
+
+def serve(worker=None):
+    """
+    Run the app.  Each worker has its own Mongo connections and commit
+    journal, and they take turns writing to the git repo.  Workers publish
+    their metrics for each other.
+    """
+    publisher = None
+    if worker is not None:
+        REGISTRY.labels['worker'] = worker
+        publisher = Publisher(REGISTRY, METRICS_DIR, METRICS_INTERVAL)
+        publisher.start()
+    app = Caustic(router, **config)
+    app.thread_pool = ThreadPool(THREAD_POOL_SIZE, THREAD_POOL_QUEUE)
+    app.sessions = SessionTokens(COOKIE_SECRET, SESSION_MAX_AGE)
+    app.profiler = RequestProfiler(PROFILE_DIR, COOKIE_SECRET, PROFILE_THRESHOLD,
+                                   PROFILE_KEEP, PROFILE_SAMPLE_RATE,
+                                   app.thread_pool)
+    db = get_db(DB_HOST, DB_PORT, DB_NAME, DB_REPLICA_SET, DB_POOL_SIZE)
+    app.users = Users(db, secondary_reads=DB_SECONDARY_READS)
+    journal = JSON_GIT_JOURNAL if worker is None else '%s.%d' % (JSON_GIT_JOURNAL, worker)
+    commits = CommitQueue(JsonGitRepository(JSON_GIT_DIR), journal,
+                          JSON_GIT_BATCH_WINDOW, lock_path=JSON_GIT_LOCK,
+                          pool=app.thread_pool)
+    commits.start()
+    # Other workers need to know what this one changes.
+    changes = Changes(db) if worker is not None else None
+    app.instructions = Instructions(app.users, commits, db, DB_SECONDARY_READS,
+                                    app.thread_pool, REVISION_CACHE_SIZE,
+                                    changes=changes)
+    app.resolver = Resolver(app.instructions, changes=changes)
+    app.templates = CompiledTemplates(app.template_env, TEMPLATE_DIR,
+                                      TEMPLATE_CACHE_SIZE)
+    app.instructions.listeners.append(app.templates.clear)
+    REGISTRY.gauge('caustic_thread_pool', 'Thread pool usage; waits in seconds.',
+                   lambda: [({'stat': k}, v)
+                            for k, v in sorted(app.thread_pool.stats().items())])
+    REGISTRY.gauge('caustic_git_pending', 'Git calls waiting to be applied.',
+                   lambda: commits.pending)
+    try:
+        app.run()
+    finally:
+        if publisher:
+            publisher.stop()
+        commits.stop()
+
+if __name__ == '__main__':
+    backfill()
+    if WORKERS > 1:
+        Supervisor(serve, WORKERS).run()
+    else:
+        serve()
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+
+"""
+caustic.sessions
+
+Stateless session tokens.  A token carries everything needed to know who
+is logged in, signed so that it can be trusted without a database read.
+"""
+
+try:
+    import simplejson as json
+    json
+except ImportError:
+    import json
+
+import hmac
+import time
+import base64
+import hashlib
+from collections import namedtuple
+
+Session = namedtuple('Session', ['id', 'name', 'issued', 'generation'])
+
+
+def _encode(data):
+    return base64.urlsafe_b64encode(data).rstrip('=')
+
+
+def _decode(data):
+    return base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+
+
+def _equal(a, b):
+    """Compare signatures in constant time.
+    """
+    if len(a) != len(b):
+        return False
+    result = 0
+    for x, y in zip(a, b):
+        result |= ord(x) ^ ord(y)
+    return result == 0
+
+
+class SessionTokens(object):
+    """Issues and reads session tokens signed with `secret`.  A token holds
+    the user's id and name, when it was issued, and the user's session
+    generation at the time, which lets sessions be revoked.
+
+    Tokens older than `max_age` seconds are not accepted, if it is set.
+    """
+
+    def __init__(self, secret, max_age=None, clock=time.time):
+        self.secret = str(secret)
+        self.max_age = max_age
+        self.clock = clock
+
+    def issue(self, user, generation=0):
+        """Issue a token for a User.
+        """
+        payload = _encode(json.dumps([str(user.id), user.name,
+                                      int(self.clock()), generation]))
+        return '%s.%s' % (payload, self._sign(payload))
+
+    def read(self, token):
+        """Read a token.
+
+        Returns its Session, or None if the token is malformed, has a bad
+        signature or is too old.
+        """
+        if not isinstance(token, basestring) or token.count('.') != 1:
+            return None
+        try:
+            payload, signature = str(token).split('.')
+            if not _equal(signature, self._sign(payload)):
+                return None
+            session = Session(*json.loads(_decode(payload)))
+        except (TypeError, ValueError):
+            return None
+        if self.max_age and self.clock() - session.issued > self.max_age:
+            return None
+        return session
+
+    def _sign(self, payload):
+        return _encode(hmac.new(self.secret, payload, hashlib.sha256).digest())
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+
+"""
+caustic.templates
+
+Mustache templates, parsed once, with rendered pages remembered.
+"""
+
+try:
+    import simplejson as json
+    json
+except ImportError:
+    import json
+
+import os
+import hashlib
+
+import pystache
+
+from cache import LRUCache
+
+
+class CompiledTemplates(object):
+    """Renders the Mustache templates in `template_dir` with `renderer`, a
+    pystache Renderer.  Every template is parsed at startup.
+
+    If `cache_size`, up to that many renderings are kept, by template and
+    a hash of their context.  `clear` forgets them.
+    """
+
+    def __init__(self, renderer, template_dir, cache_size=0):
+        self.renderer = renderer
+        self.parsed = {}
+        for filename in os.listdir(template_dir):
+            name, extension = os.path.splitext(filename)
+            if extension == '.%s' % renderer.file_extension:
+                self.parsed[name] = pystache.parse(renderer.load_template(name))
+        self.rendered = LRUCache(cache_size) if cache_size else None
+
+    def render(self, name, context):
+        """Render a template with a context dict.
+        """
+        if self.rendered is None:
+            return self._render(name, context)
+        key = (name, hashlib.sha1(json.dumps(context, sort_keys=True,
+                                             default=str)).hexdigest())
+        body = self.rendered.get(key)
+        if body is None:
+            body = self._render(name, context)
+            self.rendered.set(key, body)
+        return body
+
+    def clear(self, *args):
+        """Forget every rendering.  Takes any arguments, so that it can
+        listen for writes.
+        """
+        if self.rendered is not None:
+            self.rendered.clear()
+
+    def _render(self, name, context):
+        parsed = self.parsed.get(name)
+        if parsed is None:
+            parsed = self.parsed[name] = pystache.parse(
+                self.renderer.load_template(name))
+        return self.renderer.render(parsed, context)
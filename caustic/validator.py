@@ -0,0 +1,411 @@
+# -*- coding: utf-8 -*-
+
+"""
+caustic.validator
+
+The schemas in `schema` compiled once, at import, into trees of closures.
+A compiled schema accepts and rejects exactly what `validictory.validate`
+does and raises the same messages, but never copies schemas or looks up
+validators by name while it walks.
+
+Each compiled node can be run in two modes.  `check` raises a
+`ValidationError` with validictory's message.  `test` only answers yes or
+no, runs its cheapest checks first, and never formats a message -- type
+unions only need to know whether a branch matched, so this is what keeps
+a `find` inside a large `then` tree from being walked once as a `load`
+before being walked again as a `find`.
+"""
+
+import copy
+from collections import Mapping
+
+from validictory import ValidationError, SchemaError
+
+import schema
+
+try:
+    _str_type = basestring
+    _int_types = (int, long)
+except NameError:
+    _str_type = str
+    _int_types = (int,)
+
+# Keywords validictory accepts that have no effect on the data.
+_IGNORED = set(['default', 'description', 'title'])
+
+# Order in which `test` runs a node's checks.  Cheap membership tests go
+# first so that a mismatched union branch is usually rejected in O(1).
+_COST = {
+    'required': 0,
+    'blank': 1,
+    'additionalProperties': 1,
+    'dependencies': 1,
+    'enum': 1,
+    'type': 2,
+    'properties': 3,
+    'items': 3,
+}
+
+_SIMPLE_TYPES = {
+    'string': lambda v: isinstance(v, _str_type),
+    'integer': lambda v: type(v) in _int_types,
+    'number': lambda v: type(v) in _int_types + (float,),
+    'boolean': lambda v: type(v) == bool,
+    'object': lambda v: isinstance(v, Mapping),
+    'array': lambda v: isinstance(v, (list, tuple)),
+    'null': lambda v: v is None,
+    'any': lambda v: True,
+}
+
+
+class _Node(object):
+    """A compiled schema.  Both methods take the containing object and the
+    name of the field, as validictory does.
+    """
+
+    __slots__ = ('checks', 'tests')
+
+    def check(self, x, fieldname):
+        for check in self.checks:
+            check(x, fieldname)
+
+    def test(self, x, fieldname):
+        for test in self.tests:
+            if not test(x, fieldname):
+                return False
+        return True
+
+
+def _compile_node(s, cache):
+    """Compile schema `s`, reusing nodes in `cache` so that recursive
+    schemas compile to cyclic node graphs.
+    """
+    if s is None:
+        return None
+    if not isinstance(s, dict):
+        raise SchemaError("Schema structure is invalid.")
+    key = id(s)
+    if key in cache:
+        return cache[key]
+
+    node = _Node()
+    cache[key] = node
+
+    # Mirror validictory's defaulting so that keywords are checked in the
+    # same order, and fail with the same message first.
+    newschema = copy.copy(s)
+    if 'optional' in s:
+        raise SchemaError("'optional' is not supported, use 'required'.")
+    if 'required' not in s:
+        newschema['required'] = True
+    if 'blank' not in s:
+        newschema['blank'] = False
+
+    compiled = []
+    for keyword in newschema:
+        if keyword in _IGNORED:
+            if keyword != 'default' and not isinstance(newschema[keyword],
+                                                       (_str_type, type(None))):
+                raise SchemaError("The %s for schema must be a string" % keyword)
+            continue
+        try:
+            compiler = _KEYWORDS[keyword]
+        except KeyError:
+            raise SchemaError("Schema keyword '%s' is not supported." % keyword)
+        pair = compiler(s, newschema[keyword], cache)
+        if pair:
+            compiled.append((_COST[keyword], pair))
+
+    node.checks = tuple(check for _, (check, _) in compiled)
+    node.tests = tuple(test for _, (_, test) in
+                       sorted(compiled, key=lambda c: c[0]))
+    return node
+
+
+def _error(desc, value, fieldname, **params):
+    params['value'] = value
+    params['fieldname'] = fieldname
+    raise ValidationError(desc % params)
+
+
+def _compile_type(s, fieldtype, cache):
+    if not fieldtype:
+        return None
+
+    if isinstance(fieldtype, (list, tuple)):
+        tests = []
+        for each in fieldtype:
+            if isinstance(each, dict):
+                tests.append(_compile_node(each, cache).test)
+            else:
+                tests.append(_compile_type(s, each, cache)[1])
+        tests = tuple(tests)
+        # The message embeds the whole (possibly recursive) type list, so
+        # format it only once, the first time it is needed.
+        described = []
+
+        def test(x, fieldname):
+            if fieldname not in x:
+                return True
+            for each in tests:
+                if each(x, fieldname):
+                    return True
+            return False
+
+        def check(x, fieldname):
+            if not test(x, fieldname):
+                if not described:
+                    described.append('%s' % (fieldtype, ))
+                _error("Value %(value)r for field '%(fieldname)s' is "
+                       "not of type %(fieldtype)s",
+                       x[fieldname], fieldname, fieldtype=described[0])
+        return check, test
+
+    elif isinstance(fieldtype, dict):
+        node = _compile_node(fieldtype, cache)
+
+        def check(x, fieldname):
+            if fieldname in x:
+                node.check(x, fieldname)
+
+        def test(x, fieldname):
+            return fieldname not in x or node.test(x, fieldname)
+        return check, test
+
+    else:
+        try:
+            is_type = _SIMPLE_TYPES[fieldtype]
+        except KeyError:
+            raise SchemaError("Field type '%s' is not supported." % fieldtype)
+
+        def test(x, fieldname):
+            return fieldname not in x or is_type(x[fieldname])
+
+        def check(x, fieldname):
+            if not test(x, fieldname):
+                _error("Value %(value)r for field '%(fieldname)s' "
+                       "is not of type %(fieldtype)s",
+                       x[fieldname], fieldname, fieldtype=fieldtype)
+        return check, test
+
+
+def _compile_properties(s, properties, cache):
+    if not isinstance(properties, dict):
+        raise SchemaError("Properties definition is not an object")
+    nodes = tuple((name, _compile_node(prop, cache))
+                  for name, prop in properties.items() if prop is not None)
+
+    def check(x, fieldname):
+        value = x.get(fieldname)
+        if isinstance(value, dict):
+            for name, node in nodes:
+                node.check(value, name)
+
+    def test(x, fieldname):
+        value = x.get(fieldname)
+        if isinstance(value, dict):
+            for name, node in nodes:
+                if not node.test(value, name):
+                    return False
+        return True
+    return check, test
+
+
+def _compile_items(s, items, cache):
+    if not isinstance(items, dict):
+        raise SchemaError("Only object 'items' definitions are supported.")
+    node = _compile_node(items, cache)
+
+    def check(x, fieldname):
+        value = x.get(fieldname)
+        if isinstance(value, (list, tuple)):
+            for item in value:
+                try:
+                    node.check({'_data': item}, '_data')
+                except ValueError as e:
+                    # validictory's hack, so list messages make sense
+                    old_error = str(e).replace("field '_data'", 'list item')
+                    raise type(e)("Failed to validate field '%s' list "
+                                  "schema: %s" % (fieldname, old_error))
+
+    def test(x, fieldname):
+        value = x.get(fieldname)
+        if isinstance(value, (list, tuple)):
+            for item in value:
+                if not node.test({'_data': item}, '_data'):
+                    return False
+        return True
+    return check, test
+
+
+def _compile_required(s, required, cache):
+    if not required:
+        return None
+
+    def test(x, fieldname):
+        return fieldname in x
+
+    def check(x, fieldname):
+        if fieldname not in x:
+            _error("Required field '%(fieldname)s' is missing",
+                   None, fieldname)
+    return check, test
+
+
+def _compile_blank(s, blank, cache):
+    if blank:
+        return None
+
+    def test(x, fieldname):
+        value = x.get(fieldname)
+        return not isinstance(value, _str_type) or bool(value)
+
+    def check(x, fieldname):
+        if not test(x, fieldname):
+            _error("Value %(value)r for field '%(fieldname)s' cannot be "
+                   "blank'", x[fieldname], fieldname)
+    return check, test
+
+
+def _compile_additional_properties(s, additional, cache):
+    if additional is True:
+        return None
+    if additional is not False:
+        raise SchemaError("Only boolean 'additionalProperties' are supported.")
+    allowed = frozenset(s.get('properties') or {})
+
+    def test(x, fieldname):
+        value = x.get(fieldname)
+        if isinstance(value, dict):
+            for name in value:
+                if name not in allowed:
+                    return False
+        return True
+
+    def check(x, fieldname):
+        if not test(x, fieldname):
+            _error("additional properties not defined by 'properties' are "
+                   "not allowed in field '%(fieldname)s'", None, fieldname)
+    return check, test
+
+
+def _compile_dependencies(s, dependencies, cache):
+    if isinstance(dependencies, _str_type):
+        dependencies = [dependencies]
+    if not isinstance(dependencies, (list, tuple)):
+        raise SchemaError("Only string or list 'dependencies' are supported.")
+    dependencies = tuple(dependencies)
+
+    def check(x, fieldname):
+        if x.get(fieldname) is not None:
+            for dependency in dependencies:
+                if dependency not in x:
+                    _error("Field '%(dependency)s' is required by "
+                           "field '%(fieldname)s'",
+                           None, fieldname, dependency=dependency)
+
+    def test(x, fieldname):
+        if x.get(fieldname) is not None:
+            for dependency in dependencies:
+                if dependency not in x:
+                    return False
+        return True
+    return check, test
+
+
+def _compile_enum(s, options, cache):
+    if not isinstance(options, (list, tuple, set, frozenset, dict)):
+        raise SchemaError("Enumeration %r must be a container" % (options, ))
+
+    def test(x, fieldname):
+        value = x.get(fieldname)
+        return value is None or value in options
+
+    def check(x, fieldname):
+        if not test(x, fieldname):
+            _error("Value %(value)r for field '%(fieldname)s' is not "
+                   "in the enumeration: %(options)r",
+                   x[fieldname], fieldname, options=options)
+    return check, test
+
+
+_KEYWORDS = {
+    'type': _compile_type,
+    'properties': _compile_properties,
+    'items': _compile_items,
+    'required': _compile_required,
+    'blank': _compile_blank,
+    'additionalProperties': _compile_additional_properties,
+    'dependencies': _compile_dependencies,
+    'enum': _compile_enum,
+}
+
+
+class CompiledSchema(object):
+    """A JSON schema compiled for repeated validation.
+    """
+
+    def __init__(self, schema, cache=None):
+        self.schema = schema
+        self._node = _compile_node(schema, {} if cache is None else cache)
+
+    def is_valid(self, data):
+        """True if `data` validates, False otherwise.  Never builds an
+        error message.
+        """
+        return self._node.test({'_data': data}, '_data')
+
+    def validate(self, data):
+        """Raise the ValidationError `validictory.validate` would if `data`
+        doesn't validate.
+        """
+        self._node.check({'_data': data}, '_data')
+
+
+class InstructionError(ValueError):
+    """An instruction that failed validation.  `errors` is a list of
+    `(branch, ValidationError)` pairs, one for each branch that rejected it.
+    """
+
+    def __init__(self, errors):
+        self.errors = errors
+        super(InstructionError, self).__init__(
+            "Invalid Instruction: %s" % [e for _, e in errors])
+
+    @property
+    def branches(self):
+        """The names of the branches that failed.
+        """
+        return [branch for branch, _ in self.errors]
+
+
+_CACHE = {}
+INSTRUCTION = CompiledSchema(schema.INSTRUCTION, _CACHE)
+FIND = CompiledSchema(schema.FIND, _CACHE)
+LOAD = CompiledSchema(schema.LOAD, _CACHE)
+
+
+def validate_instruction(value):
+    """Validate an instruction in a single pass.
+
+    Raises an InstructionError if it is invalid.  If the instruction could
+    have been a `find` or a `load`, the error has messages for both
+    branches, otherwise it has the message for the instruction as a whole.
+    """
+    if INSTRUCTION.is_valid(value):
+        return
+
+    errors = []
+    for branch, compiled in (('find', FIND), ('load', LOAD)):
+        try:
+            compiled.validate(value)
+        except ValidationError as err:
+            errors.append((branch, err))
+
+    if not errors:
+        try:
+            INSTRUCTION.validate(value)
+        except ValidationError as err:
+            errors.append(('instruction', err))
+
+    raise InstructionError(errors)
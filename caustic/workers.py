@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+
+"""
+caustic.workers
+
+Runs the server as several processes.  Mongrel2 pushes requests to whichever
+worker is free, so they only need to connect to the same sockets.
+"""
+
+import os
+import sys
+import time
+import errno
+import signal
+import logging
+
+
+class Supervisor(object):
+    """Forks `count` workers, each running `target(index)`.  A worker that
+    dies is replaced by a new one with the same index after `restart_delay`
+    seconds.
+
+    `stop` sends every worker SIGTERM, and kills any still running
+    `shutdown_timeout` seconds later.
+    """
+
+    def __init__(self, target, count, restart_delay=1.0, shutdown_timeout=10.0):
+        self.target = target
+        self.count = count
+        self.restart_delay = restart_delay
+        self.shutdown_timeout = shutdown_timeout
+        self.children = {}
+        self._deadline = None
+
+    def run(self, handle_signals=True):
+        """Start the workers, and supervise them until they've all stopped.
+        SIGTERM and SIGINT stop them if `handle_signals`.
+        """
+        if handle_signals:
+            signal.signal(signal.SIGTERM, self._signalled)
+            signal.signal(signal.SIGINT, self._signalled)
+        for index in range(self.count):
+            self._spawn(index)
+
+        while self.children:
+            if self._deadline and time.time() > self._deadline:
+                self._kill(signal.SIGKILL)
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except OSError as e:
+                if e.errno == errno.EINTR:
+                    continue
+                elif e.errno == errno.ECHILD:
+                    break
+                raise
+            if not pid:
+                time.sleep(0.1)
+                continue
+
+            index = self.children.pop(pid, None)
+            if index is None or self.stopping:
+                continue
+            logging.error('Worker %d (pid %d) exited with status %d, restarting.'
+                          % (index, pid, status))
+            time.sleep(self.restart_delay)
+            if not self.stopping:
+                self._spawn(index)
+
+    @property
+    def stopping(self):
+        return self._deadline is not None
+
+    def stop(self):
+        """Ask the workers to stop.
+        """
+        if not self.stopping:
+            self._deadline = time.time() + self.shutdown_timeout
+            self._kill(signal.SIGTERM)
+
+    def _signalled(self, signum, frame):
+        self.stop()
+
+    def _kill(self, signum):
+        for pid in self.children.keys():
+            try:
+                os.kill(pid, signum)
+            except OSError:
+                pass  # already gone
+
+    def _spawn(self, index):
+        pid = os.fork()
+        if pid:
+            self.children[pid] = index
+            return
+
+        # Interrupts are for the supervisor, which passes on a SIGTERM.
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, _exit)
+        code = 0
+        try:
+            self.target(index)
+        except SystemExit as e:
+            code = e.code or 0
+        except Exception:
+            logging.error('Worker %d failed.' % index, exc_info=True)
+            code = 1
+        os._exit(code)
+
+
+def _exit(signum, frame):
+    """Unwind the worker, so that it can clean up after itself.
+    """
+    sys.exit(0)
@@ -1,5 +1,11 @@
 #!/bin/bash
 
+# Usage: ./start.sh [MODE]
+#
+# Starts `workers` server processes, as set for MODE in config.ini.
+
+MODE=${1:-production}
+
 mkdir -p log
 
 m2sh load -config mongrel2.conf
@@ -7,4 +13,4 @@ m2sh start -host localhost &
 
 mongod -f mongodb.conf &
 
-#python caustic/server.py > log/caustic.log 2>&1 &
+python caustic/server.py $MODE > log/caustic.log 2>&1 &
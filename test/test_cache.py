@@ -0,0 +1,73 @@
+"""
+Test caustic/cache.py .
+"""
+
+import unittest
+from caustic.cache import LRUCache
+
+
+class Clock(object):
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class TestLRUCache(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.cache = LRUCache(2, ttl=10, clock=self.clock)
+
+    def test_get_set(self):
+        self.cache.set('a', 1)
+        self.assertEqual(1, self.cache.get('a'))
+        self.assertIsNone(self.cache.get('b'))
+
+    def test_caches_none(self):
+        """None is a value, not a miss.
+        """
+        self.cache.set('a', None)
+        self.assertIn('a', self.cache)
+        self.assertNotIn('b', self.cache)
+
+    def test_evicts_least_recently_used(self):
+        self.cache.set('a', 1)
+        self.cache.set('b', 2)
+        self.cache.get('a')
+        self.cache.set('c', 3)
+        self.assertIn('a', self.cache)
+        self.assertNotIn('b', self.cache)
+        self.assertIn('c', self.cache)
+
+    def test_expires(self):
+        self.cache.set('a', 1)
+        self.clock.now = 9
+        self.assertEqual(1, self.cache.get('a'))
+        self.clock.now = 10
+        self.assertNotIn('a', self.cache)
+
+    def test_delete(self):
+        self.cache.set('a', 1)
+        self.assertTrue(self.cache.delete('a'))
+        self.assertFalse(self.cache.delete('a'))
+        self.assertNotIn('a', self.cache)
+
+    def test_clear(self):
+        self.cache.set('a', 1)
+        self.cache.set('b', 2)
+        self.cache.clear()
+        self.assertEqual(0, len(self.cache))
+
+    def test_on_evict(self):
+        evicted = []
+        self.cache.on_evict = evicted.append
+        self.cache.set('a', 1)
+        self.cache.set('b', 2)
+        self.cache.set('c', 3)
+        self.clock.now = 10
+        self.cache.get('b')
+        self.cache.delete('c')
+        self.assertEqual(['a', 'b'], evicted)
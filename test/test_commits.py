@@ -0,0 +1,230 @@
+"""
+Test caustic/commits.py .
+"""
+
+import os
+import json
+import fcntl
+import unittest
+from caustic.commits import CommitQueue, journals
+from caustic.offload import ThreadPool
+from jsongit import signature
+
+JOURNAL = 'tmp_journal'
+LOCK = 'tmp_lock'
+
+
+class Repo(object):
+    """Records what it was asked to do.
+    """
+
+    def __init__(self):
+        self.calls = []
+
+    def create(self, key, data, author=None):
+        self.calls.append(('create', key, data, author.name))
+
+    def commit(self, key, data, author=None):
+        self.calls.append(('commit', key, data, author.name))
+
+
+class LockCheckingRepo(Repo):
+    """Records whether LOCK was held by someone else during each call.
+    """
+
+    def commit(self, key, data, author=None):
+        with open(LOCK, 'a') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                self.calls.append('unlocked')
+            except IOError:
+                self.calls.append('locked')
+
+
+class FlakyRepo(Repo):
+    """Fails the first `failures` calls for 'joe/bad'.
+    """
+
+    def __init__(self, failures):
+        Repo.__init__(self)
+        self.failures = failures
+
+    def commit(self, key, data, author=None):
+        if key == 'joe/bad' and self.failures:
+            self.failures -= 1
+            raise IOError('git is down')
+        Repo.commit(self, key, data, author)
+
+
+class TestCommitQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.repo = Repo()
+        self.queue = CommitQueue(self.repo, JOURNAL, batch_window=0.01)
+        self.author = signature('joe', 'joe')
+
+    def tearDown(self):
+        self.queue.stop(1)
+        if os.path.exists(JOURNAL):
+            os.remove(JOURNAL)
+
+    def test_applies_in_order(self):
+        self.queue.start()
+        self.queue.create('joe/1', {'load': 'a'}, author=self.author)
+        self.queue.commit('joe/1', {'load': 'b'}, author=self.author)
+        self.assertTrue(self.queue.flush(1))
+        self.assertEqual([('create', 'joe/1', {'load': 'a'}, 'joe'),
+                          ('commit', 'joe/1', {'load': 'b'}, 'joe')],
+                         self.repo.calls)
+
+    def test_journal_emptied_when_drained(self):
+        self.queue.start()
+        self.queue.commit('joe/1', 'data', author=self.author)
+        self.queue.flush(1)
+        self.assertEqual(0, os.path.getsize(JOURNAL))
+
+    def test_replays_journal(self):
+        """Entries that were never checkpointed are applied on start.
+        """
+        with open(JOURNAL, 'w') as journal:
+            for record in [{'seq': 1, 'op': 'create', 'key': 'joe/1',
+                            'data': 'a', 'author': ['joe', 'joe']},
+                           {'seq': 2, 'op': 'commit', 'key': 'joe/1',
+                            'data': 'b', 'author': ['joe', 'joe']},
+                           {'done': 1},
+                           {'seq': 3, 'op': 'commit', 'key': 'joe/1',
+                            'data': 'c', 'author': ['joe', 'joe']}]:
+                journal.write(json.dumps(record) + '\n')
+            journal.write('{"seq": 4, "op"')  # torn write
+        self.queue.start()
+        self.assertEqual([('commit', 'joe/1', 'b', 'joe'),
+                          ('commit', 'joe/1', 'c', 'joe')],
+                         self.repo.calls)
+
+    def test_batch(self):
+        self.queue.start()
+        self.queue.batch([('create', 'joe/1', 'a', self.author),
+                          ('create', 'joe/2', 'b', self.author)])
+        self.queue.flush(1)
+        self.assertEqual([('create', 'joe/1', 'a', 'joe'),
+                          ('create', 'joe/2', 'b', 'joe')],
+                         self.repo.calls)
+
+    def test_lock_held_while_applying(self):
+        self.queue = CommitQueue(LockCheckingRepo(), JOURNAL, batch_window=0.01,
+                                 lock_path=LOCK)
+        self.queue.start()
+        self.queue.commit('joe/1', 'a', author=self.author)
+        self.queue.flush(1)
+        self.assertEqual(['locked'], self.queue.repo.calls)
+        os.remove(LOCK)
+
+    def test_applies_through_pool(self):
+        pool = ThreadPool()
+        self.queue = CommitQueue(self.repo, JOURNAL, batch_window=0.01,
+                                 pool=pool)
+        self.queue.start()
+        self.queue.commit('joe/1', 'a', author=self.author)
+        self.queue.stop(1)
+        # The batch, and a sync each for the call and the emptied journal.
+        self.assertEqual(3, pool.calls)
+        self.assertEqual([('commit', 'joe/1', 'a', 'joe')], self.repo.calls)
+
+    def test_journal_synced_through_pool(self):
+        pool = ThreadPool()
+        self.queue = CommitQueue(self.repo, JOURNAL, batch_window=0.01,
+                                 pool=pool)
+        self.queue.start()
+        calls = pool.calls
+        self.queue.commit('joe/1', 'a', author=self.author)
+        self.assertTrue(pool.calls > calls)
+        with open(JOURNAL) as journal:
+            self.assertEqual('a', json.loads(journal.readline())['data'])
+
+    def test_failed_commits_retried_in_order(self):
+        """A failed commit is retried, and later ones to its key wait for
+        it, while other keys go ahead.
+        """
+        self.repo = FlakyRepo(2)
+        self.queue = CommitQueue(self.repo, JOURNAL, batch_window=0.01,
+                                 retry_delay=0.01)
+        self.queue.start()
+        self.queue.commit('joe/bad', 'a', author=self.author)
+        self.queue.commit('joe/bad', 'b', author=self.author)
+        self.queue.commit('joe/good', 'c', author=self.author)
+        self.assertTrue(self.queue.flush(1))
+        self.assertEqual([('commit', 'joe/good', 'c', 'joe'),
+                          ('commit', 'joe/bad', 'a', 'joe'),
+                          ('commit', 'joe/bad', 'b', 'joe')],
+                         self.repo.calls)
+
+    def test_failed_commits_kept_in_journal(self):
+        self.repo = FlakyRepo(1000)
+        self.queue = CommitQueue(self.repo, JOURNAL, batch_window=0.01,
+                                 retry_delay=60)
+        self.queue.start()
+        self.queue.commit('joe/bad', 'a', author=self.author)
+        self.queue.commit('joe/good', 'b', author=self.author)
+        self.assertFalse(self.queue.flush(0.1))
+        self.assertEqual(1, self.queue.pending)
+        self.assertFalse(self.queue.stop(1))
+
+        self.repo.failures = 1
+        self.queue = CommitQueue(self.repo, JOURNAL, batch_window=0.01,
+                                 retry_delay=0.01)
+        self.queue.start()
+        self.assertEqual(1, self.queue.pending)
+        self.assertTrue(self.queue.flush(1))
+        self.assertEqual([('commit', 'joe/good', 'b', 'joe'),
+                          ('commit', 'joe/bad', 'a', 'joe')],
+                         self.repo.calls)
+
+    def test_gives_up_after_max_attempts(self):
+        """A call that keeps failing goes to the dead letter file, and
+        later calls to its key go ahead.
+        """
+        self.repo = FlakyRepo(1000)
+        self.queue = CommitQueue(self.repo, JOURNAL, batch_window=0.01,
+                                 retry_delay=0.01, max_attempts=3)
+        self.queue.start()
+        self.queue.commit('joe/bad', 'a', author=self.author)
+        self.queue.commit('joe/good', 'b', author=self.author)
+        self.assertTrue(self.queue.flush(1))
+        self.assertEqual(1000 - 3, self.repo.failures)
+        try:
+            with open(self.queue.dead_path) as dead:
+                letters = [json.loads(line) for line in dead]
+            self.assertEqual([('joe/bad', 'a', 3)],
+                             [(l['key'], l['data'], l['attempts'])
+                              for l in letters])
+        finally:
+            os.remove(self.queue.dead_path)
+
+    def test_journal_compacted(self):
+        """A journal kept growing by a failing call is rewritten as just
+        the calls outstanding.
+        """
+        self.repo = FlakyRepo(1000)
+        self.queue = CommitQueue(self.repo, JOURNAL, batch_window=0,
+                                 retry_delay=60, max_journal_size=1024)
+        self.queue.start()
+        self.queue.commit('joe/bad', 'a', author=self.author)
+        for n in range(100):
+            self.queue.commit('joe/good', 'x' * 20, author=self.author)
+        self.queue.flush(0.5)
+        self.assertEqual(1, self.queue.pending)
+        self.assertLess(os.path.getsize(JOURNAL), 1024 + 200)
+        self.queue.stop(1)
+        self.assertEqual([('joe/bad', 'a')],
+                         [(e['key'], e['data'])
+                          for e in self.queue._read_journal()])
+
+    def test_journals(self):
+        for path in (JOURNAL, JOURNAL + '.0', JOURNAL + '.12', JOURNAL + '.x'):
+            open(path, 'w').close()
+        try:
+            self.assertEqual([JOURNAL, JOURNAL + '.0', JOURNAL + '.12'],
+                             journals(JOURNAL))
+        finally:
+            for path in (JOURNAL + '.0', JOURNAL + '.12', JOURNAL + '.x'):
+                os.remove(path)
@@ -2,11 +2,16 @@
 Test the database.  Mongod must be running.
 """
 
+import json
 import unittest
 import shutil
-from caustic.database import get_db, Users, Instructions
+from datetime import datetime, timedelta
+from caustic import database
+from caustic.database import get_db, reader, Users, Instructions, Changes
+from caustic.sessions import Session
 from jsongit import JsonGitRepository
 from dictshield.base import ShieldException
+from pymongo import ReadPreference
 from pymongo.errors import DuplicateKeyError
 
 db = get_db('localhost', 27017, 'caustic_test')
@@ -14,6 +19,22 @@ REPO_DIR = 'tmp_git'
 INSTRUCTION = {'load':'google'}  # valid instruction for convenience
 TAGS = ['useful', 'fun', 'interesting']
 
+class TestReader(unittest.TestCase):
+
+    def test_primary_reads(self):
+        coll = db.users
+        self.assertIs(coll, reader(coll))
+
+    def test_secondary_reads(self):
+        """Secondary reads get their own handle, leaving writes alone.
+        """
+        coll = db.users
+        reads = reader(coll, True)
+        self.assertEqual(ReadPreference.SECONDARY_PREFERRED, reads.read_preference)
+        self.assertNotEqual(ReadPreference.SECONDARY_PREFERRED, coll.read_preference)
+        self.assertEqual(coll.full_name, reads.full_name)
+
+
 class TestUsers(unittest.TestCase):
 
     def setUp(self):
@@ -29,6 +50,12 @@ class TestUsers(unittest.TestCase):
         u = self.users.create('joe')
         self.assertEquals('joe', u.name)
 
+    def test_create_user_matches_stored(self):
+        """The created user is what a read would return.
+        """
+        u = self.users.create('jim')
+        self.assertEquals(self.users.get(u.id).to_python(), u.to_python())
+
     def test_get_user_by_id(self):
         """Get a user by the assigned id.
         """
@@ -55,6 +82,86 @@ class TestUsers(unittest.TestCase):
         self.assertIsNone(self.users.get(george.id))
         self.assertIsNone(self.users.find('george'))
 
+    def test_for_session_cached(self):
+        """Session lookups are served from the cache.
+        """
+        u = self.users.create('cached')
+        self.assertEquals('cached', self.users.for_session(u.id).name)
+        db.users.remove(u.id)
+        self.assertEquals('cached', self.users.for_session(u.id).name)
+
+    def test_delete_user_clears_session(self):
+        """Cannot find user by session after being deleted.
+        """
+        u = self.users.create('ephemeral')
+        self.users.for_session(u.id)
+        self.users.delete(u)
+        self.assertIsNone(self.users.for_session(u.id))
+
+    def test_for_token(self):
+        """Users are built from session tokens without reading them.
+        """
+        u = self.users.create('tokened')
+        session = Session(str(u.id), 'tokened', 0, self.users.generation(u.id))
+        db.users.remove(u.id)
+        self.assertEquals(u.id, self.users.for_token(session).id)
+
+    def test_delete_user_revokes_token(self):
+        u = self.users.create('revoked')
+        session = Session(str(u.id), 'revoked', 0, self.users.generation(u.id))
+        self.users.delete(u)
+        self.assertIsNone(self.users.for_token(session))
+
+    def test_deleted_elsewhere_revokes_token(self):
+        """Deletions by other processes are noticed.
+        """
+        u = self.users.create('remote')
+        session = Session(str(u.id), 'remote', 0, self.users.generation(u.id))
+        Users(db).delete(u)
+        self.users.refresh_generations()
+        self.assertIsNone(self.users.for_token(session))
+
+    def test_refresh_reads_recent_deletions(self):
+        """After the first refresh, only recent deletions are read.
+        """
+        self.users.refresh_generations()
+        old = self.users.create('old')
+        db.deleted_users.save({'_id': old.id, 'name': 'old',
+                               'deleted_at': datetime.utcnow() - timedelta(days=1)})
+        self.users.refresh_generations()
+        self.assertEqual(0, self.users.generation(old.id))
+
+
+class TestChanges(unittest.TestCase):
+
+    def tearDown(self):
+        for name in set(db.collection_names()) - set([u'system.indexes']):
+            db[name].drop()
+
+    def test_reads_others_changes(self):
+        """Only other processes' changes since the last read are read.
+        """
+        here, there = Changes(db), Changes(db)
+        there.origin = 'elsewhere'
+        there.record([('joe', 'early')])
+        self.assertEqual([], here.read())
+        there.record([('joe', 'a'), ('ann', 'b')])
+        here.record([('joe', 'mine')])
+        self.assertEqual([('joe', 'a'), ('ann', 'b')], here.read())
+        self.assertEqual([], here.read())
+
+    def test_instructions_log_writes(self):
+        changes = Changes(db)
+        changes.read()
+        instructions = Instructions(Users(db), JsonGitRepository(REPO_DIR),
+                                    db, changes=Changes(db))
+        try:
+            instructions.create(Users(db).create('joe'), 'a', INSTRUCTION, [])
+            changes.origin = 'elsewhere'
+            self.assertEqual([('joe', 'a')], changes.read())
+        finally:
+            shutil.rmtree(REPO_DIR)
+
 
 class TestInstructions(unittest.TestCase):
 
@@ -79,6 +186,14 @@ class TestInstructions(unittest.TestCase):
         self.assertEquals(TAGS, doc.tags)
         doc.validate()
 
+    def test_create_instruction_matches_stored(self):
+        """The created instruction is what a read would return.
+        """
+        doc = self.instructions.create(self.creator, 'google', INSTRUCTION, TAGS)
+        self.assertIsNotNone(doc.id)
+        stored = self.instructions.find(self.creator.name, 'google')
+        self.assertEquals(stored.to_python(), doc.to_python())
+
     def test_duplicate_names_ok(self):
         """Duplicate names are OK provided the creators are different.
         """
@@ -200,3 +315,395 @@ class TestInstructions(unittest.TestCase):
         self.assertEqual({'load': 'something else'}, doc.instruction)
         self.assertEqual(['foo'], doc.tags)
 
+    def test_save_or_create_revisions(self):
+        """Only changed instructions are new revisions.
+        """
+        _, revised = self.instructions.save_or_create(
+            self.creator, 'revised', INSTRUCTION, TAGS)
+        self.assertTrue(revised)
+        _, revised = self.instructions.save_or_create(
+            self.creator, 'revised', dict(INSTRUCTION), list(TAGS))
+        self.assertFalse(revised)
+        _, revised = self.instructions.save_or_create(
+            self.creator, 'revised', INSTRUCTION, ['new tag'])
+        self.assertFalse(revised)
+        _, revised = self.instructions.save_or_create(
+            self.creator, 'revised', {'load': 'something else'}, ['new tag'])
+        self.assertTrue(revised)
+
+    def test_save_or_create_unchanged_not_written(self):
+        """Unchanged instructions are not written to the database.
+        """
+        self.instructions.create(self.creator, 'same', INSTRUCTION, TAGS)
+        db.instructions.update({'name': 'same'}, {'$set': {'marker': True}})
+        self.instructions.save_or_create(self.creator, 'same', INSTRUCTION, TAGS)
+        self.assertTrue(db.instructions.find_one({'name': 'same'})['marker'])
+
+    def test_import_many(self):
+        """Import creates, updates and reports on each item.
+        """
+        self.instructions.create(self.creator, 'same', INSTRUCTION, TAGS)
+        self.instructions.create(self.creator, 'changed', INSTRUCTION, TAGS)
+        results = self.instructions.import_many(self.creator, [
+            ('same', INSTRUCTION, TAGS),
+            ('changed', {'load': 'something else'}, TAGS),
+            ('new', INSTRUCTION, TAGS),
+            ('bad', {'foo': 'bar'}, TAGS),
+            ('new', INSTRUCTION, TAGS)])
+        self.assertEqual(['unchanged', 'updated', 'created', 'invalid', 'invalid'],
+                         [status for status, _ in results])
+        self.assertEqual('new', results[2][1].name)
+        self.assertIsNotNone(results[2][1].id)
+        changed = self.instructions.find(self.creator.name, 'changed')
+        self.assertEqual({'load': 'something else'}, changed.instruction)
+        self.assertEqual(2, changed.revision)
+        self.assertEqual(2, results[1][1].revision)
+        self.assertIsNotNone(self.instructions.find(self.creator.name, 'new'))
+        self.assertIsNone(self.instructions.find(self.creator.name, 'bad'))
+
+    def test_save_or_create_invalid(self):
+        """Invalid updates raise.
+        """
+        self.instructions.create(self.creator, 'valid', INSTRUCTION, TAGS)
+        with self.assertRaises(ShieldException):
+            self.instructions.save_or_create(self.creator, 'valid', 7, TAGS)
+
+
+    def test_creator_name_stored(self):
+        """Instructions carry their creator's name.
+        """
+        doc = self.instructions.create(self.creator, 'named', INSTRUCTION, TAGS)
+        self.assertEqual('creator', doc.creator_name)
+
+    def test_deleted_creator_name_reused(self):
+        """A new user with a deleted user's name doesn't get their instructions.
+        """
+        self.instructions.create(self.creator, 'orphan', INSTRUCTION, TAGS)
+        self.users.delete(self.creator)
+        self.users.create('creator')
+        self.assertEqual([], self.instructions.for_creator('creator'))
+        self.assertEqual([], self.instructions.tagged('creator', TAGS[0]))
+        self.assertIsNone(self.instructions.find('creator', 'orphan'))
+
+    def test_backfill_creator_names(self):
+        """Instructions without a creator name get one.
+        """
+        self.instructions.create(self.creator, 'old', INSTRUCTION, TAGS)
+        db.instructions.update({}, {'$unset': {'creator_name': 1}}, multi=True)
+        self.assertIsNone(self.instructions.find(self.creator.name, 'old'))
+        self.assertEqual(1, self.instructions.backfill_creator_names())
+        self.assertIsNotNone(self.instructions.find(self.creator.name, 'old'))
+        self.assertEqual(0, self.instructions.backfill_creator_names())
+
+    def test_hash_for(self):
+        """The content hash can be looked up without the instruction.
+        """
+        doc = self.instructions.create(self.creator, 'hashed', INSTRUCTION, TAGS)
+        self.assertEqual(doc.content_hash,
+                         self.instructions.hash_for(self.creator.name, 'hashed'))
+        self.assertIsNone(self.instructions.hash_for(self.creator.name, 'nope'))
+
+    def test_backfill_content_hashes(self):
+        """Instructions without a content hash or JSON get them.
+        """
+        doc = self.instructions.create(self.creator, 'old', INSTRUCTION, TAGS)
+        db.instructions.update({}, {'$unset': {'content_hash': 1,
+                                               'instruction_json': 1}},
+                               multi=True)
+        self.assertIsNone(self.instructions.hash_for(self.creator.name, 'old'))
+        self.assertIsNone(self.instructions.encoded_for(self.creator.name, 'old'))
+        self.assertEqual(1, self.instructions.backfill_content_hashes())
+        self.assertEqual((doc.instruction_json, doc.content_hash),
+                         self.instructions.encoded_for(self.creator.name, 'old'))
+        self.assertEqual(0, self.instructions.backfill_content_hashes())
+
+    def test_encoded_for(self):
+        """The stored JSON decodes to the instruction, and stays current.
+        """
+        instruction = {'load': u'http://example.com/\xe9', 'posts': {'b': 1, 'a': [2]}}
+        self.instructions.create(self.creator, 'encoded', instruction, TAGS)
+        encoded, _ = self.instructions.encoded_for(self.creator.name, 'encoded')
+        self.assertEqual(instruction, json.loads(encoded))
+
+        self.instructions.save_or_create(self.creator, 'encoded', INSTRUCTION, TAGS)
+        encoded, stored_hash = self.instructions.encoded_for(self.creator.name, 'encoded')
+        self.assertEqual(INSTRUCTION, json.loads(encoded))
+        self.assertEqual(self.instructions.hash_for(self.creator.name, 'encoded'),
+                         stored_hash)
+
+    def test_names_for_creator(self):
+        """List only the names of a creator's instructions, in order.
+        """
+        for name in ['foo', 'bar', 'baz']:
+            self.instructions.create(self.creator, name, INSTRUCTION, TAGS)
+        names = self.instructions.names_for_creator(self.creator.name)
+        self.assertEqual(['bar', 'baz', 'foo'], [n.name for n in names])
+        self.assertIsNone(self.instructions.names_for_creator('some dude'))
+
+    def test_names_tagged(self):
+        """List only the names of a creator's tagged instructions.
+        """
+        self.instructions.create(self.creator, 'roses', INSTRUCTION, ['red'])
+        self.instructions.create(self.creator, 'violets', INSTRUCTION, ['blue'])
+        names = self.instructions.names_tagged(self.creator.name, 'red')
+        self.assertEqual(['roses'], [n.name for n in names])
+        self.assertEqual([], self.instructions.names_tagged(self.creator.name, 'tag'))
+        self.assertIsNone(self.instructions.names_tagged('some dude', 'tag'))
+
+    def test_names_paginated(self):
+        """Page through names with after and limit.
+        """
+        for name in ['a', 'b', 'c', 'd', 'e']:
+            self.instructions.create(self.creator, name, INSTRUCTION, TAGS)
+        names = lambda **kw: [n.name for n in
+                              self.instructions.names_for_creator(
+                                  self.creator.name, **kw)]
+        self.assertEqual(['a', 'b'], names(limit=2))
+        self.assertEqual(['c', 'd'], names(after='b', limit=2))
+        self.assertEqual(['e'], names(after='d', limit=2))
+        self.assertEqual([], names(after='e', limit=2))
+        tagged = self.instructions.names_tagged(self.creator.name, TAGS[0],
+                                                after='c', limit=1)
+        self.assertEqual(['d'], [n.name for n in tagged])
+
+    def test_search(self):
+        """Search everyone's instructions by word prefix and tags.
+        """
+        other = self.users.create('other')
+        self.instructions.create(self.creator, 'property-owner',
+                                 {'load': 'google', 'description': 'Deeds'},
+                                 ['nyc', 'real-estate'])
+        self.instructions.create(other, 'property-tax', INSTRUCTION, ['nyc'])
+        self.instructions.create(other, 'weather', INSTRUCTION, ['nyc'])
+
+        def names(results):
+            return sorted((r.creator_name, r.name) for r in results)
+
+        self.assertEqual([('creator', 'property-owner'), ('other', 'property-tax')],
+                         names(self.instructions.search('prop')))
+        self.assertEqual([('creator', 'property-owner')],
+                         names(self.instructions.search('prop deed')))
+        self.assertEqual([('creator', 'property-owner')],
+                         names(self.instructions.search(tags=['nyc', 'real-estate'])))
+        self.assertEqual([('other', 'property-tax')],
+                         names(self.instructions.search('tax', ['nyc'])))
+        self.assertEqual([], self.instructions.search())
+
+    def test_search_words_dont_match_tags(self):
+        """Short query words don't find instructions by their tags.
+        """
+        self.instructions.create(self.creator, 'weather', INSTRUCTION, ['nyc'])
+        for query in ('t', 'ta', 'tag'):
+            self.assertEqual([], self.instructions.search(query))
+        self.assertEqual(1, len(self.instructions.search('w')))
+
+    def test_backfill_tag_terms(self):
+        doc = self.instructions.create(self.creator, 'weather', INSTRUCTION, ['nyc'])
+        db.instructions.update({'_id': doc.id},
+                               {'$set': {'search_terms': ['tag:nyc', 'weather']}})
+        self.assertEqual(1, self.instructions.backfill_search_terms())
+        self.assertEqual([], self.instructions.search('t'))
+        self.assertEqual(1, len(self.instructions.search(tags=['nyc'])))
+
+    def test_search_kept_current(self):
+        """Saves and deletions change what is found.
+        """
+        doc = self.instructions.create(self.creator, 'found', INSTRUCTION, ['old'])
+        doc.tags = ['new']
+        self.instructions.save(doc)
+        self.assertEqual([], self.instructions.search(tags=['old']))
+        self.assertEqual(1, len(self.instructions.search(tags=['new'])))
+        self.instructions.delete(doc)
+        self.assertEqual([], self.instructions.search(tags=['new']))
+
+    def test_search_skips_orphans(self):
+        """Instructions whose creator was deleted aren't found.
+        """
+        other = self.users.create('other')
+        self.instructions.create(other, 'orphan', INSTRUCTION, ['lost'])
+        self.users.delete(other)
+        self.assertEqual([], self.instructions.search(tags=['lost']))
+
+    def test_search_paginated(self):
+        for name in ['a', 'b', 'c']:
+            self.instructions.create(self.creator, name, INSTRUCTION, ['paged'])
+        first = self.instructions.search(tags=['paged'], limit=2)
+        rest = self.instructions.search(tags=['paged'], after=first[-1].id)
+        self.assertEqual(['a', 'b', 'c'], [r.name for r in first + rest])
+        self.assertEqual(1, len(self.instructions.search(tags=['paged'], limit=1)))
+        default, database.SEARCH_LIMIT = database.SEARCH_LIMIT, 2
+        try:
+            self.assertEqual(2, len(self.instructions.search(tags=['paged'])))
+        finally:
+            database.SEARCH_LIMIT = default
+
+    def test_dependents(self):
+        """Find what refers to an instruction, directly or not.
+        """
+        other = self.users.create('other')
+        self.instructions.create(self.creator, 'property', INSTRUCTION, TAGS)
+        self.instructions.create(self.creator, 'manhattan',
+                                 {'load': 'google', 'then': '/property'}, TAGS)
+        self.instructions.create(other, 'mine',
+                                 {'find': 'x',
+                                  'then': ['/creator/instructions/manhattan']},
+                                 TAGS)
+
+        direct = self.instructions.dependents(self.creator.name, 'property')
+        self.assertEqual(['manhattan'], [d.name for d in direct])
+        impact = self.instructions.all_dependents(self.creator.name, 'property')
+        self.assertEqual([('creator', 'manhattan'), ('other', 'mine')],
+                         [(d.creator_name, d.name) for d in impact])
+
+    def test_all_dependents_bounded(self):
+        """The walk is paginated, and stops at MAX_DEPENDENT_DEPTH.
+        """
+        self.instructions.create(self.creator, 'c0', INSTRUCTION, TAGS)
+        for n in range(1, 5):
+            self.instructions.create(self.creator, 'c%d' % n,
+                                     {'find': 'x', 'then': '/c%d' % (n - 1)},
+                                     TAGS)
+        first = self.instructions.all_dependents('creator', 'c0', limit=2)
+        rest = self.instructions.all_dependents('creator', 'c0', first[-1].id)
+        self.assertEqual(['c1', 'c2', 'c3', 'c4'],
+                         [d.name for d in first + rest])
+        default, database.MAX_DEPENDENT_DEPTH = database.MAX_DEPENDENT_DEPTH, 2
+        try:
+            self.assertEqual(['c1', 'c2'], [d.name for d in
+                             self.instructions.all_dependents('creator', 'c0')])
+        finally:
+            database.MAX_DEPENDENT_DEPTH = default
+
+    def test_dependents_skip_orphans(self):
+        other = self.users.create('other')
+        self.instructions.create(other, 'orphan',
+                                 {'find': 'x', 'then': '/creator/instructions/base'},
+                                 TAGS)
+        self.users.delete(other)
+        self.assertEqual([], self.instructions.dependents('creator', 'base'))
+        self.assertEqual([], self.instructions.all_dependents('creator', 'base'))
+
+    def test_dependents_kept_current(self):
+        doc = self.instructions.create(self.creator, 'user',
+                                       {'find': 'x', 'then': '/base'}, TAGS)
+        self.assertEqual(1, len(self.instructions.dependents('creator', 'base')))
+        doc.instruction = {'find': 'x'}
+        self.instructions.save(doc)
+        self.assertEqual([], self.instructions.dependents('creator', 'base'))
+
+    def test_history(self):
+        """Each change to an instruction's content is a revision.
+        """
+        self.instructions.save_or_create(self.creator, 'h', INSTRUCTION, TAGS)
+        self.instructions.save_or_create(self.creator, 'h', INSTRUCTION, ['x'])
+        self.instructions.save_or_create(self.creator, 'h', {'load': 'two'}, TAGS)
+        self.instructions.import_many(self.creator, [('h', {'load': 'three'}, TAGS)])
+
+        history = self.instructions.history(self.creator.name, 'h')
+        self.assertEqual([3, 2, 1], [r.rev for r in history])
+        self.assertEqual('creator', history[0].author)
+        revision, encoded = self.instructions.revision(self.creator.name, 'h', 2)
+        self.assertEqual(history[1], revision)
+        self.assertEqual({'load': 'two'}, json.loads(encoded))
+        self.assertEqual(3, self.instructions.find(self.creator.name, 'h').revision)
+
+    def test_history_paginated(self):
+        for load in ('a', 'b', 'c'):
+            self.instructions.save_or_create(self.creator, 'h', {'load': load}, TAGS)
+        first = self.instructions.history(self.creator.name, 'h', limit=2)
+        rest = self.instructions.history(self.creator.name, 'h', first[-1].rev)
+        self.assertEqual([3, 2, 1], [r.rev for r in first + rest])
+        self.assertIsNone(self.instructions.history(self.creator.name, 'none'))
+        self.assertIsNone(self.instructions.revision(self.creator.name, 'h', 4))
+
+    def test_diff(self):
+        """Diff revisions, caching the result.
+        """
+        self.instructions.save_or_create(self.creator, 'd', INSTRUCTION, TAGS)
+        self.instructions.save_or_create(self.creator, 'd', {'load': 'two'}, TAGS)
+        ops = self.instructions.diff(self.creator.name, 'd', 1, 2)
+        self.assertEqual([{'op': 'replace', 'path': '/load', 'value': 'two'}],
+                         ops)
+        self.assertIs(ops, self.instructions.diff(self.creator.name, 'd', 1, 2))
+        self.assertEqual([], self.instructions.diff(self.creator.name, 'd', 2, 2))
+        self.assertIsNone(self.instructions.diff(self.creator.name, 'd', 1, 3))
+
+    def test_diff_first_revision(self):
+        """The first revision is diffed against an empty instruction.
+        """
+        self.instructions.save_or_create(self.creator, 'd', INSTRUCTION, TAGS)
+        self.assertEqual([{'op': 'add', 'path': '/load', 'value': 'google'}],
+                         self.instructions.diff(self.creator.name, 'd', 0, 1))
+
+    def test_clone(self):
+        """Clones share their source's content until they are changed.
+        """
+        other = self.users.create('other')
+        source = self.instructions.create(self.creator, 'base', INSTRUCTION, TAGS)
+        clone = self.instructions.clone(other, source)
+        self.assertNotIn('instruction', db.instructions.find_one(clone.id))
+
+        found = self.instructions.find('other', 'base')
+        self.assertEqual(INSTRUCTION, found.instruction)
+        self.assertEqual(TAGS, found.tags)
+        self.assertEqual(source.id, found.cloned_from)
+        self.assertEqual(source.instruction_json,
+                         self.instructions.encoded_for('other', 'base')[0])
+        self.assertEqual([1], [r.rev for r in self.instructions.history('other', 'base')])
+        self.assertRaises(DuplicateKeyError, self.instructions.clone, other, source)
+
+        found.tags = ['retagged']
+        self.assertIsNone(self.instructions.save(found))
+        stored = db.instructions.find_one(clone.id)
+        self.assertNotIn('instruction', stored)
+        self.assertNotIn('instruction_json', stored)
+        self.assertEqual(['retagged'], stored['tags'])
+
+        found.instruction = {'load': 'changed'}
+        self.assertIsNone(self.instructions.save(found))
+        stored = db.instructions.find_one(clone.id)
+        self.assertEqual({'load': 'changed'}, stored['instruction'])
+        self.assertIsNone(stored.get('cloned_from'))
+        self.assertEqual(INSTRUCTION, self.instructions.find('creator', 'base').instruction)
+
+    def test_clone_retagged_by_import(self):
+        other = self.users.create('other')
+        source = self.instructions.create(self.creator, 'base', INSTRUCTION, TAGS)
+        clone = self.instructions.clone(other, source)
+        self.assertEqual([('updated', clone.id)],
+                         [(s, d.id) for s, d in self.instructions.import_many(
+                             other, [('base', INSTRUCTION, ['retagged'])])])
+        stored = db.instructions.find_one(clone.id)
+        self.assertNotIn('instruction', stored)
+        self.assertEqual(source.id, stored['cloned_from'])
+
+    def test_missing_blobs(self):
+        """Missing content is a miss, and a clone's is taken from its
+        unchanged source.
+        """
+        other = self.users.create('other')
+        source = self.instructions.create(self.creator, 'base', INSTRUCTION, TAGS)
+        self.instructions.clone(other, source)
+        db.blobs.remove()
+        self.instructions.blob_cache.clear()
+        self.assertIsNone(self.instructions.revision('creator', 'base', 1))
+        self.assertIsNone(self.instructions.diff('creator', 'base', 1, 1))
+
+        self.assertEqual(INSTRUCTION,
+                         self.instructions.find('other', 'base').instruction)
+        self.assertIsNotNone(self.instructions.revision('other', 'base', 1))
+
+        db.blobs.remove()
+        self.instructions.blob_cache.clear()
+        db.instructions.update({'_id': source.id},
+                               {'$set': {'content_hash': 'changed'}})
+        self.assertIsNone(self.instructions.find('other', 'base'))
+        self.assertEqual([], self.instructions.for_creator('other'))
+
+    def test_backfill_revisions(self):
+        doc = self.instructions.create(self.creator, 'old', INSTRUCTION, TAGS)
+        db.instructions.update({'_id': doc.id}, {'$unset': {'revision': 1}})
+        db.revisions.remove()
+        self.assertEqual(1, self.instructions.backfill_revisions())
+        self.assertEqual([1], [r.rev for r in
+                               self.instructions.history(self.creator.name, 'old')])
@@ -0,0 +1,66 @@
+"""
+Test caustic/diff.py .
+"""
+
+import copy
+import unittest
+from caustic.diff import diff, patch
+
+PROPERTY = {
+    'load': 'http://nycprop.nyc.gov/nycproperty/nynav/jsp/selectbbl.jsp',
+    'then': [{'find': 'borough %d' % n, 'name': 'Borough'} for n in range(1, 6)],
+    'metadata': {'a/b': 1, 'c~d': True}
+}
+
+
+class TestDiff(unittest.TestCase):
+
+    def assertPatches(self, old, new):
+        ops = diff(old, new)
+        self.assertEqual(new, patch(copy.deepcopy(old), ops))
+        return ops
+
+    def test_unchanged(self):
+        self.assertEqual([], diff(PROPERTY, copy.deepcopy(PROPERTY)))
+
+    def test_keys(self):
+        new = copy.deepcopy(PROPERTY)
+        new['load'] = 'http://example.com/'
+        new['description'] = 'Added'
+        del new['metadata']['a/b']
+        self.assertEqual([
+            {'op': 'replace', 'path': '/load', 'value': 'http://example.com/'},
+            {'op': 'remove', 'path': '/metadata/a~1b'},
+            {'op': 'add', 'path': '/description', 'value': 'Added'},
+        ], sorted(self.assertPatches(PROPERTY, new), key=lambda op: op['op'])[::-1])
+
+    def test_insert_is_small(self):
+        """Adding to the front of an array doesn't touch the rest.
+        """
+        new = copy.deepcopy(PROPERTY)
+        new['then'].insert(0, {'find': 'first'})
+        self.assertEqual([{'op': 'add', 'path': '/then/0',
+                           'value': {'find': 'first'}}],
+                         self.assertPatches(PROPERTY, new))
+
+    def test_nested_change_in_array(self):
+        new = copy.deepcopy(PROPERTY)
+        new['then'][2]['name'] = 'Queens'
+        self.assertEqual([{'op': 'replace', 'path': '/then/2/name',
+                           'value': 'Queens'}],
+                         self.assertPatches(PROPERTY, new))
+
+    def test_remove_and_replace_items(self):
+        self.assertPatches([1, 2, 3, 4, 5], [1, 9, 5])
+        self.assertPatches([1, 9, 5], [1, 2, 3, 4, 5])
+        self.assertPatches([1, 2], [])
+
+    def test_types(self):
+        self.assertEqual([{'op': 'replace', 'path': '/x', 'value': True}],
+                         self.assertPatches({'x': 1}, {'x': True}))
+        self.assertEqual([{'op': 'replace', 'path': '', 'value': [1]}],
+                         self.assertPatches({'x': 1}, [1]))
+
+    def test_bad_path(self):
+        self.assertRaises(ValueError, patch, {},
+                          [{'op': 'remove', 'path': '/missing'}])
@@ -0,0 +1,45 @@
+"""
+Test caustic/encoding.py .
+"""
+
+import unittest
+import json
+from caustic.encoding import json_array_chunks, canonical_json, content_hash, \
+                             json_hash
+
+
+class TestJsonArrayChunks(unittest.TestCase):
+
+    def test_chunks_parse_as_array(self):
+        """Joined chunks are the JSON array of the items.
+        """
+        for n in [0, 1, 2, 3, 4, 7]:
+            items = ['/joe/instructions/%d' % i for i in range(n)]
+            chunks = list(json_array_chunks(items, size=2))
+            self.assertEqual(items, json.loads(''.join(chunks)))
+
+    def test_chunk_size(self):
+        """One chunk per `size` items, plus the closing bracket.
+        """
+        self.assertEqual(3, len(list(json_array_chunks(range(4), size=2))))
+        self.assertEqual(1, len(list(json_array_chunks([]))))
+
+
+class TestCanonicalJson(unittest.TestCase):
+
+    def test_key_order_irrelevant(self):
+        a = {'load': 'x', 'then': [{'find': 'y', 'match': 0}]}
+        b = {'then': [{'match': 0, 'find': 'y'}], 'load': 'x'}
+        self.assertEqual(canonical_json(a), canonical_json(b))
+        self.assertEqual(content_hash(a), content_hash(b))
+
+    def test_no_whitespace(self):
+        self.assertEqual('{"a":[1,2]}', canonical_json({'a': [1, 2]}))
+
+    def test_content_matters(self):
+        self.assertNotEqual(content_hash({'load': 'x'}), content_hash({'load': 'y'}))
+
+    def test_json_hash(self):
+        value = {'load': 'x', 'posts': {'a': u'\xe9'}}
+        self.assertEqual(content_hash(value), json_hash(canonical_json(value)))
+        self.assertEqual(value, json.loads(canonical_json(value)))
@@ -0,0 +1,81 @@
+"""
+Test caustic/metrics.py .
+"""
+
+import os
+import shutil
+import unittest
+from caustic.metrics import Registry
+
+METRICS_DIR = 'tmp_metrics'
+
+
+class TestRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = Registry()
+        self.registry.histogram('latency', 'How long.', buckets=(0.1, 1))
+
+    def test_histogram(self):
+        for value in (0.05, 0.1, 0.5, 2):
+            self.registry.observe('latency', value, handler='Index')
+        lines = self.registry.render().splitlines()
+        self.assertEqual(['# HELP latency How long.',
+                          '# TYPE latency histogram',
+                          'latency_bucket{handler="Index",le="0.1"} 2',
+                          'latency_bucket{handler="Index",le="1"} 3',
+                          'latency_bucket{handler="Index",le="+Inf"} 4',
+                          'latency_sum{handler="Index"} 2.65',
+                          'latency_count{handler="Index"} 4'], lines)
+
+    def test_undeclared(self):
+        self.assertRaises(KeyError, self.registry.observe, 'missing', 1)
+
+    def test_instrumented(self):
+        @self.registry.instrumented('latency')
+        class Timed(object):
+            def public(self):
+                return 'done'
+
+            def _private(self):
+                pass
+
+        timed = Timed()
+        self.assertEqual('done', timed.public())
+        timed._private()
+        text = self.registry.render()
+        self.assertIn('latency_count{cls="Timed",method="public"} 1', text)
+        self.assertNotIn('_private', text)
+
+    def test_gauges(self):
+        self.registry.gauge('pending', 'Waiting.', lambda: 3)
+        self.registry.gauge('pool', 'Pool.', lambda: [({'stat': 'size'}, 4)])
+        text = self.registry.render()
+        self.assertIn('\npending 3.0\n', text)
+        self.assertIn('\npool{stat="size"} 4.0\n', text)
+
+    def test_escaped_labels(self):
+        self.registry.observe('latency', 0, path='a"b\\c')
+        self.assertIn(r'path="a\"b\\c"', self.registry.render())
+
+    def test_workers_merged(self):
+        os.makedirs(METRICS_DIR)
+        try:
+            other = Registry()
+            other.histogram('latency', 'How long.', buckets=(0.1, 1))
+            other.labels['worker'] = 1
+            other.observe('latency', 0.5, handler='Index')
+            other.publish(METRICS_DIR)
+            self.registry.labels['worker'] = 0
+            self.registry.observe('latency', 2, handler='Index')
+            self.registry.publish(METRICS_DIR)
+
+            others = self.registry.published(METRICS_DIR, 60)
+            self.assertEqual(1, len(others))
+            text = self.registry.render(others)
+            self.assertEqual(1, text.count('# TYPE latency histogram'))
+            self.assertIn('latency_count{handler="Index",worker="0"} 1', text)
+            self.assertIn('latency_count{handler="Index",worker="1"} 1', text)
+            self.assertEqual([], self.registry.published(METRICS_DIR, -1))
+        finally:
+            shutil.rmtree(METRICS_DIR)
@@ -0,0 +1,48 @@
+"""
+Test caustic/offload.py .
+"""
+
+import time
+import unittest
+import threading
+from caustic.offload import ThreadPool
+
+
+class TestThreadPool(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = ThreadPool(1, max_queue=0)
+
+    def test_returns(self):
+        self.assertEqual(3, self.pool.run(lambda a, b=0: a + b, 1, b=2))
+
+    def test_raises(self):
+        def fail():
+            raise ValueError('nope')
+        self.assertRaises(ValueError, self.pool.run, fail)
+        self.assertEqual(0, self.pool.pending)
+
+    def test_bounded(self):
+        """Calls beyond the pool's size and queue wait their turn, and the
+        wait is reported.
+        """
+        release = threading.Event()
+        first = threading.Thread(target=self.pool.run, args=(release.wait,))
+        first.start()
+        while self.pool.pending < 1:
+            time.sleep(0.01)
+        second = threading.Thread(target=self.pool.run, args=(lambda: None,))
+        second.start()
+        while self.pool.pending < 2:
+            time.sleep(0.01)
+
+        self.assertEqual(1, self.pool.queue_depth)
+        time.sleep(0.05)
+        release.set()
+        first.join(1)
+        second.join(1)
+
+        stats = self.pool.stats()
+        self.assertEqual(0, stats['queue_depth'])
+        self.assertEqual(2, stats['calls'])
+        self.assertGreaterEqual(stats['max_wait'], 0.05)
@@ -0,0 +1,77 @@
+"""
+Test caustic/profiling.py .
+"""
+
+import shutil
+import pstats
+import unittest
+from caustic.profiling import RequestProfiler
+
+PROFILE_DIR = 'tmp_profiles'
+
+
+class Clock(object):
+
+    def __init__(self):
+        self.now = 1000
+
+    def __call__(self):
+        return self.now
+
+
+class TestRequestProfiler(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.profiler = RequestProfiler(PROFILE_DIR, 'secret', threshold=1,
+                                        keep=2, clock=self.clock)
+
+    def tearDown(self):
+        shutil.rmtree(PROFILE_DIR)
+
+    def request(self, seconds):
+        self.clock.now += seconds
+        return 'done'
+
+    def test_tokens(self):
+        token = self.profiler.token(60)
+        self.assertTrue(self.profiler.wants(token))
+        self.assertFalse(self.profiler.wants(None))
+        self.assertFalse(self.profiler.wants(token[:-1] + 'x'))
+        self.assertFalse(self.profiler.wants(u'1.caf\xe9'))
+        other = RequestProfiler(PROFILE_DIR, 'other', clock=self.clock)
+        self.assertFalse(other.authorized(token))
+        self.clock.now += 60
+        self.assertFalse(self.profiler.authorized(token))
+
+    def test_sampled(self):
+        self.profiler.sample_rate = 1
+        self.assertTrue(self.profiler.wants(None))
+
+    def test_only_slow_requests_kept(self):
+        self.assertEqual('done', self.profiler.run('Fast_GET', self.request, 0.5))
+        self.assertEqual([], self.profiler.profiles())
+        self.profiler.run('Slow_PUT', self.request, 2)
+        profiles = self.profiler.profiles()
+        self.assertEqual([('Slow_PUT', 2000)],
+                         [(p['name'], p['elapsed_ms']) for p in profiles])
+        pstats.Stats(self.profiler.path(profiles[0]['id']))
+
+    def test_ring(self):
+        for name in ('first', 'second', 'third'):
+            self.profiler.run(name, self.request, 1)
+        self.assertEqual(['third', 'second'],
+                         [p['name'] for p in self.profiler.profiles()])
+
+    def test_one_at_a_time(self):
+        def nested():
+            self.clock.now += 2
+            return self.profiler.run('Inner', self.request, 2)
+        self.assertEqual('done', self.profiler.run('Outer', nested))
+        self.assertEqual(['Outer'], [p['name'] for p in self.profiler.profiles()])
+        self.profiler.run('Again', self.request, 1)
+        self.assertEqual(2, len(self.profiler.profiles()))
+
+    def test_path(self):
+        self.assertIsNone(self.profiler.path('../secret'))
+        self.assertIsNone(self.profiler.path('1000000000000-000-1ms-gone'))
@@ -0,0 +1,193 @@
+"""
+Test caustic/resolver.py .
+"""
+
+import unittest
+from caustic.resolver import Resolver, ReferenceCycleError, parse_reference, \
+                             references
+
+
+class Doc(object):
+
+    def __init__(self, creator_name, name, instruction):
+        self.creator_name = creator_name
+        self.name = name
+        self.instruction = instruction
+
+
+class Instructions(object):
+    """Just enough of caustic.database.Instructions.
+    """
+
+    def __init__(self):
+        self.docs = {}
+        self.listeners = []
+        self.finds = 0
+
+    def find(self, creator_name, name, primary=False):
+        self.finds += 1
+        return self.docs.get((creator_name, name))
+
+    def save(self, creator_name, name, instruction):
+        doc = Doc(creator_name, name, instruction)
+        self.docs[(creator_name, name)] = doc
+        for listener in self.listeners:
+            listener(doc, False)
+
+    def delete(self, creator_name, name):
+        doc = self.docs.pop((creator_name, name))
+        for listener in self.listeners:
+            listener(doc, True)
+
+
+class Changes(object):
+    """Just enough of caustic.database.Changes.
+    """
+
+    def __init__(self):
+        self.keys = []
+
+    def read(self):
+        keys, self.keys = self.keys, []
+        return keys
+
+
+class Clock(object):
+
+    def __init__(self):
+        self.now = 1000
+
+    def __call__(self):
+        return self.now
+
+
+class TestResolver(unittest.TestCase):
+
+    def setUp(self):
+        self.instructions = Instructions()
+        self.resolver = Resolver(self.instructions)
+
+    def test_parse_reference(self):
+        self.assertEqual(('joe', 'leaf'), parse_reference('joe', '/leaf'))
+        self.assertEqual(('ann', 'leaf'),
+                         parse_reference('joe', '/ann/instructions/leaf'))
+        self.assertIsNone(parse_reference('joe', 'leaf'))
+        self.assertIsNone(parse_reference('joe', '/'))
+        self.assertIsNone(parse_reference('joe', {'load': '/leaf'}))
+
+    def test_references(self):
+        instruction = {'extends': '/base',
+                       'then': ['/a', {'find': 'x', 'then': '/ann/instructions/b'},
+                                'bare', {'load': '/not-a-reference'}]}
+        self.assertEqual(['/ann/instructions/b', '/joe/instructions/a',
+                          '/joe/instructions/base'],
+                         references('joe', instruction))
+        self.assertEqual(['/joe/instructions/a'], references('joe', '/a'))
+        self.assertEqual([], references(None, '/a'))
+
+    def test_missing(self):
+        self.assertIsNone(self.resolver.resolve('joe', 'nothing'))
+
+    def test_then_reference(self):
+        self.instructions.save('joe', 'leaf', {'find': 'a'})
+        self.instructions.save('joe', 'root', {'load': 'http://a.com/',
+                                               'then': ['/leaf', 'bare']})
+        self.assertEqual({'load': 'http://a.com/',
+                          'then': [{'find': 'a'}, 'bare']},
+                         self.resolver.resolve('joe', 'root'))
+
+    def test_other_users_reference(self):
+        self.instructions.save('ann', 'leaf', {'find': 'a'})
+        self.instructions.save('joe', 'root', {'load': 'http://a.com/',
+                                               'then': '/ann/instructions/leaf'})
+        self.assertEqual({'find': 'a'},
+                         self.resolver.resolve('joe', 'root')['then'])
+
+    def test_missing_reference_left_alone(self):
+        self.instructions.save('joe', 'root', {'find': 'a', 'then': '/leaf'})
+        self.assertEqual('/leaf', self.resolver.resolve('joe', 'root')['then'])
+
+    def test_extends_merges(self):
+        self.instructions.save('joe', 'property', {
+            'load': 'http://a.com/', 'posts': {'boro': 1, 'house': 2}})
+        self.instructions.save('joe', 'manhattan', {
+            'extends': '/property', 'posts': {'boro': 3}})
+        self.assertEqual({'load': 'http://a.com/',
+                          'posts': {'boro': 3, 'house': 2}},
+                         self.resolver.resolve('joe', 'manhattan'))
+
+    def test_extends_cycle(self):
+        self.instructions.save('joe', 'a', {'extends': '/b'})
+        self.instructions.save('joe', 'b', {'extends': '/a'})
+        self.assertRaises(ReferenceCycleError, self.resolver.resolve, 'joe', 'a')
+
+    def test_then_cycle_left_as_reference(self):
+        self.instructions.save('joe', 'page', {'find': 'a', 'then': '/page'})
+        self.assertEqual({'find': 'a', 'then': '/page'},
+                         self.resolver.resolve('joe', 'page'))
+
+    def test_memoised(self):
+        self.instructions.save('joe', 'leaf', {'find': 'a'})
+        self.instructions.save('joe', 'root', {'find': 'b', 'then': '/leaf'})
+        self.resolver.resolve('joe', 'root')
+        finds = self.instructions.finds
+        self.resolver.resolve('joe', 'root')
+        self.assertEqual(finds, self.instructions.finds)
+
+    def test_save_in_chain_invalidates(self):
+        self.instructions.save('joe', 'leaf', {'find': 'a'})
+        self.instructions.save('joe', 'root', {'find': 'b', 'then': '/leaf'})
+        self.resolver.resolve('joe', 'root')
+        self.instructions.save('joe', 'leaf', {'find': 'c'})
+        self.assertEqual({'find': 'c'},
+                         self.resolver.resolve('joe', 'root')['then'])
+
+    def test_delete_in_chain_invalidates(self):
+        self.instructions.save('joe', 'leaf', {'find': 'a'})
+        self.instructions.save('joe', 'root', {'find': 'b', 'then': '/leaf'})
+        self.resolver.resolve('joe', 'root')
+        self.instructions.delete('joe', 'leaf')
+        self.assertEqual('/leaf', self.resolver.resolve('joe', 'root')['then'])
+
+    def test_create_missing_reference_invalidates(self):
+        self.instructions.save('joe', 'root', {'find': 'b', 'then': '/leaf'})
+        self.resolver.resolve('joe', 'root')
+        self.instructions.save('joe', 'leaf', {'find': 'a'})
+        self.assertEqual({'find': 'a'},
+                         self.resolver.resolve('joe', 'root')['then'])
+
+    def test_dependencies_forgotten_with_results(self):
+        """What a result was built from isn't tracked once it is evicted.
+        """
+        self.resolver = Resolver(self.instructions, cache_size=1)
+        self.instructions.save('joe', 'leaf', {'find': 'a'})
+        self.instructions.save('joe', 'root', {'find': 'b', 'then': '/leaf'})
+        self.instructions.save('joe', 'other', {'find': 'c'})
+        self.resolver.resolve('joe', 'root')
+        self.resolver.resolve('joe', 'other')
+        self.assertEqual({('joe', 'other'): set([('joe', 'other')])},
+                         self.resolver._dependents)
+
+    def test_changes_elsewhere_invalidate(self):
+        """Changes logged by other processes are polled for, and only
+        what was built from them is forgotten.
+        """
+        changes, clock = Changes(), Clock()
+        self.resolver = Resolver(self.instructions, changes=changes,
+                                 poll_interval=1, clock=clock)
+        self.instructions.save('joe', 'leaf', {'find': 'a'})
+        self.instructions.save('joe', 'root', {'find': 'b', 'then': '/leaf'})
+        self.instructions.save('joe', 'other', {'find': 'c'})
+        self.resolver.resolve('joe', 'root')
+        self.resolver.resolve('joe', 'other')
+
+        self.instructions.docs[('joe', 'leaf')].instruction = {'find': 'd'}
+        changes.keys.append(('joe', 'leaf'))
+        self.assertEqual({'find': 'a'},
+                         self.resolver.resolve('joe', 'root')['then'])
+        clock.now += 1
+        finds = self.instructions.finds
+        self.assertEqual({'find': 'd'},
+                         self.resolver.resolve('joe', 'root')['then'])
+        self.resolver.resolve('joe', 'other')
+        self.assertEqual(finds + 2, self.instructions.finds)
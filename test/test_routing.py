@@ -0,0 +1,71 @@
+"""
+Test caustic/routing.py .
+"""
+
+import re
+import unittest
+from caustic.routing import SegmentRouter
+
+V_C = r'\w\-'
+ROUTES = [
+    ('/', 'index'),
+    ('/:user', 'user'),
+    ('/:user/instructions', 'instructions'),
+    ('/:user/instructions/:name', 'instruction'),
+    ('/:user/tagged/:tag', 'tagged')]
+
+
+class TestSegmentRouter(unittest.TestCase):
+
+    def setUp(self):
+        self.router = SegmentRouter(V_C)
+        for pattern, handler in ROUTES:
+            self.router.add(pattern, handler)
+
+    def test_match(self):
+        self.assertEqual(('index', ()), self.router.match('/'))
+        self.assertEqual(('index', ()), self.router.match(''))
+        self.assertEqual(('user', ('joe',)), self.router.match('/joe/'))
+        self.assertEqual(('instructions', ('joe',)),
+                         self.router.match('/joe/instructions'))
+        self.assertEqual(('instruction', ('joe', 'bqe')),
+                         self.router.match('/joe/instructions/bqe/'))
+        self.assertEqual(('tagged', ('joe', 'fun')),
+                         self.router.match('/joe/tagged/fun'))
+
+    def test_literal_segments_can_be_captured(self):
+        """A user may be called `instructions`.
+        """
+        self.assertEqual(('instruction', ('instructions', 'tagged')),
+                         self.router.match('/instructions/instructions/tagged'))
+
+    def test_no_match(self):
+        for path in ['/joe/tagged', '/joe/bad/x', '/jo e', '//',
+                     '/joe//', '/joe/instructions/a/b', 'joe']:
+            self.assertIsNone(self.router.match(path), path)
+
+    def test_agrees_with_regex(self):
+        """The router and its regexes route the same paths the same way.
+        """
+        regexes = [(re.compile(self.router.regex(p)), h) for p, h in ROUTES]
+        for path in ['/', '', '/joe', '/joe/', '/joe/instructions',
+                     '/joe/instructions/bqe', '/joe/tagged/fun', '/joe/tagged',
+                     '/jo e', '/joe/instructions/a/b', '/a-b/tagged/c_d']:
+            expected = None
+            for regex, handler in regexes:
+                m = regex.match(path)
+                if m:
+                    expected = (handler, m.groups())
+                    break
+            self.assertEqual(expected, self.router.match(path), path)
+
+    def test_regex(self):
+        self.assertEqual(r'^/?$', self.router.regex('/'))
+        self.assertEqual(r'^/([%s]+)/instructions/([%s]+)/?$' % (V_C, V_C),
+                         self.router.regex('/:user/instructions/:name'))
+
+    def test_memo_cleared_by_new_routes(self):
+        self.assertIsNone(self.router.match('/joe/starred/fun'))
+        self.router.add('/:user/starred/:tag', 'starred')
+        self.assertEqual(('starred', ('joe', 'fun')),
+                         self.router.match('/joe/starred/fun'))
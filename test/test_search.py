@@ -0,0 +1,37 @@
+"""
+Test caustic/search.py .
+"""
+
+import unittest
+from caustic.search import search_terms, words, tag_term
+
+
+class TestSearchTerms(unittest.TestCase):
+
+    def test_words(self):
+        self.assertEqual(['nyc', 'property', 'owner'],
+                         words('NYC property-owner'))
+        self.assertEqual([], words(None))
+
+    def test_terms(self):
+        instruction = {'load': 'http://example.com/',
+                       'name': 'Owner',
+                       'description': 'Finds the owner of a lot.',
+                       'metadata': {'borough': ['Manhattan'], 'year': 2012}}
+        terms = search_terms('nyc-property', instruction, ['Real Estate'])
+        for term in ['nyc', 'property', 'owner', 'finds', 'lot', 'borough',
+                     'manhattan', 'real', 'estate', tag_term('Real Estate')]:
+            self.assertIn(term, terms)
+        self.assertNotIn('example', terms)
+        self.assertNotIn('2012', terms)
+        self.assertEqual(sorted(terms), terms)
+
+    def test_string_instruction(self):
+        self.assertEqual([tag_term('x'), 'bare', 'x'],
+                         search_terms('bare', 'a string', ['x']))
+
+    def test_words_never_match_tags(self):
+        for tag in ('nyc', 'tag', 'x y'):
+            term = tag_term(tag)
+            for word in words('t ta tag n ny nyc x'):
+                self.assertFalse(term.startswith(word))
@@ -249,6 +249,75 @@ class TestServerJSON(unittest.TestCase):
         self.assertEqual(200, r.status_code, r.content)
         self.assertJsonEqual(load_nytimes, r.content)
 
+    def test_update_instruction_unchanged(self):
+        """
+        Re-PUTting the same instruction does not create a revision.
+        """
+        self._signup('repeater')
+        r = self.s.put("%s/repeater/instructions/same" % HOST,
+                       data=VALID_INSTRUCTION)
+        self.assertEqual('true', r.headers['X-Revision-Created'])
+        r = self.s.put("%s/repeater/instructions/same" % HOST,
+                       data=VALID_INSTRUCTION)
+        self.assertEqual(201, r.status_code, r.content)
+        self.assertEqual('false', r.headers['X-Revision-Created'])
+
+    def test_get_instruction_etag(self):
+        """
+        A matching If-None-Match gets an empty 304 until the instruction
+        changes.
+        """
+        self._signup('poller')
+        self.s.put("%s/poller/instructions/polled" % HOST, data=VALID_INSTRUCTION)
+        r = self.s.get("%s/poller/instructions/polled" % HOST)
+        etag = r.headers['ETag']
+
+        r = self.s.get("%s/poller/instructions/polled" % HOST,
+                       headers={'If-None-Match': etag})
+        self.assertEqual(304, r.status_code, r.content)
+        self.assertEqual('', r.content)
+        self.assertEqual(etag, r.headers['ETag'])
+
+        self.s.put("%s/poller/instructions/polled" % HOST, data={
+            'instruction': json.dumps({"load": "http://www.nytimes.com/"}),
+            'tags': TAGS
+        })
+        r = self.s.get("%s/poller/instructions/polled" % HOST,
+                       headers={'If-None-Match': etag})
+        self.assertEqual(200, r.status_code, r.content)
+        self.assertNotEqual(etag, r.headers['ETag'])
+
+    def test_get_instruction_resolved(self):
+        """
+        Path references can be expanded server-side, and the expansion
+        follows updates.
+        """
+        self._signup('weaver')
+        self.s.put("%s/weaver/instructions/leaf" % HOST, data=VALID_INSTRUCTION)
+        self.s.put("%s/weaver/instructions/root" % HOST, data={
+            'instruction': json.dumps({"load": "http://www.google.com/",
+                                       "then": "/leaf"}),
+            'tags': TAGS
+        })
+
+        r = self.s.get("%s/weaver/instructions/root" % HOST,
+                       params={'resolved': 'true'})
+        self.assertEqual(200, r.status_code, r.content)
+        self.assertEqual(json.loads(LOAD_GOOGLE), json.loads(r.content)['then'])
+
+        load_nytimes = {"load": "http://www.nytimes.com/"}
+        self.s.put("%s/weaver/instructions/leaf" % HOST, data={
+            'instruction': json.dumps(load_nytimes),
+            'tags': TAGS
+        })
+        r = self.s.get("%s/weaver/instructions/root" % HOST,
+                       params={'resolved': 'true'})
+        self.assertEqual(load_nytimes, json.loads(r.content)['then'])
+
+        r = self.s.get("%s/weaver/instructions/root" % HOST,
+                       params={'resolved': 'false'})
+        self.assertEqual('/leaf', json.loads(r.content)['then'])
+
     def test_user_instructions(self):
         """
         Get all the instructions by a particular user.
@@ -263,6 +332,32 @@ class TestServerJSON(unittest.TestCase):
                                '/joe/instructions/bar'],
                               json.loads(r.content))
 
+    def test_import_instructions(self):
+        """
+        Import several instructions at once, as JSON or NDJSON.
+        """
+        self._signup('importer')
+        items = [{'name': 'foo', 'instruction': json.loads(LOAD_GOOGLE),
+                  'tags': ['fun']},
+                 {'name': 'bar', 'instruction': {'foo': 'bar'}},
+                 {'name': 'bad name', 'instruction': json.loads(LOAD_GOOGLE)}]
+        r = self.s.post("%s/importer/instructions" % HOST, data=json.dumps(items),
+                        headers={'content-type': 'application/json'})
+        self.assertEqual(200, r.status_code, r.content)
+        results = json.loads(r.content)
+        self.assertEqual(['created', 'invalid', 'invalid'],
+                         [result['status'] for result in results])
+        self.assertEqual('/importer/instructions/foo', results[0]['path'])
+
+        r = self.s.post("%s/importer/instructions" % HOST,
+                        data='\n'.join(json.dumps(i) for i in items[:1]),
+                        headers={'content-type': 'application/x-ndjson'})
+        self.assertEqual(['unchanged'],
+                         [result['status'] for result in json.loads(r.content)])
+
+        r = self.s.get("%s/importer/tagged/fun" % HOST)
+        self.assertEqual(['/importer/instructions/foo'], json.loads(r.content))
+
     def test_get_instructions_by_tag(self):
         """
         Get several instructions with one tag.  Returns an array of
@@ -284,6 +379,139 @@ class TestServerJSON(unittest.TestCase):
                                "/trog-dor/instructions/pillaging"],
                               json.loads(r.content))
 
+    def test_user_instructions_paginated(self):
+        """
+        Page through a user's instructions with `limit` and `after`.
+        """
+        self._signup('pager')
+        for name in ['a', 'b', 'c']:
+            self.s.put("%s/pager/instructions/%s" % (HOST, name),
+                       data=VALID_INSTRUCTION)
+
+        r = self.s.get("%s/pager/instructions/?limit=2" % HOST)
+        self.assertEqual(200, r.status_code, r.content)
+        self.assertEqual(['/pager/instructions/a', '/pager/instructions/b'],
+                         json.loads(r.content))
+        self.assertIn('after=b', r.headers['Link'])
+
+        r = self.s.get("%s/pager/instructions/?limit=2&after=b" % HOST)
+        self.assertEqual(['/pager/instructions/c'], json.loads(r.content))
+        self.assertNotIn('Link', r.headers)
+
+        r = self.s.get("%s/pager/instructions/?limit=zero" % HOST)
+        self.assertEqual(400, r.status_code, r.content)
+
+    def test_user_instructions_streamed(self):
+        """
+        Stream a user's instructions.
+        """
+        self._signup('streamer')
+        for name in ['a', 'b']:
+            self.s.put("%s/streamer/instructions/%s" % (HOST, name),
+                       data=VALID_INSTRUCTION)
+
+        r = self.s.get("%s/streamer/instructions/?stream=true" % HOST)
+        self.assertEqual(200, r.status_code, r.content)
+        self.assertEqual(['/streamer/instructions/a', '/streamer/instructions/b'],
+                         json.loads(r.content))
+
+    def test_dependents(self):
+        """
+        List the instructions that refer to one.
+        """
+        self._signup('depended')
+        self.s.put("%s/depended/instructions/base" % HOST, data=VALID_INSTRUCTION)
+        self.s.put("%s/depended/instructions/user" % HOST, data={
+            'instruction': json.dumps({"load": "http://www.google.com/",
+                                       "then": "/base"}),
+            'tags': TAGS
+        })
+
+        r = self.s.get("%s/depended/instructions/base/dependents" % HOST)
+        self.assertEqual(200, r.status_code, r.content)
+        self.assertEqual(['/depended/instructions/user'], json.loads(r.content))
+
+    def test_history(self):
+        """
+        List the revisions of an instruction and get an old one.
+        """
+        self._signup('historian')
+        self.s.put("%s/historian/instructions/h" % HOST, data=VALID_INSTRUCTION)
+        self.s.put("%s/historian/instructions/h" % HOST, data={
+            'instruction': json.dumps({"load": "http://www.example.com/"}),
+            'tags': TAGS
+        })
+
+        r = self.s.get("%s/historian/instructions/h/history?limit=1" % HOST)
+        self.assertEqual(200, r.status_code, r.content)
+        self.assertEqual([2], [rev['rev'] for rev in json.loads(r.content)])
+        self.assertIn('after=2', r.headers['Link'])
+
+        r = self.s.get("%s/historian/instructions/h/history/1" % HOST)
+        self.assertEqual(200, r.status_code, r.content)
+        self.assertEqual(json.loads(VALID_INSTRUCTION['instruction']),
+                         json.loads(r.content))
+        r = self.s.get("%s/historian/instructions/h/history/3" % HOST)
+        self.assertEqual(404, r.status_code)
+
+        r = self.s.get("%s/historian/instructions/h/history/2/diff" % HOST)
+        self.assertEqual(200, r.status_code, r.content)
+        self.assertIn({'op': 'replace', 'path': '/load',
+                       'value': 'http://www.example.com/'}, json.loads(r.content))
+
+    def test_search(self):
+        """
+        Search across users by word prefix and tags.
+        """
+        self._signup('seeker')
+        self.s.put("%s/seeker/instructions/property-owner" % HOST,
+                   data=VALID_INSTRUCTION)
+        self.s.put("%s/seeker/instructions/weather" % HOST, data=VALID_INSTRUCTION)
+
+        r = self.s.get("%s/search" % HOST, params={'q': 'prop', 'tags': 'fun'})
+        self.assertEqual(200, r.status_code, r.content)
+        self.assertEqual(['/seeker/instructions/property-owner'],
+                         json.loads(r.content))
+
+    def test_search_next_page_non_ascii(self):
+        """
+        A full page of results for a non-ASCII search links to the next.
+        """
+        self._signup('seeker')
+        for name in ('a', 'b'):
+            self.s.put("%s/seeker/instructions/%s" % (HOST, name), data={
+                'instruction': LOAD_GOOGLE,
+                'tags': '["caf\\u00e9"]'
+            })
+
+        r = self.s.get("%s/search" % HOST,
+                       params={'tags': u'caf\xe9', 'limit': 1})
+        self.assertEqual(200, r.status_code, r.content)
+        self.assertIn('tags=caf%C3%A9', r.headers['Link'])
+
+    def test_metrics(self):
+        """
+        Request latencies are exposed to Prometheus.
+        """
+        self.s.get("%s/search?q=x" % HOST)
+        r = self.s.get("%s/metrics" % HOST)
+        self.assertEqual(200, r.status_code)
+        self.assertIn('caustic_request_seconds_count{handler="SearchHandler",'
+                      'method="GET"}', r.content)
+        self.assertIn('caustic_db_seconds_count{cls="Instructions",'
+                      'method="search"}', r.content)
+
+    def test_profiles_need_token(self):
+        """
+        Profiles of slow requests can't be read without a token.
+        """
+        r = self.s.get("%s/profiles" % HOST)
+        self.assertEqual(403, r.status_code)
+
+    def test_search_is_reserved(self):
+        r = self._signup('search')
+        self.assertEqual(400, r.status_code, r.content)
+
     def test_get_nonexistent_tag(self):
         """
         Get instructions for nonexistent tag.  Returns an empty array.
@@ -313,22 +541,22 @@ class TestServerJSON(unittest.TestCase):
         self.assertEqual(200, r.status_code, r.content)
         self.assertJsonEqual('[]', r.content)
 
-    def xtest_clone_instruction(self):
+    def test_clone_instruction(self):
         """
         One user clones another user's instruction.  Should keep JSON and tags.
         """
         self._signup('muddy')
         self.s.put("%s/muddy/instructions/delta-blues" % HOST, data={
-            'instruction': LOAD_GOOGLE
+            'instruction': LOAD_GOOGLE,
+            'tags': '["guitar"]'
         })
-        self.s.put("%s/muddy/instructions/delta-blues/tags/guitar" % HOST)
         self._logout()
 
         self._signup('crapton')
         r = self.s.post("%s/crapton/instructions/" % HOST, data={
             'clone': '/muddy/instructions/delta-blues'
         })
-        self.assertEqual(201, r.status_code)
+        self.assertEqual(201, r.status_code, r.content)
         self.assertEqual('/crapton/instructions/delta-blues', r.headers['Location'])
 
         r = self.s.get("%s/crapton/instructions/delta-blues" % HOST)
@@ -339,6 +567,35 @@ class TestServerJSON(unittest.TestCase):
         self.assertEqual(200, r.status_code)
         self.assertEqual(["/crapton/instructions/delta-blues"], json.loads(r.content))
 
+        r = self.s.post("%s/crapton/instructions/" % HOST, data={
+            'clone': '/muddy/instructions/delta-blues'
+        })
+        self.assertEqual(409, r.status_code)
+
+    def test_clone_into_others_instructions(self):
+        """
+        Users can only clone into their own instructions.
+        """
+        self._signup('muddy')
+        self.s.put("%s/muddy/instructions/delta-blues" % HOST, data={
+            'instruction': LOAD_GOOGLE
+        })
+        self._logout()
+
+        r = self.s.post("%s/muddy/instructions/" % HOST, data={
+            'clone': '/muddy/instructions/delta-blues'
+        })
+        self.assertEqual(403, r.status_code, r.content)
+
+        self._signup('crapton')
+        r = self.s.post("%s/muddy/instructions/" % HOST, data={
+            'clone': '/muddy/instructions/delta-blues'
+        })
+        self.assertEqual(403, r.status_code, r.content)
+
+        r = self.s.get("%s/crapton/instructions/delta-blues" % HOST)
+        self.assertEqual(404, r.status_code)
+
     def xtest_pull_instruction(self):
         """
         One user pulls another user's instruction after cloning it.
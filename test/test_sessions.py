@@ -0,0 +1,55 @@
+"""
+Test caustic/sessions.py .
+"""
+
+import unittest
+from caustic.sessions import SessionTokens, Session
+
+
+class User(object):
+
+    def __init__(self, id, name):
+        self.id = id
+        self.name = name
+
+
+class Clock(object):
+
+    def __init__(self):
+        self.now = 1000
+
+    def __call__(self):
+        return self.now
+
+
+class TestSessionTokens(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.tokens = SessionTokens('secret', max_age=60, clock=self.clock)
+        self.user = User('4f2ab1', 'joe')
+
+    def test_round_trip(self):
+        token = self.tokens.issue(self.user, 3)
+        self.assertEqual(Session('4f2ab1', 'joe', 1000, 3),
+                         self.tokens.read(token))
+
+    def test_tampered(self):
+        token = self.tokens.issue(self.user)
+        payload, signature = token.split('.')
+        forged = SessionTokens('other', clock=self.clock).issue(
+            User('4f2ab1', 'admin'))
+        self.assertIsNone(self.tokens.read(forged))
+        self.assertIsNone(self.tokens.read(forged.split('.')[0] + '.' + signature))
+        self.assertIsNone(self.tokens.read(payload + '.' + signature[:-1]))
+
+    def test_malformed(self):
+        for token in [None, '', 'abc', 'a.b.c', u'\xe9.\xe9', '!sig?msg']:
+            self.assertIsNone(self.tokens.read(token))
+
+    def test_expires(self):
+        token = self.tokens.issue(self.user)
+        self.clock.now += 60
+        self.assertIsNotNone(self.tokens.read(token))
+        self.clock.now += 1
+        self.assertIsNone(self.tokens.read(token))
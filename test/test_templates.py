@@ -0,0 +1,46 @@
+"""
+Test caustic/templates.py .
+"""
+
+import os
+import shutil
+import unittest
+import pystache
+from caustic.templates import CompiledTemplates
+
+TEMPLATE_DIR = 'tmp_templates'
+
+
+class TestCompiledTemplates(unittest.TestCase):
+
+    def setUp(self):
+        os.mkdir(TEMPLATE_DIR)
+        with open(os.path.join(TEMPLATE_DIR, 'hello.mustache'), 'w') as f:
+            f.write('Hello {{name}}!')
+        self.renderer = pystache.Renderer(search_dirs=[TEMPLATE_DIR])
+        self.templates = CompiledTemplates(self.renderer, TEMPLATE_DIR, 10)
+
+    def tearDown(self):
+        shutil.rmtree(TEMPLATE_DIR)
+
+    def test_parsed_at_startup(self):
+        os.remove(os.path.join(TEMPLATE_DIR, 'hello.mustache'))
+        self.assertEqual('Hello joe!', self.templates.render('hello', {'name': 'joe'}))
+
+    def test_cached_by_context(self):
+        self.templates.render('hello', {'name': 'joe'})
+        self.templates.parsed['hello'] = pystache.parse(u'Bye {{name}}')
+        self.assertEqual('Hello joe!', self.templates.render('hello', {'name': 'joe'}))
+        self.assertEqual('Bye ann', self.templates.render('hello', {'name': 'ann'}))
+
+    def test_clear(self):
+        self.templates.render('hello', {'name': 'joe'})
+        self.templates.parsed['hello'] = pystache.parse(u'Bye {{name}}')
+        self.templates.clear(None, False)
+        self.assertEqual('Bye joe', self.templates.render('hello', {'name': 'joe'}))
+
+    def test_uncached(self):
+        templates = CompiledTemplates(self.renderer, TEMPLATE_DIR)
+        templates.render('hello', {'name': 'joe'})
+        templates.parsed['hello'] = pystache.parse(u'Bye {{name}}')
+        self.assertEqual('Bye joe', templates.render('hello', {'name': 'joe'}))
@@ -0,0 +1,93 @@
+"""
+Test caustic/validator.py .
+"""
+
+import unittest
+import validictory
+from caustic import schema
+from caustic.validator import INSTRUCTION, FIND, LOAD, InstructionError, \
+                              validate_instruction
+
+FIND_PROPERTY = {'find': 'prop', 'then': ['/dos-corpsearch',
+                                          {'find': 'lot', 'match': 0}]}
+LOAD_PROPERTY = {'load': 'http://www.google.com/', 'method': 'post',
+                 'posts': {'FBORO': '1', 'FAPTNUM': ''},
+                 'then': [FIND_PROPERTY, '/acris-index-all-docs']}
+
+VALID = ['foo', [], ['foo', 'bar'], {'load': 'google.com'}, {'find': '.*'},
+         FIND_PROPERTY, LOAD_PROPERTY,
+         {'find': 'x', 'then': {'load': 'y', 'then': {'find': 'z'}}}]
+
+INVALID = [7, None, '', [7], [['nested']], {'foo': 'bar'},
+           {'load': ''}, {'load': 7}, {'load': 'x', 'method': 'put'},
+           {'find': 'x', 'method': 'get'}, {'load': 'x', 'find': 'y'},
+           {'find': 'x', 'match': '0'}, {'find': 'x', 'then': 7},
+           {'find': 'x', 'then': ['ok', {'load': 'x', 'then': {}}]},
+           {'load': 'x', 'then': [{'find': 'y', 'case_insensitive': 1}]}]
+
+
+def _validictory_error(value, s):
+    try:
+        validictory.validate(value, s)
+    except ValueError as e:
+        return str(e)
+
+
+class TestCompiledSchema(unittest.TestCase):
+
+    def test_accepts_what_validictory_accepts(self):
+        """Compiled schemas agree with validictory on every value.
+        """
+        for compiled in [INSTRUCTION, FIND, LOAD]:
+            for value in VALID + INVALID:
+                expected = _validictory_error(value, compiled.schema)
+                self.assertEqual(expected is None, compiled.is_valid(value),
+                                 value)
+
+    def test_same_messages(self):
+        """Compiled schemas fail with validictory's messages.
+        """
+        for compiled in [INSTRUCTION, FIND, LOAD]:
+            for value in INVALID:
+                expected = _validictory_error(value, compiled.schema)
+                try:
+                    compiled.validate(value)
+                    actual = None
+                except ValueError as e:
+                    actual = str(e)
+                self.assertEqual(expected, actual, value)
+
+
+class TestValidateInstruction(unittest.TestCase):
+
+    def test_valid(self):
+        for valid in VALID:
+            self.assertIsNone(validate_instruction(valid))
+
+    def test_invalid(self):
+        for invalid in INVALID:
+            with self.assertRaises(InstructionError):
+                validate_instruction(invalid)
+
+    def test_reports_branches(self):
+        """Dict instructions report both branches.
+        """
+        with self.assertRaises(InstructionError) as cm:
+            validate_instruction({'foo': 'bar'})
+        self.assertEqual(['find', 'load'], cm.exception.branches)
+
+    def test_same_text_as_three_passes(self):
+        """Error text is what the three validictory passes produced.
+        """
+        for invalid in INVALID:
+            errors = []
+            for s in [schema.FIND, schema.LOAD]:
+                try:
+                    validictory.validate(invalid, s)
+                except ValueError as e:
+                    errors.append(e)
+            try:
+                validate_instruction(invalid)
+            except InstructionError as e:
+                self.assertEqual(repr(errors), repr([err for _, err in e.errors]))
+                self.assertEqual("Invalid Instruction: %s" % errors, str(e))
@@ -0,0 +1,60 @@
+"""
+Test caustic/workers.py .
+"""
+
+import os
+import time
+import shutil
+import unittest
+import threading
+from caustic.workers import Supervisor
+
+WORK_DIR = 'tmp_workers'
+
+
+def work(index):
+    """Record a start, then crash on the first start of worker 0, and wait
+    to be stopped otherwise.
+    """
+    starts = os.path.join(WORK_DIR, str(index))
+    with open(starts, 'a') as f:
+        f.write('.')
+    if index == 0 and os.path.getsize(starts) == 1:
+        raise Exception('Crash')
+    while True:
+        time.sleep(0.01)
+
+
+class TestSupervisor(unittest.TestCase):
+
+    def setUp(self):
+        os.mkdir(WORK_DIR)
+        self.supervisor = Supervisor(work, 2, restart_delay=0,
+                                     shutdown_timeout=2)
+        self.thread = threading.Thread(target=self.supervisor.run,
+                                       args=(False,))
+        self.thread.start()
+
+    def tearDown(self):
+        self.supervisor.stop()
+        self.thread.join(5)
+        shutil.rmtree(WORK_DIR)
+
+    def starts(self, index):
+        path = os.path.join(WORK_DIR, str(index))
+        return os.path.getsize(path) if os.path.exists(path) else 0
+
+    def test_restarts_crashed_worker(self):
+        deadline = time.time() + 5
+        while self.starts(0) < 2 and time.time() < deadline:
+            time.sleep(0.05)
+        self.assertEqual(2, self.starts(0))
+        self.assertEqual(1, self.starts(1))
+
+    def test_stop(self):
+        while len(self.supervisor.children) < 2:
+            time.sleep(0.01)
+        self.supervisor.stop()
+        self.thread.join(5)
+        self.assertFalse(self.thread.is_alive())
+        self.assertEqual({}, self.supervisor.children)